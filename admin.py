@@ -1,7 +1,75 @@
+import atexit
 import os
+import tempfile
+from datetime import datetime, time, timedelta
 import streamlit as st
+import auth
 import database  # Import database functions
-import pandas as pd
+import analytics_rollups
+import catalog_cache
+from labels import CLASS_NAMES
+
+PAGE_SIZE = 50
+
+
+# pandas is imported by the first page that builds a table, not at app start
+def to_frame(rows):
+    import pandas as pd
+    return pd.DataFrame(rows)
+
+
+# Pagination: a stack of keyset cursors per page, reset whenever the filters change
+def pagination_state(key, filters):
+    state = st.session_state.setdefault(f"{key}_pagination", {"filters": None, "cursors": [None]})
+    if state["filters"] != filters:
+        state["filters"] = filters
+        state["cursors"] = [None]
+    return state
+
+
+def page_controls(key, state, next_after):
+    st.caption(f"Page {len(state['cursors'])}")
+    prev_col, next_col = st.columns(2)
+    if prev_col.button("⬅️ Previous", key=f"{key}_prev", disabled=len(state["cursors"]) == 1):
+        state["cursors"].pop()
+        st.experimental_rerun()
+    if next_col.button("Next ➡️", key=f"{key}_next", disabled=next_after is None):
+        state["cursors"].append(next_after)
+        st.experimental_rerun()
+
+
+def date_range_filter(key):
+    dates = st.date_input("Date range", value=(), key=f"{key}_dates")
+    start = datetime.combine(dates[0], time.min) if len(dates) > 0 else None
+    end = datetime.combine(dates[1], time.min) + timedelta(days=1) if len(dates) > 1 else None
+    return start, end
+
+
+def _remove_export(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# Streamed export: rows are written to a temporary CSV in chunks and the download is served from that file,
+# so the export is never held in session state. The file belongs to the filters it was made for and is
+# removed when they change, when it is replaced, or at process exit.
+def export_button(key, label, rows_fn, columns, filters):
+    export = st.session_state.get(f"{key}_export")
+    if export is not None and export["filters"] != filters:
+        _remove_export(export["path"])
+        export = st.session_state[f"{key}_export"] = None
+    if st.button(label, key=f"{key}_export_button"):
+        if export is not None:
+            _remove_export(export["path"])
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as f:
+            path = f.name
+        atexit.register(_remove_export, path)
+        count = database.export_csv(rows_fn(), path, columns)
+        export = st.session_state[f"{key}_export"] = {"filters": filters, "path": path}
+        st.success(f"Exported {count} rows.")
+    if export is not None and os.path.exists(export["path"]):
+        with open(export["path"], "rb") as f:
+            st.download_button("⬇️ Download CSV", f, file_name=f"{key}.csv", mime="text/csv", key=f"{key}_download")
 
 st.title("Admin Panel - Plant Disease Detection")
 
@@ -10,6 +78,13 @@ if "admin_logged_in" not in st.session_state:
 if "admin_username" not in st.session_state:
     st.session_state["admin_username"] = None
 
+# Reruns check the signed session token instead of re-running bcrypt; expired tokens log out
+if st.session_state["admin_logged_in"] and \
+        auth.verify_token(st.session_state.get("admin_session_token")) != f"admin:{st.session_state['admin_username']}":
+    st.session_state["admin_logged_in"] = False
+    st.session_state["admin_username"] = None
+    st.session_state.pop("admin_session_token", None)
+
 admin_exists = database.admin_collection.count_documents({}) > 0
 
 if st.session_state["admin_logged_in"]:
@@ -42,18 +117,26 @@ if admin_mode == "Admin Login":
     admin_password = st.text_input("Admin Password", type="password", key="admin_password_input")
 
     if st.button("Login as Admin"):
-        if database.login_admin(admin_username, admin_password):
-            st.session_state['admin_logged_in'] = True
-            st.session_state['admin_username'] = admin_username
-            st.success("Admin Login Successful!")
-            st.experimental_rerun()
+        client_id = auth.client_id_from_headers(getattr(getattr(st, "context", None), "headers", None))
+        try:
+            logged_in = database.login_admin(admin_username, admin_password, client_id)
+        except (auth.RateLimitExceeded, auth.AuthBusy) as e:
+            st.warning(str(e))
         else:
-            st.error("Invalid Admin Credentials")
+            if logged_in:
+                st.session_state['admin_logged_in'] = True
+                st.session_state['admin_username'] = admin_username
+                st.session_state['admin_session_token'] = auth.issue_token(f"admin:{admin_username}")
+                st.success("Admin Login Successful!")
+                st.experimental_rerun()
+            else:
+                st.error("Invalid Admin Credentials")
 
 if st.session_state["admin_logged_in"]:
     if st.sidebar.button("Logout"):
         st.session_state["admin_logged_in"] = False
         st.session_state["admin_username"] = None
+        st.session_state.pop("admin_session_token", None)
         st.experimental_rerun()
 
     if admin_mode == "Dashboard":
@@ -61,14 +144,55 @@ if st.session_state["admin_logged_in"]:
         st.subheader("Admin Dashboard")
         st.write("📊 Here you can manage users, view orders, and monitor system analytics.")
 
+        # Charts read the precomputed rollups only; a background thread keeps them current
+        analytics_rollups.start_background_updater()
+        days = st.selectbox("Period", [7, 30, 90], index=1, format_func=lambda d: f"Last {d} days")
+        since = datetime.combine(datetime.now().date() - timedelta(days=days - 1), time.min)
+
+        predictions = to_frame(analytics_rollups.get_rollups("predictions_by_disease", "day", since))
+        if not predictions.empty:
+            st.subheader("Predictions per Day")
+            st.line_chart(predictions.groupby("bucket")["count"].sum())
+            st.subheader("Most Detected Diseases")
+            st.bar_chart(predictions.groupby("key")["count"].sum().nlargest(10))
+        else:
+            st.info("No prediction analytics yet.")
+
+        users = to_frame(analytics_rollups.get_rollups("predictions_by_user", "day", since))
+        if not users.empty:
+            st.subheader("Most Active Users")
+            st.bar_chart(users.groupby("key")["count"].sum().nlargest(10))
+
+        sales = to_frame(analytics_rollups.get_rollups("supplement_sales", "day", since))
+        if not sales.empty:
+            st.subheader("Supplement Revenue")
+            st.bar_chart(sales.groupby("key")["revenue"].sum().sort_values(ascending=False))
+            st.subheader("Units Sold")
+            st.bar_chart(sales.groupby("key")["units"].sum().sort_values(ascending=False))
+
+        latency = to_frame(analytics_rollups.get_rollups("latency_ms", "day", since))
+        if not latency.empty:
+            st.subheader("Prediction Latency (ms)")
+            buckets = [f"le_{edge}" for edge in analytics_rollups.LATENCY_BUCKETS_MS] + ["le_inf"]
+            histogram = latency.reindex(columns=buckets).fillna(0).sum()
+            histogram.index = [b.replace("le_", "≤ ") for b in buckets]
+            st.bar_chart(histogram)
+            st.write(f"Average: {latency['sum_ms'].sum() / latency['count'].sum():.1f} ms")
+
+        updated = analytics_rollups.last_updated()
+        st.caption(f"Analytics updated: {updated.strftime('%Y-%m-%d %H:%M:%S') if updated else 'never'}")
+
     elif admin_mode == "Manage Users":
         st.header("Manage Users")
-        users = database.users_collection.find({}, {"_id": 0, "username": 1})
-        users_list = list(users)
+        prefix = st.text_input("Search username (prefix)")
+        state = pagination_state("users", (prefix,))
+        users_list, next_after = database.get_users_page(prefix=prefix or None, after=state["cursors"][-1],
+                                                         limit=PAGE_SIZE)
 
         if users_list:
-            df = pd.DataFrame(users_list)
+            df = to_frame(users_list)
             st.dataframe(df)
+            page_controls("users", state, next_after)
             selected_user = st.selectbox("Select a user to remove:", [user["username"] for user in users_list])
 
             if st.button("Delete User"):
@@ -80,12 +204,23 @@ if st.session_state["admin_logged_in"]:
 
     elif admin_mode == "View Logs":
         st.header("User Prediction Logs")
-        logs = database.prediction_logs.find({}, {"_id": 0, "username": 1, "image_name": 1, "disease_name": 1})
-        logs_list = list(logs)
+        start, end = date_range_filter("logs")
+        username = st.text_input("Username") or None
+        disease_name = st.selectbox("Disease", ["All"] + CLASS_NAMES)
+        disease_name = None if disease_name == "All" else disease_name
+        filters = {"start": start, "end": end, "username": username, "disease_name": disease_name}
+
+        state = pagination_state("logs", tuple(filters.values()))
+        logs_list, next_after = database.get_prediction_logs_page(**filters, after=state["cursors"][-1],
+                                                                  limit=PAGE_SIZE)
 
         if logs_list:
-            df = pd.DataFrame(logs_list)
+            df = to_frame(logs_list).drop(columns=["_id"])
             st.dataframe(df)
+            page_controls("logs", state, next_after)
+            export_button("prediction_logs", "Export matching logs",
+                          lambda: database.iter_prediction_logs(**filters),
+                          ["username", "image_name", "disease_name", "timestamp"], tuple(filters.values()))
         else:
             st.info("No prediction logs found.")
 
@@ -99,23 +234,21 @@ if st.session_state["admin_logged_in"]:
         if st.button("Add Supplement"):
             if supplement_name and supplement_description and supplement_price > 0:
                 image_url = None
+                thumbnail_url = None
                 if supplement_image:
-                    upload_folder = "uploads"
-                    os.makedirs(upload_folder, exist_ok=True)
-                    image_path = os.path.join(upload_folder, supplement_image.name)
-                    with open(image_path, "wb") as f:
-                        f.write(supplement_image.read())
-                    image_url = image_path
-
-                database.add_supplement(supplement_name, supplement_description, supplement_price, image_url)
+                    image_url, thumbnail_url = catalog_cache.save_upload(supplement_image.read(),
+                                                                         supplement_image.name)
+
+                database.add_supplement(supplement_name, supplement_description, supplement_price, image_url,
+                                        thumbnail_url)
                 st.success(f"Supplement '{supplement_name}' added successfully!")
             else:
                 st.error("Please fill in all fields with valid values.")
 
         st.subheader("Existing Supplements")
-        supplements = list(database.get_all_supplements())
+        supplements = list(catalog_cache.get_supplements())
         if supplements:
-            df = pd.DataFrame(supplements)
+            df = to_frame(supplements)
             st.dataframe(df)
 
             selected_supplement = st.selectbox("Select a supplement to delete:", [supp["name"] for supp in supplements])
@@ -129,21 +262,19 @@ if st.session_state["admin_logged_in"]:
 
     elif admin_mode == "View Orders":
         st.header("User Orders")
-        orders = database.get_all_orders()
-        if orders:
-            orders_data = []
-            for order in orders:
-                for item in order["items"]:
-                    orders_data.append({
-                        "Username": order["username"],
-                        "Supplement Name": item["supplement_name"],
-                        "Quantity": item["quantity"],
-                        "Price": item["price"],
-                        "Total Price": order.get("total_price", 0.0),
-                        "Order Date": order["order_date"].strftime('%Y-%m-%d %H:%M:%S')
-                    })
-            df = pd.DataFrame(orders_data)
+        start, end = date_range_filter("orders")
+        username = st.text_input("Username") or None
+        filters = {"start": start, "end": end, "username": username}
+
+        state = pagination_state("orders", tuple(filters.values()))
+        orders_data, next_after = database.get_order_rows_page(**filters, after=state["cursors"][-1],
+                                                               limit=PAGE_SIZE)
+        if orders_data:
+            df = to_frame(orders_data)
             st.dataframe(df)
+            page_controls("orders", state, next_after)
+            export_button("orders", "Export matching orders", lambda: database.iter_order_rows(**filters),
+                          ["Username", "Supplement Name", "Quantity", "Price", "Total Price", "Order Date"],
+                          tuple(filters.values()))
         else:
             st.info("No orders found.")
-
@@ -0,0 +1,208 @@
+# analytics_rollups.py
+
+import argparse
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+import db_client
+
+# Rollup Settings
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "5000"))
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))  # seconds between background updates
+# Logs are written asynchronously, so only documents inserted longer ago than this lag are rolled up
+ROLLUP_LAG_SECONDS = float(os.getenv("ROLLUP_LAG_SECONDS", "120"))
+
+ROLLUPS = "analytics_rollups"
+ROLLUP_STATE = "analytics_rollup_state"
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+def _truncate(ts, granularity):
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def latency_bucket(latency_ms):
+    for edge in LATENCY_BUCKETS_MS:
+        if latency_ms <= edge:
+            return f"le_{edge}"
+    return "le_inf"
+
+
+# Increments are accumulated per rollup document in memory, then applied with one bulk_write. Each rollup
+# document remembers the last batch of every source applied to it, so replaying a batch after a crash skips
+# the documents it already reached instead of counting them twice.
+class _Increments:
+    def __init__(self):
+        self.docs = defaultdict(lambda: defaultdict(int))
+
+    def add(self, metric, granularity, bucket, key, **fields):
+        doc = self.docs[(metric, granularity, bucket, key)]
+        for field, value in fields.items():
+            doc[field] += value
+
+    def apply(self, collection, source, batch_id):
+        if not self.docs:
+            return 0
+        marker = f"applied.{source}"
+        operations = [
+            UpdateOne({"metric": metric, "granularity": granularity, "bucket": bucket, "key": key,
+                       marker: {"$ne": batch_id}},
+                      {"$inc": dict(fields), "$set": {marker: batch_id}}, upsert=True)
+            for (metric, granularity, bucket, key), fields in self.docs.items()
+        ]
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Already applied: the filter misses the existing document and the upsert hits the unique index
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        return len(operations)
+
+
+def _add_prediction(increments, log):
+    ts = log["timestamp"]
+    for granularity in ("hour", "day"):
+        increments.add("predictions_by_disease", granularity, _truncate(ts, granularity),
+                       log.get("disease_name") or "unknown", count=1)
+    day = _truncate(ts, "day")
+    increments.add("predictions_by_user", "day", day, log.get("username") or "Guest", count=1)
+    if log.get("latency_ms") is not None:
+        increments.add("latency_ms", "day", day, "all", **{latency_bucket(log["latency_ms"]): 1,
+                                                           "count": 1, "sum_ms": log["latency_ms"]})
+
+
+def _add_order(increments, order):
+    day = _truncate(order["order_date"], "day")
+    increments.add("orders", "day", day, "all", count=1, revenue=order.get("total_price", 0.0))
+    for item in order.get("items", []):
+        increments.add("supplement_sales", "day", day, item["supplement_name"],
+                       units=item["quantity"], revenue=item["price"] * item["quantity"])
+
+
+# Source collection -> handler; the time field only picks the bucket, progress follows _id (insertion order)
+SOURCES = {
+    "prediction_logs": _add_prediction,
+    "orders": _add_order,
+}
+
+
+def _state(db, source):
+    return db[ROLLUP_STATE].find_one({"_id": source}) or {}
+
+
+# Update: roll up documents inserted after the source's high-water mark, in _id order. Late arrivals (e.g.
+# replayed spill files) carry fresh _ids, so they are picked up even when their timestamp is old. The batch
+# end is recorded before its increments are applied and only becomes the mark afterwards; a crash in between
+# replays exactly that batch on the next run.
+def update_source(db, source, until=None, batch_size=ROLLUP_BATCH_SIZE):
+    add = SOURCES[source]
+    until = until or datetime.now(timezone.utc) - timedelta(seconds=ROLLUP_LAG_SECONDS)
+    state = _state(db, source)
+    processed = 0
+    while True:
+        pending = state.get("pending_id")
+        query = {"_id": {"$lte": pending} if pending is not None else {"$lt": ObjectId.from_datetime(until)}}
+        if state.get("hwm_id") is not None:
+            query["_id"]["$gt"] = state["hwm_id"]
+        cursor = db[source].find(query).sort("_id", ASCENDING)
+        docs = list(cursor if pending is not None else cursor.limit(batch_size))
+        if pending is None:
+            if not docs:
+                return processed
+            pending = docs[-1]["_id"]
+            db[ROLLUP_STATE].update_one({"_id": source}, {"$set": {"pending_id": pending}}, upsert=True)
+        increments = _Increments()
+        for doc in docs:
+            add(increments, doc)
+        increments.apply(db[ROLLUPS], source, pending)
+        state = {"hwm_id": pending, "pending_id": None}
+        db[ROLLUP_STATE].update_one({"_id": source}, {"$set": dict(state, updated_at=datetime.now())},
+                                    upsert=True)
+        processed += len(docs)
+
+
+def update_all(db=None):
+    db = db if db is not None else db_client.get_db()
+    return {source: update_source(db, source) for source in SOURCES}
+
+
+# Backfill: drop the rollups and rebuild them from the full history
+def backfill(db=None):
+    db = db if db is not None else db_client.get_db()
+    db[ROLLUPS].delete_many({})
+    db[ROLLUP_STATE].delete_many({})
+    return update_all(db)
+
+
+# Follow: update continuously; a change stream (replica sets only) wakes the loop early on inserts
+def follow(interval=ROLLUP_INTERVAL, stop_event=None):
+    stop_event = stop_event or threading.Event()
+    db = db_client.get_db()
+    while not stop_event.is_set():
+        try:
+            update_all(db)
+        except PyMongoError as e:
+            print(f"Rollup update failed: {e}")
+        try:
+            with db["prediction_logs"].watch([{"$match": {"operationType": "insert"}}],
+                                             max_await_time_ms=int(interval * 1000)) as stream:
+                stream.try_next()
+            # Let the new document age past the lag before the next pass picks it up
+            stop_event.wait(min(interval, ROLLUP_LAG_SECONDS))
+        except Exception:
+            stop_event.wait(interval)
+
+
+_updater = None
+_updater_lock = threading.Lock()
+
+
+def start_background_updater(interval=ROLLUP_INTERVAL):
+    global _updater
+    with _updater_lock:
+        if _updater is None:
+            _updater = threading.Thread(target=follow, args=(interval,), name="analytics-rollups", daemon=True)
+            _updater.start()
+    return _updater
+
+
+# Dashboard Queries: read only the small rollup collection
+def get_rollups(metric, granularity="day", since=None, db=None):
+    db = db if db is not None else db_client.get_db()
+    query = {"metric": metric, "granularity": granularity}
+    if since is not None:
+        query["bucket"] = {"$gte": since}
+    return list(db[ROLLUPS].find(query, {"_id": 0, "metric": 0, "granularity": 0, "applied": 0}).sort("bucket", ASCENDING))
+
+
+def last_updated(db=None):
+    db = db if db is not None else db_client.get_db()
+    states = list(db[ROLLUP_STATE].find({}, {"updated_at": 1}))
+    return max((s["updated_at"] for s in states if "updated_at" in s), default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain analytics rollups for the admin dashboard.")
+    parser.add_argument("command", choices=["update", "backfill", "follow"])
+    parser.add_argument("--interval", type=float, default=ROLLUP_INTERVAL)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "follow":
+        follow(args.interval)
+        return
+    counts = backfill() if args.command == "backfill" else update_all()
+    print(f"Rolled up {counts} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
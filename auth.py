@@ -0,0 +1,190 @@
+# auth.py
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import bcrypt
+
+import metrics
+
+# Auth Settings
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", "32"))  # queued + running hashes before rejecting
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", "10"))  # seconds
+LOGIN_BURST = float(os.getenv("LOGIN_BURST", "5"))  # attempts allowed back to back
+LOGIN_RATE = float(os.getenv("LOGIN_RATE", "0.2"))  # attempts refilled per second
+SESSION_TTL = int(os.getenv("SESSION_TTL", "43200"))  # seconds
+# Without SESSION_SECRET tokens are only valid within this process
+SESSION_SECRET = (os.getenv("SESSION_SECRET") or base64.b64encode(os.urandom(32)).decode()).encode()
+
+
+class AuthBusy(Exception):
+    pass
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+# Hash Pool: bcrypt releases the GIL, so a small dedicated pool keeps hashing off the script thread
+# while bounding how much CPU a login burst can take from inference and page rendering
+_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="auth-hash")
+_pending = threading.BoundedSemaphore(AUTH_MAX_PENDING)
+_stats_lock = threading.Lock()
+_stats = {"hashes": 0, "checks": 0, "hash_ms_total": 0.0, "queue_ms_total": 0.0, "queue_ms_max": 0.0,
+          "rejected_busy": 0, "timed_out": 0, "rate_limited": 0, "rehashed": 0}
+_started = time.monotonic()
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def _run(kind, fn, *args):
+    if not _pending.acquire(blocking=False):
+        _count("rejected_busy")
+        raise AuthBusy("Too many logins in progress. Please try again in a moment.")
+    submitted = time.perf_counter()
+
+    def task():
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            metrics.observe("app_auth_hash_seconds", finished - started, kind=kind)
+            metrics.observe("app_auth_queue_seconds", started - submitted)
+            with _stats_lock:
+                _stats[kind] += 1
+                _stats["hash_ms_total"] += (finished - started) * 1000.0
+                queue_ms = (started - submitted) * 1000.0
+                _stats["queue_ms_total"] += queue_ms
+                _stats["queue_ms_max"] = max(_stats["queue_ms_max"], queue_ms)
+
+    try:
+        future = _executor.submit(task)
+    except BaseException:
+        _pending.release()
+        raise
+    # The slot is held until the hash actually finishes, not just until this caller stops waiting
+    future.add_done_callback(lambda _: _pending.release())
+    try:
+        return future.result(timeout=AUTH_TIMEOUT)
+    except FutureTimeoutError:
+        _count("timed_out")
+        raise AuthBusy("Login is taking longer than usual. Please try again in a moment.")
+
+
+def hash_password(password, rounds=BCRYPT_ROUNDS):
+    hashed = _run("hashes", lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)))
+    return hashed.decode('utf-8')
+
+
+def hash_rounds(hashed):
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# Check Password: returns (matches, new_hash); new_hash is set when the stored work factor is outdated
+def check_password(password, hashed):
+    matches = _run("checks", lambda: bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8')))
+    if matches and hash_rounds(hashed) != BCRYPT_ROUNDS:
+        try:
+            new_hash = hash_password(password)
+        except AuthBusy:
+            # The password matched; the upgrade is opportunistic and waits for a quieter login
+            return True, None
+        _count("rehashed")
+        return True, new_hash
+    return matches, None
+
+
+# Token Bucket Limiter keyed by username and client address
+class TokenBucketLimiter:
+    def __init__(self, burst=LOGIN_BURST, rate=LOGIN_RATE, max_keys=100000):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._evict(now)
+            return allowed
+
+    # Full buckets carry no state worth keeping
+    def _evict(self, now):
+        full_after = self.burst / self.rate if self.rate else float("inf")
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated > full_after]:
+            del self._buckets[key]
+
+
+login_limiter = TokenBucketLimiter()
+
+
+# Client address from request headers (st.context.headers on newer Streamlit); None when unavailable
+def client_id_from_headers(headers):
+    if not headers:
+        return None
+    forwarded = headers.get("X-Forwarded-For") or headers.get("X-Real-Ip") or ""
+    return forwarded.split(",")[0].strip() or None
+
+
+def check_rate_limit(username, client_id=None):
+    keys = [f"user:{username}"] + ([f"client:{client_id}"] if client_id else [])
+    # Evaluate every key so a throttled client also drains the user's bucket
+    allowed = all([login_limiter.allow(key) for key in keys])
+    if not allowed:
+        _count("rate_limited")
+        raise RateLimitExceeded("Too many login attempts. Please wait a minute and try again.")
+
+
+# Session Tokens: HMAC-signed "username|expiry" so reruns are validated without bcrypt
+def _sign(payload):
+    return hmac.new(SESSION_SECRET, payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def issue_token(username, ttl=SESSION_TTL):
+    payload = f"{username}|{int(time.time()) + ttl}"
+    return base64.urlsafe_b64encode(f"{payload}|{_sign(payload)}".encode('utf-8')).decode('ascii')
+
+
+def verify_token(token):
+    try:
+        username, expires, signature = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8').rsplit("|", 2)
+    except (ValueError, UnicodeDecodeError, AttributeError):
+        return None
+    if not hmac.compare_digest(signature, _sign(f"{username}|{expires}")) or int(expires) < time.time():
+        return None
+    return username
+
+
+# Hashing throughput and queue time
+def stats():
+    with _stats_lock:
+        s = dict(_stats)
+    operations = s["hashes"] + s["checks"]
+    s["avg_hash_ms"] = s["hash_ms_total"] / operations if operations else 0.0
+    s["avg_queue_ms"] = s["queue_ms_total"] / operations if operations else 0.0
+    s["operations_per_second"] = operations / max(time.monotonic() - _started, 1e-9)
+    s["bcrypt_rounds"] = BCRYPT_ROUNDS
+    s["workers"] = AUTH_HASH_WORKERS
+    return s
@@ -0,0 +1,301 @@
+# benchmark.py
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+# Benchmark Images: on-disk photos (e.g. test/test) or synthetic JPEGs at phone-camera size
+def load_image_bytes(images_dir, limit):
+    images = []
+    for root, _, files in os.walk(images_dir):
+        for file_name in sorted(files):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(root, file_name), "rb") as f:
+                    images.append(f.read())
+                if len(images) >= limit:
+                    return images
+    return images
+
+
+def synthetic_image_bytes(count, width, height, seed=0):
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        # Smooth gradients plus noise compress like a real photo rather than pure noise
+        base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        pixels = (base + rng.normal(0, 20, (height, width, 3))).clip(0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def percentiles(timings_ms):
+    if not timings_ms:
+        return {}
+    values = np.asarray(timings_ms)
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+# Single Stream: one image at a time through decode -> resize -> img_to_array -> predict -> argmax -> lookup.
+# The app path instead predicts through prediction.predict_image (the batching engine or inference service)
+# and postprocessing, and also times prediction.predict_probabilities, which answers repeats from the cache.
+def run_single_stream(model, images, iterations, warmup, app_path=False):
+    from labels import CLASS_NAMES
+    from preprocessing import decode_image
+
+    if app_path:
+        import postprocessing
+        import prediction
+
+    stages = {"decode_ms": [], "predict_ms": [], "postprocess_ms": [], "total_ms": []}
+    if app_path:
+        stages["cached_ms"] = []
+    for i in range(warmup + iterations):
+        data = images[i % len(images)]
+        t0 = time.perf_counter()
+        input_arr = decode_image(data)
+        t1 = time.perf_counter()
+        if app_path:
+            probabilities = prediction.predict_image(input_arr)[0]
+            t2 = time.perf_counter()
+            postprocessing.postprocess_rows(probabilities)
+            t3 = time.perf_counter()
+            prediction.predict_probabilities(data)
+            t4 = time.perf_counter()
+        else:
+            probabilities = model.predict(input_arr[np.newaxis])
+            t2 = time.perf_counter()
+            CLASS_NAMES[int(np.argmax(probabilities))]
+            t3 = time.perf_counter()
+        if i < warmup:
+            continue
+        stages["decode_ms"].append((t1 - t0) * 1000.0)
+        stages["predict_ms"].append((t2 - t1) * 1000.0)
+        stages["postprocess_ms"].append((t3 - t2) * 1000.0)
+        stages["total_ms"].append((t3 - t0) * 1000.0)
+        if app_path:
+            stages["cached_ms"].append((t4 - t3) * 1000.0)
+    return {stage: percentiles(values) for stage, values in stages.items()}
+
+
+# Max Throughput: `clients` threads each push full batches through the same path for `duration` seconds.
+# On the app path each client sends one image at a time and the engine does the batching, as it does
+# for concurrent sessions; batch_size only sets how many images a client decodes per round.
+def run_throughput(model, images, batch_size, clients, duration, app_path=False):
+    from preprocessing import decode_image
+
+    if app_path:
+        import postprocessing
+        import prediction
+
+    decoded = [decode_image(data) for data in images[:batch_size]]
+    while len(decoded) < batch_size:
+        decoded.append(decoded[len(decoded) % len(images)])
+    if app_path:
+        prediction.predict_image(decoded[0])
+    else:
+        model.predict(np.stack(decoded))
+
+    counts = [0] * clients
+    batch_timings = [[] for _ in range(clients)]
+    stop_at = time.perf_counter() + duration
+
+    def client(index):
+        offset = index
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            batch = [decode_image(images[(offset + j) % len(images)]) for j in range(batch_size)]
+            if app_path:
+                postprocessing.postprocess_rows(np.stack([prediction.predict_image(image)[0] for image in batch]))
+            else:
+                np.argmax(model.predict(np.stack(batch)), axis=1)
+            batch_timings[index].append((time.perf_counter() - started) * 1000.0)
+            counts[index] += batch_size
+            offset += batch_size
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "images": sum(counts),
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(sum(counts) / elapsed, 2),
+        "batch_latency": percentiles([t for timings in batch_timings for t in timings]),
+    }
+
+
+# One (backend, thread count) configuration; runs in its own process because TF threading
+# can only be configured before the runtime starts. The app path loads the artifact through
+# model_registry, the way the Streamlit pages do.
+def run_configuration(config):
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(config["threads"])
+    tf.config.threading.set_inter_op_parallelism_threads(max(1, config["threads"] // 2))
+    os.environ["TFLITE_THREADS"] = str(config["threads"])
+    app_path = config["mode"] == "app"
+    if app_path:
+        os.environ["MODEL_PATH"] = config["path"]
+        os.environ["MODEL_BACKEND"] = config["backend"]
+
+    import inference_backends
+    import model_registry
+
+    images = config["images"]
+    started = time.perf_counter()
+    if app_path:
+        model = model_registry.get_predictor()
+    else:
+        model = inference_backends.load_backend(config["path"], config["backend"])
+    load_ms = (time.perf_counter() - started) * 1000.0
+
+    result = {
+        "backend": config["backend"],
+        "path": config["path"],
+        "mode": config["mode"],
+        "threads": config["threads"],
+        "image_source": config["image_source"],
+        "model_load_ms": round(load_ms, 1),
+        "single_stream": run_single_stream(model, images, config["iterations"], config["warmup"], app_path),
+        "throughput": [],
+    }
+    for batch_size in config["batch_sizes"]:
+        for clients in config["clients"]:
+            run = run_throughput(model, images, batch_size, clients, config["duration"], app_path)
+            run.update({"batch_size": batch_size, "clients": clients})
+            result["throughput"].append(run)
+    return result
+
+
+def environment_info():
+    info = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        info["git_commit"] = subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except Exception:
+        info["git_commit"] = None
+    return info
+
+
+def _result_key(result):
+    return (result["backend"], result.get("mode", "model"), result["threads"], result["image_source"])
+
+
+# Compare against a previous results file and print the relative change of each measurement
+def compare(previous_path, results):
+    with open(previous_path) as f:
+        previous = {_result_key(r): r for r in json.load(f)["results"]}
+    for result in results:
+        old = previous.get(_result_key(result))
+        if old is None:
+            continue
+        new_p50 = result["single_stream"]["total_ms"]["p50_ms"]
+        old_p50 = old["single_stream"]["total_ms"]["p50_ms"]
+        print(f"{_result_key(result)} single-stream p50: {old_p50} -> {new_p50}ms "
+              f"({(new_p50 - old_p50) / old_p50:+.1%})")
+        old_runs = {(r["batch_size"], r["clients"]): r for r in old["throughput"]}
+        for run in result["throughput"]:
+            old_run = old_runs.get((run["batch_size"], run["clients"]))
+            if old_run:
+                change = (old_run["images_per_second"] - run["images_per_second"]) / old_run["images_per_second"]
+                print(f"    batch={run['batch_size']} clients={run['clients']}: "
+                      f"{old_run['images_per_second']} -> {run['images_per_second']} images/s ({-change:+.1%})")
+
+
+def _csv(value, cast=int):
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the plant disease prediction path on CPU.")
+    parser.add_argument("--artifact", action="append", default=None, metavar="BACKEND=PATH",
+                        help="Model to benchmark, e.g. keras=trained_model.keras (repeatable)")
+    parser.add_argument("--images-dir", default=None, help="Directory of on-disk images, e.g. test/test")
+    parser.add_argument("--synthetic", type=int, default=16, help="Number of synthetic JPEGs to generate")
+    parser.add_argument("--synthetic-size", default="4000x3000", help="Synthetic image WIDTHxHEIGHT")
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--threads", default=str(os.cpu_count() or 1), help="Comma-separated TF thread counts")
+    parser.add_argument("--clients", default="1,4", help="Comma-separated concurrent client counts")
+    parser.add_argument("--mode", default="model",
+                        help="Comma-separated: model (the backend's predict) and/or app (prediction.predict_image "
+                             "through the inference engine or service, the prediction cache and postprocessing)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per throughput run")
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare against")
+    args = parser.parse_args()
+    if not set(_csv(args.mode, str)) <= {"model", "app"}:
+        parser.error("--mode takes model and/or app")
+
+    artifacts = [a.split("=", 1) for a in (args.artifact or ["keras=trained_model.keras"])]
+    image_sets = []
+    if args.images_dir:
+        image_sets.append((f"disk:{args.images_dir}", load_image_bytes(args.images_dir, 256)))
+    if args.synthetic:
+        width, height = (int(v) for v in args.synthetic_size.lower().split("x"))
+        image_sets.append((f"synthetic:{width}x{height}", synthetic_image_bytes(args.synthetic, width, height)))
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for backend, path in artifacts:
+        for mode in _csv(args.mode, str):
+            for threads in _csv(args.threads):
+                for source, images in image_sets:
+                    if not images:
+                        print(f"No images found for {source}, skipping.")
+                        continue
+                    config = {
+                        "backend": backend, "path": path, "mode": mode, "threads": threads,
+                        "image_source": source, "images": images,
+                        "batch_sizes": _csv(args.batch_sizes), "clients": _csv(args.clients),
+                        "iterations": args.iterations, "warmup": args.warmup, "duration": args.duration,
+                    }
+                    with ctx.Pool(1) as pool:
+                        result = pool.apply(run_configuration, (config,))
+                    results.append(result)
+                    total = result["single_stream"]["total_ms"]
+                    print(f"{backend} mode={mode} threads={threads} {source}: single-stream p50={total['p50_ms']}ms "
+                          f"p99={total['p99_ms']}ms")
+                    for run in result["throughput"]:
+                        print(f"    batch={run['batch_size']} clients={run['clients']}: "
+                              f"{run['images_per_second']} images/s")
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment_info(), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
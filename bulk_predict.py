@@ -0,0 +1,205 @@
+# bulk_predict.py
+
+import argparse
+import csv
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import embedding_index
+import inference_client
+import metrics
+import postprocessing
+import preprocessing
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_WORKERS = 4
+DEFAULT_TOP_K = postprocessing.DEFAULT_TOP_K
+
+# Row for an image that failed to decode
+ERROR_ROW = {"disease_name": None, "crop": None, "condition": None, "confidence": None, "uncertain": None,
+             "crop_confidence": None, "solution": None, "top_k": [], "inference_ms": None, "embedding_row": None}
+
+
+def _is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+# Image Sources: (name, open_fn) pairs, opened lazily by the decode workers
+def iter_directory(directory):
+    for root, _, files in os.walk(directory):
+        for file_name in sorted(files):
+            if _is_image(file_name):
+                path = os.path.join(root, file_name)
+                yield os.path.relpath(path, directory), (lambda p=path: p)
+
+
+def iter_zip(zip_file):
+    archive = zipfile.ZipFile(zip_file)
+    lock = threading.Lock()
+
+    def opener(member):
+        with lock:
+            return io.BytesIO(archive.read(member))
+
+    for member in archive.namelist():
+        if _is_image(member) and not member.endswith("/"):
+            yield member, (lambda m=member: opener(m))
+
+
+def iter_uploads(uploaded_files):
+    for uploaded in uploaded_files:
+        if uploaded.name.lower().endswith(".zip"):
+            yield from iter_zip(uploaded)
+        elif _is_image(uploaded.name):
+            data = uploaded.getvalue()
+            yield uploaded.name, (lambda d=data: io.BytesIO(d))
+
+
+def _read_batch(chunk, buffer, executor):
+    started = time.perf_counter()
+    images, errors = preprocessing.decode_batch([open_fn() for _, open_fn in chunk], out=buffer,
+                                                executor=executor)
+    decode_ms = (time.perf_counter() - started) * 1000.0 / len(chunk)
+    return [name for name, _ in chunk], images, errors, decode_ms
+
+
+def _chunks(sources, batch_size):
+    chunk = []
+    for source in sources:
+        chunk.append(source)
+        if len(chunk) == batch_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Predict Stream: decode the next batch on the worker pool while the current one runs through the model,
+# yielding one row per image. Only two preallocated batch buffers exist however many sources there are.
+# With index_embeddings, decoded images are also added to the similar-cases index (embedding_index) and
+# each row carries its embedding_row id.
+def predict_stream(sources, batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS, top_k=DEFAULT_TOP_K,
+                   index_embeddings=False):
+    # The inference service when it's running, else the model in this process
+    entry = inference_client.get_predictor()
+    index_embeddings = (index_embeddings and embedding_index.EMBEDDING_INDEX_ENABLED
+                        and hasattr(entry, "predict_with_embeddings"))
+    buffers = [np.empty((batch_size, *preprocessing.IMAGE_SIZE, 3), dtype=np.float32) for _ in range(2)]
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-reader") as reader, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-decode") as decoder:
+
+        def submit(chunk, buffer):
+            return reader.submit(lambda: _read_batch(chunk, buffer, decoder))
+
+        chunk_iter = _chunks(sources, batch_size)
+        first = next(chunk_iter, None)
+        pending = submit(first, buffers[0]) if first else None
+        index = 0
+        while pending is not None:
+            names, images, errors, decode_ms = pending.result()
+            index += 1
+            upcoming = next(chunk_iter, None)
+            pending = submit(upcoming, buffers[index % 2]) if upcoming else None
+
+            started = time.perf_counter()
+            if index_embeddings:
+                probabilities, embeddings = entry.predict_with_embeddings(images)
+            else:
+                probabilities, embeddings = entry.predict(images), None
+            elapsed = time.perf_counter() - started
+            metrics.observe("app_stage_seconds", elapsed, stage="bulk_inference_batch")
+            per_image_ms = elapsed * 1000.0 / len(names)
+            results = postprocessing.postprocess_rows(probabilities, top_k)
+            embedding_rows = {}
+            if embeddings is not None:
+                valid = [i for i, error in enumerate(errors)
+                         if error is None and embedding_index.has_embedding(embeddings[i])]
+                if valid:
+                    row_ids = embedding_index.get_index(entry.version).add(embeddings[valid], [
+                        {"image_name": names[i], "disease_name": results[i]["disease_name"], "confirmed": False,
+                         "source": "bulk", "timestamp": datetime.now().isoformat()} for i in valid])
+                    embedding_rows = dict(zip(valid, row_ids))
+            for i, (name, error, result) in enumerate(zip(names, errors, results)):
+                if error is not None:
+                    yield dict(ERROR_ROW, image_name=name, decode_ms=round(decode_ms, 3),
+                               model_version=entry.version, error=error)
+                    continue
+                yield dict(result, image_name=name, decode_ms=round(decode_ms, 3),
+                           inference_ms=round(per_image_ms, 3), model_version=entry.version, error=None,
+                           embedding_row=embedding_rows.get(i))
+
+
+# Result Writers (one row written and flushed per image)
+class CsvResultWriter:
+    def __init__(self, f, top_k=DEFAULT_TOP_K):
+        self.f = f
+        self.top_k = top_k
+        fields = ["image_name", "disease_name", "crop", "condition", "confidence", "uncertain", "crop_confidence"]
+        for k in range(1, top_k + 1):
+            fields += [f"top{k}_disease_name", f"top{k}_probability"]
+        fields += ["solution", "decode_ms", "inference_ms", "model_version", "error"]
+        self.writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, row):
+        flat = {key: value for key, value in row.items() if key != "top_k"}
+        for k, item in enumerate(row["top_k"][:self.top_k], start=1):
+            flat[f"top{k}_disease_name"] = item["disease_name"]
+            flat[f"top{k}_probability"] = item["probability"]
+        self.writer.writerow(flat)
+        self.f.flush()
+
+
+class JsonlResultWriter:
+    def __init__(self, f, top_k=DEFAULT_TOP_K):
+        self.f = f
+
+    def write(self, row):
+        self.f.write(json.dumps(row) + "\n")
+        self.f.flush()
+
+
+def make_writer(f, fmt, top_k=DEFAULT_TOP_K):
+    if fmt == "jsonl":
+        return JsonlResultWriter(f, top_k)
+    return CsvResultWriter(f, top_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict plant diseases for a folder or zip of leaf images.")
+    parser.add_argument("source", help="Directory (e.g. test/test) or .zip archive of images")
+    parser.add_argument("-o", "--output", default="predictions.csv", help="Output file (.csv or .jsonl)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--index-embeddings", action="store_true",
+                        help="Also add the images to the similar-cases index (embedding_index.py)")
+    args = parser.parse_args()
+
+    fmt = args.format or ("jsonl" if args.output.endswith(".jsonl") else "csv")
+    sources = iter_zip(args.source) if args.source.lower().endswith(".zip") else iter_directory(args.source)
+
+    started = time.perf_counter()
+    count = 0
+    with open(args.output, "w", newline="", encoding="utf-8") as f:
+        writer = make_writer(f, fmt, args.top_k)
+        for row in predict_stream(sources, args.batch_size, args.workers, args.top_k, args.index_embeddings):
+            writer.write(row)
+            count += 1
+    elapsed = time.perf_counter() - started
+    print(f"Predicted {count} images in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.1f} images/s) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
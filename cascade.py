@@ -0,0 +1,169 @@
+# cascade.py
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+import model_registry
+
+# Cascade Settings (INFERENCE_MODE=cascade in model_registry switches it on)
+STUDENT_MODEL_PATH = os.getenv("STUDENT_MODEL_PATH", "student_model.keras")
+CASCADE_CONFIG_PATH = os.getenv("CASCADE_CONFIG_PATH", "cascade.json")  # written by distill.py calibration
+CASCADE_THRESHOLD = os.getenv("CASCADE_THRESHOLD")  # overrides the calibrated threshold when set
+
+
+def load_config(path=CASCADE_CONFIG_PATH):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _config_mtime(path=CASCADE_CONFIG_PATH):
+    try:
+        return os.stat(path).st_mtime if path else None
+    except OSError:
+        return None
+
+
+# Cascade: the student answers every image whose top softmax probability reaches the threshold;
+# only the rest go through the full model. Both models take the same (N, 128, 128, 3) batch.
+class Cascade:
+    def __init__(self, teacher_path=model_registry.MODEL_PATH, student_path=STUDENT_MODEL_PATH, threshold=None):
+        self.path = teacher_path
+        self.teacher_path = teacher_path
+        self.student_path = student_path
+        self._threshold_override = threshold if threshold is not None else CASCADE_THRESHOLD
+        self.config = None
+        self._config_mtime = None
+        self._refresh_config()
+        self._embedding_dim = None
+        self._reported_embeddings = False
+        self._stats_lock = threading.Lock()
+        self._stats = {"images": 0, "early_exits": 0, "student_ms_total": 0.0, "teacher_ms_total": 0.0}
+
+    # Calibration: re-read cascade.json when distill.py rewrites it (e.g. after training a new student)
+    def _refresh_config(self):
+        mtime = _config_mtime()
+        if self.config is not None and mtime == self._config_mtime:
+            return
+        self._config_mtime = mtime
+        self.config = load_config()
+        threshold = self._threshold_override
+        self.threshold = float(threshold if threshold is not None else self.config.get("threshold", 0.9))
+
+    # Version Mismatch: a description when the loaded teacher/student files are not the ones cascade.json was
+    # calibrated for (checked on every lookup, so hot swaps are caught too), else None
+    def version_mismatch(self):
+        self._refresh_config()
+        problems = []
+        for role, entry in (("teacher", self.teacher), ("student", self.student)):
+            expected = self.config.get(f"{role}_version")
+            if expected is not None and entry.version != expected:
+                problems.append(f"{role} {entry.path} is {entry.version}, calibrated for {expected}")
+        return "; ".join(problems) or None
+
+    # Entries are looked up per call so hot-swapped student/teacher files are picked up
+    @property
+    def teacher(self):
+        return model_registry.get_entry(self.teacher_path)
+
+    @property
+    def student(self):
+        return model_registry.get_entry(self.student_path)
+
+    @property
+    def version(self):
+        return f"{self.teacher.version}+{self.student.version}@{self.threshold:g}"
+
+    @property
+    def backend(self):
+        return self.teacher.backend
+
+    def predict(self, batch):
+        return self._predict(batch, False)[0]
+
+    # Embeddings come from the full model's feature layer (the space the similar-cases index is built in), so
+    # only rows escalated to it have one; rows the student answered come back as NaN and are not indexed
+    def predict_with_embeddings(self, batch):
+        if not self._reported_embeddings:
+            self._reported_embeddings = True
+            print("Cascade mode: similar cases are only looked up for images escalated to the full model.")
+        return self._predict(batch, True)
+
+    def _predict(self, batch, want_embeddings):
+        batch = np.asarray(batch)
+        started = time.perf_counter()
+        probabilities = np.array(self.student.predict(batch), dtype=np.float32)
+        student_s = time.perf_counter() - started
+        hard = probabilities.max(axis=1) < self.threshold
+        teacher_s = 0.0
+        embeddings = None
+        if hard.any():
+            started = time.perf_counter()
+            if want_embeddings:
+                probabilities[hard], hard_embeddings = self.teacher.predict_with_embeddings(batch[hard])
+                if hard_embeddings is not None:
+                    self._embedding_dim = hard_embeddings.shape[1]
+                    embeddings = np.full((len(batch), self._embedding_dim), np.nan, dtype=np.float32)
+                    embeddings[hard] = hard_embeddings
+            else:
+                probabilities[hard] = self.teacher.predict(batch[hard])
+            teacher_s = time.perf_counter() - started
+        elif want_embeddings:
+            if self._embedding_dim is None:
+                _, sample = self.teacher.predict_with_embeddings(batch[:1])
+                self._embedding_dim = sample.shape[1] if sample is not None else 0
+            if self._embedding_dim:
+                embeddings = np.full((len(batch), self._embedding_dim), np.nan, dtype=np.float32)
+        exits = int(len(batch) - hard.sum())
+        metrics.observe("app_stage_seconds", student_s, stage="cascade_student")
+        if teacher_s:
+            metrics.observe("app_stage_seconds", teacher_s, stage="cascade_teacher")
+        metrics.inc("app_cascade_images_total", len(batch))
+        metrics.inc("app_cascade_early_exits_total", exits)
+        with self._stats_lock:
+            self._stats["images"] += len(batch)
+            self._stats["early_exits"] += exits
+            self._stats["student_ms_total"] += student_s * 1000.0
+            self._stats["teacher_ms_total"] += teacher_s * 1000.0
+        return probabilities, embeddings
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["exit_rate"] = s["early_exits"] / s["images"] if s["images"] else 0.0
+        s["threshold"] = self.threshold
+        return s
+
+
+_cascades = {}
+_cascades_lock = threading.Lock()
+_reported_missing = set()
+_reported_mismatch = set()
+
+
+# Get Cascade: falls back to the full model alone when no student model has been trained yet, or when the
+# models on disk don't match the calibration in cascade.json
+def get_cascade(teacher_path=model_registry.MODEL_PATH):
+    cascade = _cascades.get(teacher_path)
+    if cascade is None:
+        if not os.path.exists(STUDENT_MODEL_PATH):
+            if STUDENT_MODEL_PATH not in _reported_missing:
+                _reported_missing.add(STUDENT_MODEL_PATH)
+                print(f"Cascade mode: student model '{STUDENT_MODEL_PATH}' not found, using the full model only.")
+            return model_registry.get_entry(teacher_path)
+        with _cascades_lock:
+            cascade = _cascades.get(teacher_path) or _cascades.setdefault(teacher_path, Cascade(teacher_path))
+    mismatch = cascade.version_mismatch()
+    if mismatch is not None:
+        if mismatch not in _reported_mismatch:
+            _reported_mismatch.add(mismatch)
+            print(f"Cascade mode: {mismatch}; using the full model only until {CASCADE_CONFIG_PATH} "
+                  f"is recalibrated (distill.py).")
+        return model_registry.get_entry(teacher_path)
+    return cascade
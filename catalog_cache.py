@@ -0,0 +1,134 @@
+# catalog_cache.py
+
+import hashlib
+import io
+import os
+import threading
+import time
+
+from PIL import Image
+
+import database
+
+# Catalog Settings
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
+THUMBNAIL_FOLDER = os.path.join(UPLOAD_FOLDER, "thumbs")
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "300"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+# How often other processes' catalog changes are picked up (one tiny query per interval)
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "30"))
+
+
+# Content-addressed names: identical uploads share a file and different ones can't collide
+def _content_name(data, extension):
+    return hashlib.sha256(data).hexdigest()[:24] + extension
+
+
+def make_thumbnail(data):
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (THUMBNAIL_WIDTH, THUMBNAIL_WIDTH))
+        image = image.convert("RGB")
+        if image.width > THUMBNAIL_WIDTH:
+            height = round(image.height * THUMBNAIL_WIDTH / image.width)
+            image = image.resize((THUMBNAIL_WIDTH, height), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _write_once(path, data):
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return path
+
+
+# Save Upload: store the original and its thumbnail; returns (image_url, thumbnail_url)
+def save_upload(data, original_name):
+    extension = os.path.splitext(original_name)[1].lower() or ".jpg"
+    name = _content_name(data, extension)
+    image_path = _write_once(os.path.join(UPLOAD_FOLDER, name), data)
+    thumbnail_path = os.path.join(THUMBNAIL_FOLDER, os.path.splitext(name)[0] + ".jpg")
+    if not os.path.exists(thumbnail_path):
+        _write_once(thumbnail_path, make_thumbnail(data))
+    return image_path, thumbnail_path
+
+
+# Lazy thumbnail for supplements added before thumbnails existed
+def ensure_thumbnail(supplement):
+    image_url = supplement.get("image_url")
+    if supplement.get("thumbnail_url") or not image_url or image_url == "None" or not os.path.exists(image_url):
+        return supplement
+    try:
+        with open(image_url, "rb") as f:
+            data = f.read()
+        thumbnail_path = os.path.join(THUMBNAIL_FOLDER, _content_name(data, ".jpg"))
+        if not os.path.exists(thumbnail_path):
+            _write_once(thumbnail_path, make_thumbnail(data))
+        database.set_supplement_thumbnail(supplement["name"], thumbnail_path)
+        supplement["thumbnail_url"] = thumbnail_path
+    except Exception as e:
+        print(f"Could not create thumbnail for {image_url}: {e}")
+    return supplement
+
+
+class _Snapshot:
+    def __init__(self, supplements, version, local_changes):
+        self.supplements = supplements
+        self.by_name = {s["name"]: s for s in supplements}
+        self.version = version
+        self.local_changes = local_changes
+        self.checked_at = time.monotonic()
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _load_snapshot():
+    local_changes = database.catalog_changes()
+    version = database.get_catalog_version()
+    supplements = [ensure_thumbnail(s) for s in database.get_all_supplements()]
+    return _Snapshot(supplements, version, local_changes)
+
+
+def _is_stale(snapshot):
+    if snapshot is None or snapshot.local_changes != database.catalog_changes():
+        return True
+    if time.monotonic() - snapshot.checked_at < CATALOG_CHECK_INTERVAL:
+        return False
+    snapshot.checked_at = time.monotonic()
+    return database.get_catalog_version() != snapshot.version
+
+
+def _current():
+    global _snapshot
+    snapshot = _snapshot
+    if _is_stale(snapshot):
+        with _snapshot_lock:
+            if _is_stale(_snapshot):
+                _snapshot = _load_snapshot()
+            snapshot = _snapshot
+    return snapshot
+
+
+# Get Supplements: served from the in-process snapshot, reloaded only when the catalog version changes
+def get_supplements():
+    return _current().supplements
+
+
+def get_supplement(name):
+    return _current().by_name.get(name)
+
+
+def version():
+    return _current().version
+
+
+def invalidate():
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
@@ -1,118 +1,213 @@
 # database.py
 
+import csv
 import os
-import bcrypt
-from pymongo import MongoClient
-from dotenv import load_dotenv
-from datetime import datetime
-
-# Load environment variables
-load_dotenv()
-
-# MongoDB Connection
-MONGO_URI = os.getenv("MONGO_URI")  # Store this in .env file
-client = MongoClient(MONGO_URI)
-db = client["plant_disease_db"]
-users_collection = db["users"]
-admin_collection = db["admins"]
-prediction_logs = db["prediction_logs"]
-supplements_collection = db["supplements"]
-carts_collection = db["carts"]
-orders_collection = db["orders"]
+import re
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConfigurationError, DuplicateKeyError, OperationFailure, PyMongoError
+
+import auth
+import db_client
+import metrics
+import prediction_log_writer
+
+# Collections are resolved through db_client, which connects lazily on first use
+_COLLECTIONS = {
+    "users_collection": "users",
+    "admin_collection": "admins",
+    "prediction_logs": "prediction_logs",
+    "supplements_collection": "supplements",
+    "carts_collection": "carts",
+    "orders_collection": "orders",
+}
+
+
+def _col(name):
+    return db_client.get_collection(name)
+
+
+# Keeps `database.db`, `database.users_collection`, ... working for callers such as admin.py
+def __getattr__(name):
+    if name == "client":
+        return db_client.get_client()
+    if name == "db":
+        return db_client.get_db()
+    if name in _COLLECTIONS:
+        return _col(_COLLECTIONS[name])
+    raise AttributeError(f"module 'database' has no attribute '{name}'")
+
+# Register and verify accounts; hashing runs in auth's bounded worker pool
+def _register(collection, username, password, exists_message, success_message):
+    if _col(collection).find_one({"username": username}, {"_id": 1}):
+        return exists_message
+
+    try:
+        _col(collection).insert_one({"username": username, "password": auth.hash_password(password)})
+    except auth.AuthBusy as e:
+        return str(e)
+    except DuplicateKeyError:
+        return exists_message
+    return success_message
+
+
+# Raises auth.RateLimitExceeded / auth.AuthBusy so the page can tell the user to retry
+def _login(collection, username, password, client_id=None):
+    auth.check_rate_limit(f"{collection}:{username}", client_id)
+    account = _col(collection).find_one({"username": username}, {"password": 1})
+    if not account:
+        return False
+    matches, new_hash = auth.check_password(password, account["password"])
+    if new_hash:
+        # Transparent upgrade to the configured BCRYPT_ROUNDS
+        _col(collection).update_one({"_id": account["_id"]}, {"$set": {"password": new_hash}})
+    return matches
 
 # Register Users
+@metrics.timed("app_stage_seconds", stage="register")
 def register_user(username, password):
-    if users_collection.find_one({"username": username}):
-        return "Username already exists."
-
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    users_collection.insert_one({"username": username, "password": hashed_password.decode('utf-8')})
-    return "Registration successful!"
+    return _register("users", username, password, "Username already exists.", "Registration successful!")
 
 # Login Users
-def login_user(username, password):
-    user = users_collection.find_one({"username": username})
-    if user and bcrypt.checkpw(password.encode('utf-8'), user["password"].encode('utf-8')):
-        return True
-    return False
+@metrics.timed("app_stage_seconds", stage="login")
+def login_user(username, password, client_id=None):
+    return _login("users", username, password, client_id)
 
 # Register Admin (One-Time Setup)
 def register_admin(admin_username, admin_password):
-    if admin_collection.find_one({"username": admin_username}):
-        return "Admin already exists."
-
-    hashed_password = bcrypt.hashpw(admin_password.encode('utf-8'), bcrypt.gensalt())
-    admin_collection.insert_one({"username": admin_username, "password": hashed_password.decode('utf-8')})
-    return "Admin registration successful!"
+    return _register("admins", admin_username, admin_password, "Admin already exists.",
+                     "Admin registration successful!")
 
 # Admin Login
-def login_admin(admin_username, admin_password):
-    admin = admin_collection.find_one({"username": admin_username})
-    if admin and bcrypt.checkpw(admin_password.encode('utf-8'), admin["password"].encode('utf-8')):
-        return True
-    return False
+@metrics.timed("app_stage_seconds", stage="admin_login")
+def login_admin(admin_username, admin_password, client_id=None):
+    return _login("admins", admin_username, admin_password, client_id)
 
-# Save Prediction Logs
-def save_prediction(username, image_name, disease_name):
-    prediction_logs.insert_one({
+# Save Prediction Logs (queued for the background writer; extra fields such as
+# model_version, top_k and latency_ms are stored alongside)
+@metrics.timed("app_db_query_seconds", query="save_prediction")
+def save_prediction(username, image_name, disease_name, **extra):
+    return prediction_log_writer.get_writer().write({
         "username": username,
         "image_name": image_name,
         "disease_name": disease_name,
-        "timestamp": datetime.now()
+        "timestamp": datetime.now(),
+        **extra
     })
 
+# Catalog Version: bumped on every supplement change so cached catalogs (catalog_cache) reload
+_catalog_changes = 0
+
+
+def _bump_catalog_version():
+    global _catalog_changes
+    _catalog_changes += 1
+    _col("catalog_meta").update_one({"_id": "supplements"}, {"$inc": {"version": 1}}, upsert=True)
+
+
+def catalog_changes():
+    return _catalog_changes
+
+
+def get_catalog_version():
+    meta = _col("catalog_meta").find_one({"_id": "supplements"})
+    return meta["version"] if meta else 0
+
 # Add Supplement with Image
-def add_supplement(name, description, price, image_url):
-    if supplements_collection.find_one({"name": name}):
+def add_supplement(name, description, price, image_url, thumbnail_url=None):
+    if _col("supplements").find_one({"name": name}):
         return "Supplement already exists."
-    supplements_collection.insert_one({
+    _col("supplements").insert_one({
         "name": name,
         "description": description,
         "price": price,
-        "image_url": image_url
+        "image_url": image_url,
+        "thumbnail_url": thumbnail_url
     })
+    _bump_catalog_version()
     return "Supplement added successfully!"
 
 # Get All Supplements
+@metrics.timed("app_db_query_seconds", query="get_all_supplements")
 def get_all_supplements():
-    return list(supplements_collection.find({}, {"_id": 0}))
+    return list(_col("supplements").find({}, {"_id": 0}))
+
+
+def set_supplement_thumbnail(name, thumbnail_url):
+    _col("supplements").update_one({"name": name}, {"$set": {"thumbnail_url": thumbnail_url}})
 
 # Delete Supplement
 def delete_supplement(name):
-    result = supplements_collection.delete_one({"name": name})
+    result = _col("supplements").delete_one({"name": name})
     if result.deleted_count > 0:
+        _bump_catalog_version()
         return f"Supplement '{name}' deleted successfully."
     return f"Supplement '{name}' not found."
 
+def _cart_upsert(username, supplement_name, quantity, price):
+    return UpdateOne(
+        {"username": username, "supplement_name": supplement_name},
+        {"$inc": {"quantity": quantity}, "$setOnInsert": {"price": price}},
+        upsert=True
+    )
+
+
+def _write_cart(operations):
+    try:
+        _col("carts").bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Two concurrent first-time upserts on the same (username, supplement_name): the loser
+        # hits the unique index, and retrying turns it into a plain $inc on the winner's row
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+        failed = {error["index"] for error in e.details["writeErrors"]}
+        _col("carts").bulk_write([operations[i] for i in sorted(failed)], ordered=False)
+
+
 # Add to Cart
+@metrics.timed("app_db_query_seconds", query="add_to_cart")
 def add_to_cart(username, supplement_name, quantity):
-    supplement = supplements_collection.find_one({"name": supplement_name})
-    if not supplement:
+    return add_many_to_cart(username, [(supplement_name, quantity)])
+
+
+# Add Many to Cart: one price lookup and one bulk upsert, however many items
+@metrics.timed("app_db_query_seconds", query="add_many_to_cart")
+def add_many_to_cart(username, items):
+    names = [name for name, _ in items]
+    prices = {s["name"]: s["price"] for s in _col("supplements").find({"name": {"$in": names}},
+                                                                       {"_id": 0, "name": 1, "price": 1})}
+    missing = [name for name in names if name not in prices]
+    if missing:
         return "Supplement not found."
-    
-    cart_item = carts_collection.find_one({"username": username, "supplement_name": supplement_name})
-    if cart_item:
-        carts_collection.update_one({"_id": cart_item["_id"]}, {"$inc": {"quantity": quantity}})
-    else:
-        carts_collection.insert_one({
-            "username": username,
-            "supplement_name": supplement_name,
-            "quantity": quantity,
-            "price": supplement["price"]
-        })
-    return "Item added to cart!"
+
+    _write_cart([_cart_upsert(username, name, quantity, prices[name]) for name, quantity in items])
+    return "Item added to cart!" if len(items) == 1 else "Items added to cart!"
 
 # View Cart
+@metrics.timed("app_db_query_seconds", query="view_cart")
 def view_cart(username):
-    return list(carts_collection.find({"username": username}, {"_id": 0}))
+    return get_cart(username)["items"]
+
+
+# Get Cart: items and total in a single aggregation. Not cached: another app process may have just
+# changed the cart, and a cache check would cost the same round trip as the aggregation itself.
+@metrics.timed("app_db_query_seconds", query="get_cart")
+def get_cart(username):
+    result = list(_col("carts").aggregate([
+        {"$match": {"username": username, "quantity": {"$gt": 0}}},
+        {"$sort": {"supplement_name": 1}},
+        {"$group": {
+            "_id": None,
+            "items": {"$push": {"username": "$username", "supplement_name": "$supplement_name",
+                                "quantity": "$quantity", "price": "$price"}},
+            "total": {"$sum": {"$multiply": ["$price", "$quantity"]}},
+        }},
+    ]))
+    return {"items": result[0]["items"], "total": result[0]["total"]} if result else {"items": [], "total": 0}
 
-# Place Order
-def place_order(username):
-    cart_items = view_cart(username)
-    if not cart_items:
-        return "Cart is empty."
 
-    order = {
+def _build_order(username, cart_items):
+    return {
         "username": username,
         "items": [
             {
@@ -125,14 +220,220 @@ def place_order(username):
         "total_price": sum(item['price'] * item['quantity'] for item in cart_items),
         "order_date": datetime.now()
     }
-    orders_collection.insert_one(order)
-    carts_collection.delete_many({"username": username})
+
+
+def _place_order_transaction(username):
+    def checkout(session):
+        cart_items = list(_col("carts").find({"username": username}, session=session))
+        if not cart_items:
+            return False
+        _col("orders").insert_one(_build_order(username, cart_items), session=session)
+        _col("carts").delete_many({"_id": {"$in": [item["_id"] for item in cart_items]}}, session=session)
+        return True
+
+    with db_client.get_client().start_session() as session:
+        return session.with_transaction(checkout)
+
+
+CART_CLAIM_TIMEOUT = 60  # seconds after which a crashed checkout's claim on cart rows lapses
+
+
+# Without transactions (standalone mongod), in five round trips however many items: the rows are claimed
+# with one update_many (so a concurrent checkout can't order them twice), read, ordered, then released by
+# subtracting the ordered quantity, and rows left at zero are deleted. An item added mid-checkout either
+# lands in this order or stays in the cart; never lost.
+def _place_order_claim(username):
+    carts = _col("carts")
+    token = os.urandom(8).hex()
+    now = datetime.now()
+    carts.update_many(
+        {"username": username, "quantity": {"$gt": 0},
+         "$or": [{"claim": None}, {"claim.at": {"$lt": now - timedelta(seconds=CART_CLAIM_TIMEOUT)}}]},
+        {"$set": {"claim": {"token": token, "at": now}}})
+    cart_items = list(carts.find({"claim.token": token}).sort("supplement_name", 1))
+    if not cart_items:
+        return False
+    try:
+        _col("orders").insert_one(_build_order(username, cart_items))
+    except PyMongoError:
+        carts.update_many({"claim.token": token}, {"$unset": {"claim": ""}})
+        raise
+    carts.bulk_write([UpdateOne({"_id": item["_id"]},
+                                {"$inc": {"quantity": -item["quantity"]}, "$unset": {"claim": ""}})
+                      for item in cart_items], ordered=False)
+    carts.delete_many({"username": username, "quantity": {"$lte": 0}, "claim": None})
+    return True
+
+
+_transactions_supported = None
+
+
+# Place Order
+@metrics.timed("app_db_query_seconds", query="place_order")
+def place_order(username):
+    global _transactions_supported
+    placed = None
+    if _transactions_supported is not False:
+        try:
+            placed = _place_order_transaction(username)
+            _transactions_supported = True
+        except OperationFailure as e:
+            # Standalone servers reject transactions with IllegalOperation
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+        except (ConfigurationError, NotImplementedError):
+            _transactions_supported = False
+    if placed is None:
+        placed = _place_order_claim(username)
+    if not placed:
+        return "Cart is empty."
     return "Order placed successfully!"
 
 # Get All Orders
 def get_all_orders():
-    return list(orders_collection.find({}, {"_id": 0}))
+    return list(_col("orders").find({}, {"_id": 0}))
 
 
+@metrics.timed("app_db_query_seconds", query="get_user_orders")
 def get_user_orders(username):
-    return list(orders_collection.find({"username": username}, {"_id": 0}))
+    return list(_col("orders").find({"username": username}, {"_id": 0}))
+
+
+# Admin Queries: keyset pagination, projection and server-side filtering so the admin
+# pages never materialize whole collections
+
+LOG_FIELDS = {"_id": 1, "username": 1, "image_name": 1, "disease_name": 1, "timestamp": 1}
+
+
+def _date_filter(field, start=None, end=None):
+    if start is None and end is None:
+        return {}
+    condition = {}
+    if start is not None:
+        condition["$gte"] = start
+    if end is not None:
+        condition["$lt"] = end
+    return {field: condition}
+
+
+# After (value, _id) in descending (field, _id) order
+def _after_filter(field, after):
+    if after is None:
+        return {}
+    value, last_id = after
+    return {"$or": [{field: {"$lt": value}}, {field: value, "_id": {"$lt": last_id}}]}
+
+
+def _and(*filters):
+    filters = [f for f in filters if f]
+    if not filters:
+        return {}
+    return filters[0] if len(filters) == 1 else {"$and": filters}
+
+
+def _page(docs, field, limit):
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_after = (docs[-1][field], docs[-1]["_id"]) if has_more and docs else None
+    return docs, next_after
+
+
+def _log_filter(start=None, end=None, username=None, disease_name=None):
+    query = _date_filter("timestamp", start, end)
+    if username:
+        query["username"] = username
+    if disease_name:
+        query["disease_name"] = disease_name
+    return query
+
+
+# Returns (logs, next_after); pass next_after back in to get the following page
+@metrics.timed("app_db_query_seconds", query="get_prediction_logs_page")
+def get_prediction_logs_page(start=None, end=None, username=None, disease_name=None, after=None, limit=50):
+    query = _and(_log_filter(start, end, username, disease_name), _after_filter("timestamp", after))
+    cursor = _col("prediction_logs").find(query, LOG_FIELDS).sort([("timestamp", -1), ("_id", -1)]).limit(limit + 1)
+    return _page(list(cursor), "timestamp", limit)
+
+
+def iter_prediction_logs(start=None, end=None, username=None, disease_name=None, batch_size=1000):
+    query = _log_filter(start, end, username, disease_name)
+    cursor = _col("prediction_logs").find(query, LOG_FIELDS).sort([("timestamp", -1), ("_id", -1)])
+    return cursor.batch_size(batch_size)
+
+
+@metrics.timed("app_db_query_seconds", query="get_users_page")
+def get_users_page(prefix=None, after=None, limit=50):
+    query = {}
+    if prefix:
+        query["username"] = {"$regex": "^" + re.escape(prefix)}
+    if after is not None:
+        query = _and(query, {"username": {"$gt": after}})
+    users = list(_col("users").find(query, {"_id": 0, "username": 1}).sort("username", 1).limit(limit + 1))
+    has_more = len(users) > limit
+    users = users[:limit]
+    return users, (users[-1]["username"] if has_more and users else None)
+
+
+def _order_rows_pipeline(query):
+    return [
+        {"$match": query},
+        {"$sort": {"order_date": -1, "_id": -1}},
+    ], [
+        {"$unwind": "$items"},
+        {"$project": {
+            "_id": 0,
+            "Username": "$username",
+            "Supplement Name": "$items.supplement_name",
+            "Quantity": "$items.quantity",
+            "Price": "$items.price",
+            "Total Price": {"$ifNull": ["$total_price", 0.0]},
+            "Order Date": {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$order_date"}},
+        }},
+    ]
+
+
+def _order_filter(start=None, end=None, username=None):
+    query = _date_filter("order_date", start, end)
+    if username:
+        query["username"] = username
+    return query
+
+
+# Order rows flattened by Mongo ($unwind/$project); pages are cut on whole orders
+@metrics.timed("app_db_query_seconds", query="get_order_rows_page")
+def get_order_rows_page(start=None, end=None, username=None, after=None, limit=50):
+    query = _and(_order_filter(start, end, username), _after_filter("order_date", after))
+    head, tail = _order_rows_pipeline(query)
+    orders = list(_col("orders").aggregate(head + [{"$limit": limit + 1},
+                                                   {"$project": {"_id": 1, "order_date": 1}}]))
+    orders, next_after = _page(orders, "order_date", limit)
+    if not orders:
+        return [], None
+    rows = list(_col("orders").aggregate(
+        [{"$match": {"_id": {"$in": [o["_id"] for o in orders]}}},
+         {"$sort": {"order_date": -1, "_id": -1}}] + tail))
+    return rows, next_after
+
+
+def iter_order_rows(start=None, end=None, username=None, batch_size=1000):
+    head, tail = _order_rows_pipeline(_order_filter(start, end, username))
+    return _col("orders").aggregate(head + tail, batchSize=batch_size, allowDiskUse=True)
+
+
+# Export: write rows to a CSV file in fixed-size chunks instead of building one big DataFrame
+def export_csv(rows, path, columns, chunk_size=5000):
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                writer.writerows(chunk)
+                count += len(chunk)
+                chunk = []
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
@@ -0,0 +1,200 @@
+# db_client.py
+
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# MongoDB Connection Settings (store these in .env file)
+MONGO_URI = os.getenv("MONGO_URI")  # "mongomock://" runs against an in-memory mongomock client
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "plant_disease_db")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")  # e.g. "zstd,snappy,zlib" when installed
+
+# Indexes backing every lookup the app and admin panel make
+INDEXES = {
+    "users": [([("username", ASCENDING)], {"unique": True})],
+    "admins": [([("username", ASCENDING)], {"unique": True})],
+    "supplements": [([("name", ASCENDING)], {"unique": True})],
+    "carts": [([("username", ASCENDING), ("supplement_name", ASCENDING)], {"unique": True})],
+    "orders": [([("username", ASCENDING), ("order_date", DESCENDING)], {})],
+    "prediction_logs": [
+        ([("timestamp", DESCENDING), ("disease_name", ASCENDING)], {}),
+        ([("username", ASCENDING), ("timestamp", DESCENDING)], {}),
+    ],
+    "analytics_rollups": [
+        ([("metric", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING), ("key", ASCENDING)],
+         {"unique": True}),
+    ],
+}
+
+
+# Command/Pool Statistics collected through pymongo's monitoring hooks
+class _Stats(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.pool = {"connections_created": 0, "connections_closed": 0, "checkouts": 0,
+                     "checkout_failures": 0, "checked_out": 0}
+
+    def _command(self, event, failed):
+        with self.lock:
+            entry = self.commands.setdefault(event.command_name,
+                                             {"count": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0})
+            duration_ms = event.duration_micros / 1000.0
+            entry["count"] += 1
+            entry["failures"] += int(failed)
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._command(event, False)
+
+    def failed(self, event):
+        self._command(event, True)
+
+    def _pool(self, key, delta=1):
+        with self.lock:
+            self.pool[key] += delta
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._pool("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._pool("connections_closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._pool("checkout_failures")
+
+    def connection_checked_out(self, event):
+        self._pool("checkouts")
+        self._pool("checked_out")
+
+    def connection_checked_in(self, event):
+        self._pool("checked_out", -1)
+
+    def snapshot(self):
+        with self.lock:
+            commands = {
+                name: dict(entry, avg_ms=entry["total_ms"] / entry["count"] if entry["count"] else 0.0)
+                for name, entry in self.commands.items()
+            }
+            return {"commands": commands, "pool": dict(self.pool)}
+
+
+_stats = _Stats()
+_client = None
+_client_lock = threading.Lock()
+
+
+def _create_client(uri):
+    if uri and uri.startswith("mongomock://"):
+        import mongomock
+        return mongomock.MongoClient()
+    return MongoClient(
+        uri,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        compressors=MONGO_COMPRESSORS,
+        retryWrites=True,
+        event_listeners=[_stats],
+    )
+
+
+# Ensure Indexes: idempotent, run once when the process first connects
+def ensure_indexes(db):
+    for collection_name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection_name].create_index(keys, background=True, **options)
+            except PyMongoError as e:
+                logger.warning("Could not create index %s on %s: %s", keys, collection_name, e)
+
+
+# Get Client (created lazily, one pooled client per process)
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = _create_client(MONGO_URI)
+                ensure_indexes(client[MONGO_DB_NAME])
+                _client = client
+    return _client
+
+
+def get_db():
+    return get_client()[MONGO_DB_NAME]
+
+
+def get_collection(name):
+    return get_db()[name]
+
+
+# Replace the client (e.g. with a mongomock client in tests); indexes are ensured on the new one
+def set_client(client):
+    global _client
+    with _client_lock:
+        ensure_indexes(client[MONGO_DB_NAME])
+        _client = client
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+# Pool and per-command latency statistics
+def stats():
+    snapshot = _stats.snapshot()
+    snapshot["connected"] = _client is not None
+    snapshot["max_pool_size"] = MONGO_MAX_POOL_SIZE
+    return snapshot
+
+
+def ping():
+    started = time.perf_counter()
+    get_client().admin.command("ping")
+    return (time.perf_counter() - started) * 1000.0
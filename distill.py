@@ -0,0 +1,187 @@
+# distill.py
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import training_data
+from cascade import CASCADE_CONFIG_PATH, STUDENT_MODEL_PATH, Cascade
+from model_registry import IMAGE_SIZE, MODEL_PATH, file_version
+
+
+# Student: downsample to `resolution`, four narrow conv blocks, global pooling; outputs logits.
+# Takes the same 0..255 (128, 128, 3) input as the full model, so the serving code needs no changes.
+def build_student(num_classes, resolution=64, width=16):
+    inputs = tf.keras.Input(shape=(IMAGE_SIZE[1], IMAGE_SIZE[0], 3))
+    x = tf.keras.layers.Resizing(resolution, resolution, interpolation="bilinear")(inputs)
+    x = tf.keras.layers.Rescaling(1.0 / 255)(x)
+    for multiplier in (1, 2, 4, 8):
+        x = tf.keras.layers.Conv2D(width * multiplier, 3, padding="same", use_bias=False)(x)
+        x = tf.keras.layers.BatchNormalization()(x)
+        x = tf.keras.layers.ReLU()(x)
+        x = tf.keras.layers.MaxPool2D(2)(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.Dropout(0.2)(x)
+    logits = tf.keras.layers.Dense(num_classes)(x)
+    return tf.keras.Model(inputs, logits, name="student")
+
+
+# Distill: loss = alpha * CE(labels) + (1 - alpha) * T^2 * KL(teacher_T || student_T)
+def distill(teacher, student, train_ds, valid_ds, epochs, temperature=4.0, alpha=0.3, learning_rate=1e-3):
+    optimizer = tf.keras.optimizers.Adam(learning_rate)
+    ce = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
+    kl = tf.keras.losses.KLDivergence()
+
+    @tf.function
+    def train_step(images, labels):
+        # The full model outputs softmax; its log-probabilities act as logits for temperature scaling
+        teacher_logits = tf.math.log(teacher(images, training=False) + 1e-8)
+        with tf.GradientTape() as tape:
+            logits = student(images, training=True)
+            soft_loss = kl(tf.nn.softmax(teacher_logits / temperature), tf.nn.softmax(logits / temperature))
+            loss = alpha * ce(labels, logits) + (1.0 - alpha) * temperature ** 2 * soft_loss
+        optimizer.apply_gradients(zip(tape.gradient(loss, student.trainable_variables),
+                                      student.trainable_variables))
+        return loss
+
+    history = []
+    for epoch in range(1, epochs + 1):
+        started = time.perf_counter()
+        losses = [float(train_step(images, labels)) for images, labels in train_ds]
+        predicted, true = training_data.predict_dataset(student, valid_ds)
+        entry = {"epoch": epoch, "loss": float(np.mean(losses)), "val_accuracy": float(np.mean(predicted == true)),
+                 "seconds": round(time.perf_counter() - started, 1)}
+        history.append(entry)
+        print(f"Epoch {epoch}/{epochs} - loss {entry['loss']:.4f} - val_accuracy {entry['val_accuracy']:.4f} "
+              f"- {entry['seconds']}s")
+    return history
+
+
+# Softmax outputs, labels and per-image latency of one model over the valid split
+def collect_probabilities(model, dataset):
+    probabilities, labels = [], []
+    seconds = 0.0
+    for images, batch_labels in dataset:
+        started = time.perf_counter()
+        probabilities.append(np.asarray(model(images, training=False)))
+        seconds += time.perf_counter() - started
+        labels.append(batch_labels.numpy())
+    labels = np.concatenate(labels)
+    return np.concatenate(probabilities), labels, seconds * 1000.0 / len(labels)
+
+
+# Calibrate: the lowest threshold (highest exit rate) whose cascade accuracy on valid stays within
+# max_accuracy_drop of the full model alone
+def calibrate(student_probs, teacher_probs, labels, student_ms, teacher_ms, max_accuracy_drop=0.002):
+    confidence = student_probs.max(axis=1)
+    student_correct = student_probs.argmax(axis=1) == labels
+    teacher_correct = teacher_probs.argmax(axis=1) == labels
+    thresholds = np.round(np.arange(0.30, 1.0, 0.001), 3)
+    exits = confidence[np.newaxis, :] >= thresholds[:, np.newaxis]
+    accuracy = np.where(exits, student_correct, teacher_correct).mean(axis=1)
+    exit_rate = exits.mean(axis=1)
+    cost_ms = student_ms + (1.0 - exit_rate) * teacher_ms
+    teacher_accuracy = float(teacher_correct.mean())
+    feasible = np.flatnonzero(accuracy >= teacher_accuracy - max_accuracy_drop)
+    if len(feasible):
+        best = feasible[np.argmin(cost_ms[feasible])]
+        threshold = float(thresholds[best])
+        expected = {"accuracy": float(accuracy[best]), "exit_rate": float(exit_rate[best]),
+                    "ms_per_image": float(cost_ms[best])}
+    else:
+        # The student never helps at this accuracy budget: everything goes to the full model
+        threshold = 1.01
+        expected = {"accuracy": teacher_accuracy, "exit_rate": 0.0, "ms_per_image": student_ms + teacher_ms}
+    curve = [{"threshold": float(t), "accuracy": float(a), "exit_rate": float(e), "ms_per_image": float(c)}
+             for t, a, e, c in zip(thresholds[::10], accuracy[::10], exit_rate[::10], cost_ms[::10])]
+    return threshold, {
+        "teacher_accuracy": teacher_accuracy,
+        "student_accuracy": float(student_correct.mean()),
+        "teacher_ms_per_image": teacher_ms,
+        "student_ms_per_image": student_ms,
+        "expected": expected,
+        "curve": curve,
+    }
+
+
+# End-to-end: the serving Cascade itself over the valid split
+def evaluate_cascade(cascade, dataset):
+    correct = images_seen = 0
+    seconds = 0.0
+    for images, labels in dataset:
+        batch = images.numpy()
+        started = time.perf_counter()
+        probabilities = cascade.predict(batch)
+        seconds += time.perf_counter() - started
+        correct += int((probabilities.argmax(axis=1) == labels.numpy()).sum())
+        images_seen += len(batch)
+    stats = cascade.stats()
+    return {"accuracy": correct / images_seen, "exit_rate": stats["exit_rate"],
+            "ms_per_image": seconds * 1000.0 / images_seen, "images": images_seen}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill a small student model and calibrate the inference cascade.")
+    parser.add_argument("--teacher", default=MODEL_PATH)
+    parser.add_argument("--student", default=STUDENT_MODEL_PATH)
+    parser.add_argument("--config", default=CASCADE_CONFIG_PATH)
+    parser.add_argument("--train-dir", default="train", help="Raw or converted (training_data.py) train split")
+    parser.add_argument("--valid-dir", default="valid")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--resolution", type=int, default=64, help="Student input resolution after downsampling")
+    parser.add_argument("--width", type=int, default=16, help="Filters in the student's first conv block")
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.3, help="Weight of the hard-label loss")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.002,
+                        help="Allowed cascade accuracy loss vs the full model on valid")
+    parser.add_argument("--calibrate-only", action="store_true", help="Reuse an existing student model")
+    args = parser.parse_args()
+
+    teacher = tf.keras.models.load_model(args.teacher)
+    valid_ds = training_data.load_dataset(args.valid_dir, batch_size=256, shuffle=False, label_mode="int")
+    history = []
+    if not args.calibrate_only:
+        train_ds = training_data.load_dataset(args.train_dir, batch_size=args.batch_size, label_mode="int", seed=42)
+        student = build_student(len(train_ds.class_names), args.resolution, args.width)
+        student.summary()
+        history = distill(teacher, student, train_ds, valid_ds, args.epochs, args.temperature, args.alpha)
+        # Served with a softmax head, like the full model
+        serving = tf.keras.Sequential([student, tf.keras.layers.Softmax()], name="student_serving")
+        serving.save(args.student)
+        print(f"Student model saved to {args.student} ({os.path.getsize(args.student) / 2**20:.1f} MB)")
+
+    student = tf.keras.models.load_model(args.student)
+    student_probs, labels, student_ms = collect_probabilities(student, valid_ds)
+    teacher_probs, _, teacher_ms = collect_probabilities(teacher, valid_ds)
+    threshold, report = calibrate(student_probs, teacher_probs, labels, student_ms, teacher_ms,
+                                  args.max_accuracy_drop)
+    report["end_to_end"] = evaluate_cascade(Cascade(args.teacher, args.student, threshold), valid_ds)
+    report["distillation"] = history
+
+    config = {
+        "threshold": threshold,
+        "teacher_path": args.teacher,
+        "student_path": args.student,
+        "teacher_version": file_version(args.teacher),
+        "student_version": file_version(args.student),
+        "max_accuracy_drop": args.max_accuracy_drop,
+        "report": report,
+    }
+    with open(args.config, "w") as f:
+        json.dump(config, f, indent=2)
+
+    end_to_end = report["end_to_end"]
+    print(f"Full model: accuracy {report['teacher_accuracy']:.4f}, {teacher_ms:.2f} ms/image")
+    print(f"Student:    accuracy {report['student_accuracy']:.4f}, {student_ms:.2f} ms/image")
+    print(f"Cascade @ {threshold:g}: accuracy {end_to_end['accuracy']:.4f}, exit rate {end_to_end['exit_rate']:.1%}, "
+          f"{end_to_end['ms_per_image']:.2f} ms/image")
+    print(f"Calibration written to {args.config}")
+
+
+if __name__ == "__main__":
+    main()
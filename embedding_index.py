@@ -0,0 +1,435 @@
+# embedding_index.py
+
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Embedding Index Settings
+EMBEDDING_INDEX_ENABLED = os.getenv("EMBEDDING_INDEX_ENABLED", "1") != "0"
+EMBEDDING_INDEX_DIR = os.getenv("EMBEDDING_INDEX_DIR", "embeddings")  # one sub-directory per model version
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float16")  # float16 | int8 (per-row scale)
+IVF_MIN_ROWS = int(os.getenv("EMBEDDING_IVF_MIN_ROWS", "5000"))  # below this, brute force is fast enough
+IVF_NPROBE = int(os.getenv("EMBEDDING_IVF_NPROBE", "8"))
+SIMILAR_CASES = int(os.getenv("SIMILAR_CASES", "3"))
+
+_SCAN_BLOCK = 32768  # rows converted to float32 at a time during brute-force scans
+_INITIAL_CAPACITY = 4096
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _open_array(path, shape, dtype, mode):
+    return np.lib.format.open_memmap(path, mode=mode, dtype=dtype, shape=shape if mode == "w+" else None)
+
+
+# Store View: the arrays and row count at one moment. add() only writes rows past that count or swaps in
+# new arrays, so a view can be scanned without holding the store lock.
+class _StoreView:
+    def __init__(self, vectors, scales, count, dtype):
+        self.vectors = vectors
+        self.scales = scales
+        self.count = count
+        self.dtype = dtype
+
+    # Decoded float32 vectors for the given row ids (or a slice)
+    def decode(self, ids):
+        block = np.asarray(self.vectors[ids], dtype=np.float32)
+        if self.dtype == "int8":
+            block *= np.asarray(self.scales[ids], dtype=np.float32)[..., np.newaxis]
+        return block
+
+
+# Embedding Store: L2-normalized vectors in a memory-mapped .npy (float16, or int8 with a float32 scale
+# per row), row metadata in an append-only JSONL file. Capacity doubles as rows are appended. A row counts
+# once its JSONL line is complete, so meta.json (dim, dtype) is only rewritten on growth and flush.
+# The app, bulk_predict and the build CLI may write the same directory: appends hold an exclusive lock on
+# .lock and first catch up with rows (and a reallocated vectors.npy) written by other processes.
+class EmbeddingStore:
+    def __init__(self, directory, dtype=EMBEDDING_DTYPE):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.rows_path = os.path.join(directory, "rows.jsonl")
+        self.lock = threading.Lock()
+        self.vectors = self.scales = None
+        self._vectors_id = None
+        self.rows = []
+        self._rows_offset = 0
+        self._rows_file = None
+        self.count = 0
+        self.dim = None
+        self.dtype = dtype
+        with self.lock:
+            self._sync()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Cross-process lock around appends (fcntl; on platforms without it only the in-process lock applies)
+    @contextlib.contextmanager
+    def _file_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(".lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Sync: pick up what other processes appended since the last call (caller holds self.lock)
+    def _sync(self):
+        if self.dim is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            self.dim, self.dtype = meta["dim"], meta["dtype"]
+        try:
+            stat = os.stat(self._path("vectors.npy"))
+        except FileNotFoundError:
+            return
+        if (stat.st_dev, stat.st_ino) != self._vectors_id:
+            self.vectors = _open_array(self._path("vectors.npy"), None, None, "r+")
+            if self.dtype == "int8":
+                self.scales = _open_array(self._path("scales.npy"), None, None, "r+")
+            self._vectors_id = (stat.st_dev, stat.st_ino)
+        if os.path.exists(self.rows_path) and os.path.getsize(self.rows_path) > self._rows_offset:
+            with open(self.rows_path, "rb") as f:
+                f.seek(self._rows_offset)
+                data = f.read()
+            # A trailing line without its newline is still being written (or was cut short by a crash)
+            complete = data[:data.rfind(b"\n") + 1]
+            self.rows.extend(json.loads(line) for line in complete.decode("utf-8").splitlines() if line.strip())
+            self._rows_offset += len(complete)
+        self.count = min(len(self.rows), len(self.vectors))
+
+    def _allocate(self, capacity):
+        os.makedirs(self.directory, exist_ok=True)
+        vectors = _open_array(self._path("vectors.tmp.npy"), (capacity, self.dim), self.dtype, "w+")
+        if self.vectors is not None:
+            vectors[:self.count] = self.vectors[:self.count]
+            vectors.flush()
+        os.replace(self._path("vectors.tmp.npy"), self._path("vectors.npy"))
+        self.vectors = vectors
+        stat = os.stat(self._path("vectors.npy"))
+        self._vectors_id = (stat.st_dev, stat.st_ino)
+        if self.dtype == "int8":
+            scales = _open_array(self._path("scales.tmp.npy"), (capacity,), np.float32, "w+")
+            if self.scales is not None:
+                scales[:self.count] = self.scales[:self.count]
+                scales.flush()
+            os.replace(self._path("scales.tmp.npy"), self._path("scales.npy"))
+            self.scales = scales
+        self._write_meta()
+
+    def _encode(self, vectors):
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            return np.round(vectors / scales[:, np.newaxis]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(np.float16), None
+
+    # Add: returns the new row ids
+    def add(self, vectors, rows):
+        vectors = normalize(np.atleast_2d(vectors))
+        with self.lock, self._file_lock():
+            self._sync()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if self.vectors is None or self.count + len(vectors) > len(self.vectors):
+                capacity = max(_INITIAL_CAPACITY, len(self.vectors) if self.vectors is not None else 0)
+                while capacity < self.count + len(vectors):
+                    capacity *= 2
+                self._allocate(capacity)
+            start = self.count
+            encoded, scales = self._encode(vectors)
+            self.vectors[start:start + len(vectors)] = encoded
+            if scales is not None:
+                self.scales[start:start + len(vectors)] = scales
+            if os.path.exists(self.rows_path) and os.path.getsize(self.rows_path) > self._rows_offset:
+                # Only a crashed writer leaves an incomplete line behind while we hold the lock
+                os.truncate(self.rows_path, self._rows_offset)
+            if self._rows_file is None:
+                self._rows_file = open(self.rows_path, "ab")
+            data = "".join(json.dumps(row, default=str) + "\n" for row in rows).encode("utf-8")
+            self._rows_file.write(data)
+            self._rows_file.flush()
+            self._rows_offset += len(data)
+            self.rows.extend(rows)
+            self.count += len(vectors)
+            return list(range(start, self.count))
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype, "count": self.count}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def flush(self):
+        with self.lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+                self._write_meta()
+            if self.scales is not None:
+                self.scales.flush()
+
+    def snapshot(self):
+        with self.lock:
+            self._sync()
+            return _StoreView(self.vectors, self.scales, self.count, self.dtype)
+
+
+def _top_k(scores, ids, k):
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[best], ids[best]
+    order = np.argsort(-scores)
+    return scores[order], ids[order]
+
+
+# Brute Force: exact cosine similarity over every row of a store view, in float32 blocks
+def brute_force_search(view, query, k):
+    count = view.count
+    best_scores, best_ids = np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+    for start in range(0, count, _SCAN_BLOCK):
+        stop = min(start + _SCAN_BLOCK, count)
+        scores = view.decode(slice(start, stop)) @ query
+        scores, ids = _top_k(scores, np.arange(start, stop), k)
+        best_scores, best_ids = _top_k(np.concatenate([best_scores, scores]), np.concatenate([best_ids, ids]), k)
+    return best_scores, best_ids
+
+
+# IVF: spherical k-means cells; a query scans only the rows of its nprobe closest cells
+class IVFIndex:
+    def __init__(self, store):
+        self.store = store
+        self.centroids = None
+        self.lists = None
+        self.assigned = 0
+        self.trained_on = 0
+        path = store._path("ivf_centroids.npy")
+        if os.path.exists(path):
+            self.centroids = np.load(path)
+            # Trained with nlist = sqrt(rows), so this recovers the training size closely enough
+            self.trained_on = len(self.centroids) ** 2
+            self.assign_new()
+
+    def train(self, nlist=None, iterations=10, sample_size=None, seed=0):
+        view = self.store.snapshot()
+        count = view.count
+        nlist = nlist or max(8, int(np.sqrt(count)))
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(count, min(count, sample_size or 64 * nlist), replace=False))
+        sample = view.decode(sample_ids)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize(sums)
+        self.centroids = centroids.astype(np.float32)
+        self.trained_on = count
+        np.save(self.store._path("ivf_centroids.npy"), self.centroids)
+        self.lists, self.assigned = None, 0
+        self.assign_new(view)
+
+    # Assign rows added since the last call (up to the view's count) to their closest cell
+    def assign_new(self, view=None):
+        view = view or self.store.snapshot()
+        count = view.count
+        if self.lists is None:
+            self.lists = [[] for _ in range(len(self.centroids))]
+        for start in range(self.assigned, count, _SCAN_BLOCK):
+            stop = min(start + _SCAN_BLOCK, count)
+            cells = np.argmax(view.decode(slice(start, stop)) @ self.centroids.T, axis=1)
+            for row_id, cell in zip(range(start, stop), cells.tolist()):
+                self.lists[cell].append(row_id)
+        self.assigned = max(self.assigned, count)
+
+    def search(self, view, query, k, nprobe=IVF_NPROBE):
+        if self.assigned < view.count:
+            self.assign_new(view)
+        cells = np.argsort(-(self.centroids @ query))[:nprobe]
+        ids = np.fromiter((row_id for cell in cells for row_id in self.lists[cell]), dtype=np.int64)
+        if not len(ids):
+            return np.empty(0, dtype=np.float32), ids
+        ids.sort()
+        return _top_k(view.decode(ids) @ query, ids, k)
+
+
+# Embedding Index: store + search; brute force for small stores, IVF once it has been built
+class EmbeddingIndex:
+    def __init__(self, directory, dtype=EMBEDDING_DTYPE):
+        self.store = EmbeddingStore(directory, dtype)
+        self.ivf = IVFIndex(self.store) if self.store.count else None
+        self._search_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def __len__(self):
+        return self.store.count
+
+    def add(self, vectors, rows):
+        ids = self.store.add(vectors, rows)
+        self._maybe_rebuild()
+        return ids
+
+    # Train on a private IVFIndex and swap it in, so searches keep running meanwhile
+    def build_ivf(self, nlist=None):
+        ivf = IVFIndex(self.store)
+        ivf.train(nlist)
+        with self._search_lock:
+            self.ivf = ivf
+
+    # Background (re)training once the store passes IVF_MIN_ROWS and whenever it doubles after that
+    def _maybe_rebuild(self):
+        count = self.store.count
+        trained_on = self.ivf.trained_on if self.ivf is not None else 0
+        if count < IVF_MIN_ROWS or count < 2 * trained_on or not self._build_lock.acquire(blocking=False):
+            return
+
+        def worker():
+            try:
+                self.build_ivf()
+            except Exception as e:
+                print(f"Embedding index IVF build failed for {self.store.directory}: {e}")
+            finally:
+                self._build_lock.release()
+
+        threading.Thread(target=worker, name="embedding-ivf-build", daemon=True).start()
+
+    # Search: [{row_id, similarity, **row metadata}] for the k most similar stored images
+    def search(self, vector, k=SIMILAR_CASES, confirmed_only=False):
+        if not self.store.count:
+            return []
+        query = normalize(vector).reshape(-1)
+        fetch = k * 4 if confirmed_only else k
+        view = self.store.snapshot()
+        with self._search_lock:
+            use_ivf = self.ivf is not None and self.ivf.centroids is not None and view.count >= IVF_MIN_ROWS
+            scores, ids = self.ivf.search(view, query, fetch) if use_ivf else brute_force_search(view, query, fetch)
+        results = []
+        for score, row_id in zip(scores.tolist(), ids.tolist()):
+            row = self.store.rows[row_id]
+            if confirmed_only and not row.get("confirmed"):
+                continue
+            results.append(dict(row, row_id=row_id, similarity=round(score, 4)))
+            if len(results) == k:
+                break
+        return results
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+# Get Index: one per model version, since embeddings from different weights aren't comparable. Cascade
+# versions ("teacher+student@threshold") share the full model's index: its embeddings come from the teacher.
+def get_index(model_version):
+    model_version = model_version.split("+")[0]
+    index = _indexes.get(model_version)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(model_version)
+            if index is None:
+                index = EmbeddingIndex(os.path.join(EMBEDDING_INDEX_DIR, model_version))
+                _indexes[model_version] = index
+    return index
+
+
+# Has Embedding: False for the NaN rows a cascade returns for images its student answered
+def has_embedding(vector):
+    return vector is not None and bool(np.isfinite(vector).all())
+
+
+# Record: similar confirmed cases for a new prediction, then add it to the index. Other users' unconfirmed
+# uploads are never returned, since their labels are only the model's own guesses.
+def lookup_and_add(embedding, model_version, image_name, disease_name, k=SIMILAR_CASES):
+    index = get_index(model_version)
+    similar = index.search(embedding, k, confirmed_only=True)
+    row_id = index.add(embedding, [{"image_name": image_name, "disease_name": disease_name, "confirmed": False,
+                                    "source": "prediction", "timestamp": datetime.now().isoformat()}])[0]
+    return similar, row_id
+
+
+# Bulk Build: embed a class-per-folder split (e.g. train) with labels as confirmed diagnoses
+def build_from_directory(directory, model_path=None, batch_size=256):
+    import model_registry
+    import preprocessing
+
+    model_path = model_path or model_registry.MODEL_PATH
+    entry = model_registry.get_entry(model_path)
+    if not getattr(entry.backend, "supports_embeddings", False):
+        raise SystemExit(f"The {entry.backend.name} backend does not expose embeddings; use the Keras model.")
+    class_names, _, _ = preprocessing.list_directory(directory)
+    index = get_index(entry.version)
+    started = time.perf_counter()
+    added = 0
+    for images, labels, paths in preprocessing.iter_directory_batches(directory, batch_size):
+        _, embeddings = entry.predict_with_embeddings(images)
+        # Straight into the store: IVF is trained once at the end rather than as the build grows
+        index.store.add(embeddings, [{"image_name": os.path.relpath(path, directory), "disease_name": class_names[label],
+                                "confirmed": True, "source": os.path.basename(os.path.normpath(directory))}
+                               for label, path in zip(labels.tolist(), paths)])
+        added += len(paths)
+        print(f"Embedded {added} images ({added / (time.perf_counter() - started):.0f}/s)", end="\r")
+    print()
+    index.store.flush()
+    if len(index) >= IVF_MIN_ROWS:
+        index.build_ivf()
+    return index, added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the similar-cases embedding index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Embed a class-per-folder split, e.g. train")
+    build.add_argument("directory")
+    build.add_argument("--model", default=None)
+    build.add_argument("--batch-size", type=int, default=256)
+    query = subparsers.add_parser("query", help="Find the most similar stored images for an image file")
+    query.add_argument("image")
+    query.add_argument("-k", type=int, default=5)
+    query.add_argument("--confirmed-only", action="store_true")
+    subparsers.add_parser("build-ivf", help="(Re)train the IVF cells for the current model's index")
+    args = parser.parse_args()
+
+    import model_registry
+
+    if args.command == "build":
+        index, added = build_from_directory(args.directory, args.model, args.batch_size)
+        print(f"Added {added} images; index now holds {len(index)} rows")
+    elif args.command == "build-ivf":
+        index = get_index(model_registry.get_version())
+        index.build_ivf()
+        print(f"Trained {len(index.ivf.centroids)} IVF cells over {len(index)} rows")
+    else:
+        import preprocessing
+
+        entry = model_registry.get_entry()
+        _, embeddings = entry.predict_with_embeddings(preprocessing.decode_image(args.image)[np.newaxis])
+        started = time.perf_counter()
+        results = get_index(entry.version).search(embeddings[0], args.k, args.confirmed_only)
+        print(f"Search took {(time.perf_counter() - started) * 1000:.1f} ms")
+        for result in results:
+            print(f"{result['similarity']:.3f}  {result['disease_name']:45s} {result['image_name']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# export_model.py
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import inference_backends
+import preprocessing
+
+IMAGE_SIZE = (128, 128)
+
+
+# Sample: a shuffled subset of a class-per-folder split. Images are decoded by preprocessing, the same
+# PIL path serving uses, so calibration and accuracy reflect what the exported model will actually see.
+def _sample(data_dir, num_samples, seed=42):
+    _, paths, labels = preprocessing.list_directory(data_dir)
+    order = np.random.default_rng(seed).permutation(len(paths))[:num_samples]
+    return [paths[i] for i in order], labels[order]
+
+
+def _batches(data_dir, num_samples, batch_size, seed=42):
+    paths, labels = _sample(data_dir, num_samples, seed)
+    for start in range(0, len(paths), batch_size):
+        images, errors = preprocessing.decode_batch(paths[start:start + batch_size])
+        ok = np.array([error is None for error in errors])
+        yield images[ok], labels[start:start + batch_size][ok]
+
+
+# Calibration Data: a shuffled sample of the valid split for full-int8 quantization
+def representative_dataset(data_dir, num_samples):
+    def generator():
+        for images, _ in _batches(data_dir, num_samples, batch_size=1):
+            if len(images):
+                yield [images]
+    return generator
+
+
+def export_tflite(model, output_dir, valid_dir, calibration_samples):
+    artifacts = {}
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    artifacts["tflite_float32"] = converter.convert()
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    artifacts["tflite_dynamic_range"] = converter.convert()
+
+    if valid_dir and os.path.isdir(valid_dir):
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(valid_dir, calibration_samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+        artifacts["tflite_int8"] = converter.convert()
+    else:
+        print(f"Skipping full-int8 export: calibration directory '{valid_dir}' not found.")
+
+    paths = {}
+    for name, flatbuffer in artifacts.items():
+        path = os.path.join(output_dir, f"{name}.tflite")
+        with open(path, "wb") as f:
+            f.write(flatbuffer)
+        paths[name] = path
+    return paths
+
+
+# SavedModel with a fixed-shape serving signature so Grappler can fold and fuse the whole graph
+def export_savedmodel(model, output_dir):
+    path = os.path.join(output_dir, "savedmodel")
+
+    @tf.function(input_signature=[tf.TensorSpec([None, *IMAGE_SIZE, 3], tf.float32, name="image")])
+    def serve(image):
+        return {"probabilities": model(image, training=False)}
+
+    tf.saved_model.save(model, path, signatures={"serving_default": serve})
+    return path
+
+
+# ONNX export, only when tf2onnx is installed
+def export_onnx(model, output_dir):
+    try:
+        import tf2onnx
+    except ImportError:
+        print("Skipping ONNX export: tf2onnx is not installed.")
+        return None
+    path = os.path.join(output_dir, "model.onnx")
+    spec = (tf.TensorSpec([None, *IMAGE_SIZE, 3], tf.float32, name="image"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=path)
+    return path
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+# Runs in a fresh process per backend so RSS numbers are not polluted by the others
+def _measure(args):
+    name, path, backend, valid_dir, eval_samples, latency_runs = args
+    rss_before = _rss_mb()
+    model = inference_backends.load_backend(path, backend)
+    rss_loaded = _rss_mb()
+
+    sample = np.random.default_rng(0).uniform(0, 255, (1, *IMAGE_SIZE, 3)).astype(np.float32)
+    model.predict(sample)
+    timings = []
+    for _ in range(latency_runs):
+        started = time.perf_counter()
+        model.predict(sample)
+        timings.append((time.perf_counter() - started) * 1000.0)
+
+    accuracy = None
+    if valid_dir and os.path.isdir(valid_dir):
+        correct = total = 0
+        for images, labels in _batches(valid_dir, eval_samples, batch_size=32):
+            if not len(images):
+                continue
+            predicted = np.argmax(model.predict(images), axis=1)
+            correct += int(np.sum(predicted == labels))
+            total += len(predicted)
+        accuracy = correct / total if total else None
+
+    return {
+        "artifact": name,
+        "path": path,
+        "backend": backend,
+        "size_mb": round(sum(os.path.getsize(p) for p in _files(path)) / 1e6, 2),
+        "accuracy": accuracy,
+        "latency_ms_p50": round(float(np.percentile(timings, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(timings, 95)), 3),
+        "rss_model_mb": round(rss_loaded - rss_before, 1),
+        "rss_peak_mb": round(_rss_mb(), 1),
+    }
+
+
+def _files(path):
+    if os.path.isdir(path):
+        return [os.path.join(root, n) for root, _, names in os.walk(path) for n in names]
+    return [path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export optimized inference artifacts and compare backends.")
+    parser.add_argument("--model", default="trained_model.keras")
+    parser.add_argument("--output-dir", default="exported")
+    parser.add_argument("--valid-dir", default="valid")
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    parser.add_argument("--eval-samples", type=int, default=2000)
+    parser.add_argument("--latency-runs", type=int, default=50)
+    parser.add_argument("--history", default="training_hist.json")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    model = tf.keras.models.load_model(args.model)
+
+    artifacts = [("keras", args.model, "keras")]
+    artifacts.append(("savedmodel", export_savedmodel(model, args.output_dir), "savedmodel"))
+    for name, path in export_tflite(model, args.output_dir, args.valid_dir, args.calibration_samples).items():
+        artifacts.append((name, path, "tflite"))
+    onnx_path = export_onnx(model, args.output_dir)
+    if onnx_path:
+        try:
+            import onnxruntime  # noqa: F401
+            artifacts.append(("onnx", onnx_path, "onnx"))
+        except ImportError:
+            print("Skipping ONNX Runtime measurement: onnxruntime is not installed.")
+
+    reference_accuracy = None
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            reference_accuracy = json.load(f)["val_accuracy"][-1]
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for name, path, backend in artifacts:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(_measure, ((name, path, backend, args.valid_dir, args.eval_samples,
+                                            args.latency_runs),))
+        if reference_accuracy is not None and result["accuracy"] is not None:
+            result["accuracy_delta_vs_history"] = round(result["accuracy"] - reference_accuracy, 4)
+        results.append(result)
+        print(f"{name:22s} acc={result['accuracy']} p50={result['latency_ms_p50']}ms "
+              f"size={result['size_mb']}MB rss={result['rss_model_mb']}MB")
+
+    report = {"reference_val_accuracy": reference_accuracy, "results": results}
+    report_path = os.path.join(args.output_dir, "export_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}")
+    print("Serve an artifact with e.g. MODEL_PATH=exported/tflite_int8.tflite streamlit run main.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# inference_backends.py
+
+import os
+import threading
+
+import numpy as np
+
+# Backend Settings: keras | savedmodel | tflite | onnx (empty = pick from the file extension)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "")
+TFLITE_THREADS = int(os.getenv("TFLITE_THREADS", str(os.cpu_count() or 1)))
+
+
+# TensorFlow is imported by the backends that need it, when a model is first loaded,
+# so importing this module (and model_registry) stays cheap
+def _tf():
+    import tensorflow as tf
+    return tf
+
+
+# Keras model file (.keras / .h5)
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, path):
+        tf = _tf()
+        self.model = tf.keras.models.load_model(path)
+        # Same forward pass, second output: the last Dense layer before the classifier (the
+        # Dense(1500) feature vector) for the similar-cases index
+        self.embedding_model = None
+        dense = [layer for layer in self.model.layers[:-1] if isinstance(layer, tf.keras.layers.Dense)]
+        if dense:
+            self.embedding_model = tf.keras.Model(self.model.inputs, [self.model.outputs[0], dense[-1].output])
+
+    @property
+    def supports_embeddings(self):
+        return self.embedding_model is not None
+
+    def predict(self, batch):
+        return np.asarray(self.model(batch, training=False))
+
+    # (probabilities, embeddings) from one forward pass
+    def predict_with_embeddings(self, batch):
+        probabilities, embeddings = self.embedding_model(batch, training=False)
+        return np.asarray(probabilities), np.asarray(embeddings)
+
+
+# SavedModel directory written by export_model.py
+class SavedModelBackend:
+    name = "savedmodel"
+
+    def __init__(self, path):
+        self.tf = _tf()
+        self.model = self.tf.saved_model.load(path)
+        self.serve = self.model.signatures["serving_default"]
+        self.output_key = list(self.serve.structured_outputs)[0]
+
+    def predict(self, batch):
+        outputs = self.serve(self.tf.constant(batch, dtype=self.tf.float32))
+        return outputs[self.output_key].numpy()
+
+
+# TFLite flatbuffer (float32, dynamic-range or full-int8)
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, path, num_threads=TFLITE_THREADS):
+        try:
+            # The standalone runtime avoids importing all of TensorFlow
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = _tf().lite.Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = 1
+        # The interpreter owns a single set of tensors, so calls are serialized
+        self._lock = threading.Lock()
+
+    def _quantize(self, batch):
+        dtype = self.input["dtype"]
+        if dtype == np.float32:
+            return batch.astype(np.float32, copy=False)
+        scale, zero_point = self.input["quantization"]
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output):
+        if self.output["dtype"] == np.float32:
+            return output
+        scale, zero_point = self.output["quantization"]
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def predict(self, batch):
+        batch = np.asarray(batch)
+        with self._lock:
+            if batch.shape[0] != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self.input = self.interpreter.get_input_details()[0]
+                self.output = self.interpreter.get_output_details()[0]
+                self.batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self.input["index"], self._quantize(batch))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output["index"]).copy()
+        return self._dequantize(output)
+
+
+# ONNX model, only when onnxruntime is installed
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+BACKENDS = {
+    "keras": KerasBackend,
+    "savedmodel": SavedModelBackend,
+    "tflite": TFLiteBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def backend_for_path(path):
+    if path.endswith(".tflite"):
+        return "tflite"
+    if path.endswith(".onnx"):
+        return "onnx"
+    if os.path.isdir(path):
+        return "savedmodel"
+    return "keras"
+
+
+# Load Backend: explicit name, else MODEL_BACKEND, else inferred from the artifact
+def load_backend(path, backend=None):
+    name = backend or MODEL_BACKEND or backend_for_path(path)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{name}'. Choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[name](path)
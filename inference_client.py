@@ -0,0 +1,218 @@
+# inference_client.py
+
+import http.client
+import io
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import model_registry
+
+# Inference Client Settings: empty URL = always run the model in this process
+INFERENCE_SERVICE_URL = os.getenv("INFERENCE_SERVICE_URL", "")  # e.g. http://127.0.0.1:8601
+INFERENCE_SERVICE_TIMEOUT = float(os.getenv("INFERENCE_SERVICE_TIMEOUT", "10"))  # seconds per request
+INFERENCE_SERVICE_RECHECK = float(os.getenv("INFERENCE_SERVICE_RECHECK", "10"))  # seconds between readiness probes
+_PROBE_TIMEOUT = 0.5
+
+NPZ_TYPE = "application/x-npz"
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+# Client: one keep-alive connection per thread; readiness is probed at most every RECHECK seconds,
+# so an absent service costs one short connect attempt per interval rather than one per prediction
+class InferenceClient:
+    def __init__(self, url=INFERENCE_SERVICE_URL, timeout=INFERENCE_SERVICE_TIMEOUT,
+                 recheck=INFERENCE_SERVICE_RECHECK):
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.recheck = recheck
+        self.version = None
+        self._up = False
+        self._checked_at = 0.0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "images": 0, "errors": 0, "fallbacks": 0, "request_ms_total": 0.0}
+
+    def _connection(self, timeout):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _request(self, method, path, body=None, headers=None, timeout=None):
+        timeout = timeout or self.timeout
+        # A kept-alive connection the server has since closed fails on first use; retry once on a fresh one
+        for attempt in (1, 2):
+            connection = self._connection(timeout)
+            reused = connection.sock is not None
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                payload = response.read()
+                if response.getheader("Connection", "").lower() == "close":
+                    self._drop_connection()
+                return response.status, response.getheader("Content-Type", ""), payload
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                self._drop_connection()
+                if attempt == 2 or not reused:
+                    raise ServiceUnavailable(f"{type(e).__name__}: {e}")
+            except (OSError, http.client.HTTPException) as e:
+                self._drop_connection()
+                raise ServiceUnavailable(f"{type(e).__name__}: {e}")
+
+    def mark_down(self):
+        self._up = False
+        self._checked_at = time.monotonic()
+
+    # Available: cached readiness probe
+    def available(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.recheck:
+            return self._up
+        self._checked_at = now
+        try:
+            status, _, payload = self._request("GET", "/readyz", timeout=_PROBE_TIMEOUT)
+            self._up = status == 200
+            if self._up:
+                self.version = json.loads(payload)["model_version"]
+        except (ServiceUnavailable, ValueError, KeyError):
+            self._up = False
+        return self._up
+
+    # Predict: (N, H, W, 3) pixel values -> (probabilities, embeddings or None). Pixel values from
+    # preprocessing are whole numbers, so they travel as uint8 (a quarter of the float32 size).
+    def predict(self, images, embeddings=False):
+        images = np.asarray(images)
+        if images.dtype != np.uint8:
+            as_uint8 = images.astype(np.uint8)
+            if np.array_equal(as_uint8, images):
+                images = as_uint8
+        buffer = io.BytesIO()
+        np.savez(buffer, images=images)
+        return self._predict_body(buffer.getvalue(), NPZ_TYPE, len(images), embeddings)
+
+    def _predict_body(self, body, content_type, count, embeddings):
+        started = time.perf_counter()
+        try:
+            status, _, payload = self._request(
+                "POST", "/predict?embeddings=1" if embeddings else "/predict", body, {"Content-Type": content_type})
+            if status != 200:
+                raise ServiceUnavailable(f"HTTP {status}: {payload[:200].decode('utf-8', 'replace')}")
+        except ServiceUnavailable:
+            with self._stats_lock:
+                self._stats["errors"] += 1
+            raise
+        with np.load(io.BytesIO(payload), allow_pickle=False) as archive:
+            probabilities = archive["probabilities"]
+            vectors = archive["embeddings"] if "embeddings" in archive.files else None
+            # Picks up a model hot-swapped inside the service
+            self.version = str(archive["model_version"])
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["images"] += count
+            self._stats["request_ms_total"] += (time.perf_counter() - started) * 1000.0
+        return probabilities, vectors
+
+    def record_fallback(self):
+        with self._stats_lock:
+            self._stats["fallbacks"] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["avg_request_ms"] = s["request_ms_total"] / s["requests"] if s["requests"] else 0.0
+        s["available"] = self._up
+        return s
+
+
+# Service Predictor: the model_registry entry interface (predict, predict_with_embeddings, version) backed by
+# the service; any failure marks the service down and answers that call in-process. version is the model
+# that answered the last call (the local one after a fallback), so logs and cache keys match the results.
+class ServicePredictor:
+    def __init__(self, client, path=model_registry.MODEL_PATH):
+        self.client = client
+        self.path = path
+        self._version = None
+
+    @property
+    def version(self):
+        return self._version or self.client.version
+
+    def _local(self, batch, embeddings):
+        self.client.record_fallback()
+        predictor = model_registry.get_predictor(self.path)
+        if embeddings and hasattr(predictor, "predict_with_embeddings"):
+            probabilities, vectors = predictor.predict_with_embeddings(batch)
+        else:
+            probabilities, vectors = predictor.predict(batch), None
+        return probabilities, vectors, predictor.version
+
+    # Predict Versioned: (probabilities, embeddings or None, version of the model that answered)
+    def predict_versioned(self, batch, embeddings=False):
+        try:
+            probabilities, vectors = self.client.predict(batch, embeddings)
+            result = probabilities, vectors, self.client.version
+        except ServiceUnavailable as e:
+            print(f"Inference service unavailable ({e}); predicting in-process")
+            self.client.mark_down()
+            result = self._local(batch, embeddings)
+        self._version = result[2]
+        return result
+
+    def predict_with_embeddings(self, batch):
+        return self.predict_versioned(batch, True)[:2]
+
+    def predict(self, batch):
+        return self.predict_versioned(batch)[0]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# Get Client (None when no service URL is configured)
+def get_client():
+    global _client
+    if not INFERENCE_SERVICE_URL:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient()
+    return _client
+
+
+# Remote Predictor: a ServicePredictor when the service is configured and ready, else None
+def remote_predictor(path=model_registry.MODEL_PATH):
+    client = get_client()
+    if client is None or path != model_registry.MODEL_PATH or not client.available():
+        return None
+    return ServicePredictor(client, path)
+
+
+# Get Predictor / Get Version: the service when it's up, otherwise the in-process model
+def get_predictor(path=model_registry.MODEL_PATH):
+    return remote_predictor(path) or model_registry.get_predictor(path)
+
+
+def get_version(path=model_registry.MODEL_PATH):
+    return get_predictor(path).version
@@ -0,0 +1,171 @@
+# inference_engine.py
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+import model_registry
+
+# Batching Settings
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH", "32"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+NUM_THREADS = int(os.getenv("INFERENCE_THREADS", "2"))
+
+
+class _Request:
+    __slots__ = ("image", "future", "enqueued_at")
+
+    def __init__(self, image):
+        self.image = image
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+# Coalesces single-image requests from all sessions into batched forward passes
+class InferenceEngine:
+    def __init__(self, model_path=model_registry.MODEL_PATH, max_batch_size=MAX_BATCH_SIZE,
+                 max_wait_ms=MAX_WAIT_MS, num_threads=NUM_THREADS):
+        self.model_path = model_path
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="inference")
+        # Limit in-flight batches to the pool size so new requests pile up into fuller batches
+        self._slots = threading.Semaphore(num_threads)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "batched_images": 0,
+            "queue_wait_ms_total": 0.0,
+            "queue_wait_ms_max": 0.0,
+            "inference_ms_total": 0.0,
+            "errors": 0,
+        }
+        self._running = True
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="inference-batcher", daemon=True)
+        self._dispatcher.start()
+
+    # Submit one preprocessed (128, 128, 3) image; returns a Future of its softmax vector
+    def submit(self, image):
+        if not self._running:
+            raise RuntimeError("Inference engine is shut down.")
+        request = _Request(image)
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, image, timeout=None):
+        return self.submit(image).result(timeout=timeout)
+
+    # (softmax vector, feature embedding or None) from the same batched forward pass
+    def predict_with_embedding(self, image, timeout=None):
+        future = self.submit(image)
+        probabilities = future.result(timeout=timeout)
+        return probabilities, getattr(future, "embedding", None)
+
+    def predict_many(self, images, timeout=None):
+        futures = [self.submit(image) for image in images]
+        return np.stack([f.result(timeout=timeout) for f in futures])
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _dispatch_loop(self):
+        while True:
+            self._slots.acquire()
+            batch = self._collect_batch()
+            if batch is None:
+                self._slots.release()
+                return
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            entry = model_registry.get_predictor(self.model_path)
+            images = np.stack([request.image for request in batch]).astype(np.float32, copy=False)
+            embeddings = None
+            if hasattr(entry, "predict_with_embeddings"):
+                probabilities, embeddings = entry.predict_with_embeddings(images)
+            else:
+                probabilities = entry.predict(images)
+            for i, (request, row) in enumerate(zip(batch, probabilities)):
+                # Attached before set_result so waiters always see it
+                request.future.embedding = embeddings[i] if embeddings is not None else None
+                request.future.set_result(row)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            with self._stats_lock:
+                self._stats["errors"] += 1
+        finally:
+            self._slots.release()
+            finished = time.perf_counter()
+            waits = [(started - request.enqueued_at) * 1000.0 for request in batch]
+            metrics.observe("app_stage_seconds", finished - started, stage="inference_batch")
+            for wait_ms in waits:
+                metrics.observe("app_stage_seconds", wait_ms / 1000.0, stage="inference_queue")
+            with self._stats_lock:
+                self._stats["requests"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["batched_images"] += len(batch)
+                self._stats["queue_wait_ms_total"] += sum(waits)
+                self._stats["queue_wait_ms_max"] = max(self._stats["queue_wait_ms_max"], max(waits))
+                self._stats["inference_ms_total"] += (finished - started) * 1000.0
+
+    # Counters for tuning max batch size / max wait
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        batches = s["batches"] or 1
+        requests = s["requests"] or 1
+        s["avg_batch_size"] = s["batched_images"] / batches
+        s["batch_fill_ratio"] = s["batched_images"] / (batches * self.max_batch_size)
+        s["avg_queue_wait_ms"] = s["queue_wait_ms_total"] / requests
+        s["avg_batch_inference_ms"] = s["inference_ms_total"] / batches
+        s["queue_depth"] = self._queue.qsize()
+        s["max_batch_size"] = self.max_batch_size
+        s["max_wait_ms"] = self.max_wait * 1000.0
+        return s
+
+    def shutdown(self, wait=True):
+        self._running = False
+        self._queue.put(None)
+        if wait:
+            self._dispatcher.join()
+        self._executor.shutdown(wait=wait)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# Get Engine (one shared engine per process)
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = InferenceEngine()
+    return _engine
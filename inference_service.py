@@ -0,0 +1,539 @@
+# inference_service.py
+
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import metrics
+import preprocessing
+
+# Inference Service Settings (inference_client.py talks to it; INFERENCE_SERVICE_URL on the app side)
+SERVICE_HOST = os.getenv("INFERENCE_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("INFERENCE_SERVICE_PORT", "8601"))
+SERVICE_WORKERS = int(os.getenv("INFERENCE_SERVICE_WORKERS", str(max(1, (os.cpu_count() or 1) // 4))))
+SERVICE_MAX_BATCH = int(os.getenv("INFERENCE_SERVICE_MAX_BATCH", "32"))
+SERVICE_MAX_WAIT_MS = float(os.getenv("INFERENCE_SERVICE_MAX_WAIT_MS", "5"))
+SERVICE_DRAIN_TIMEOUT = float(os.getenv("INFERENCE_SERVICE_DRAIN_TIMEOUT", "30"))
+SERVICE_MAX_BODY_MB = float(os.getenv("INFERENCE_SERVICE_MAX_BODY_MB", "64"))
+SERVICE_REQUEST_TIMEOUT = float(os.getenv("INFERENCE_SERVICE_REQUEST_TIMEOUT", "8"))  # seconds; answered with 504
+SERVICE_RESTART_BACKOFF = float(os.getenv("INFERENCE_SERVICE_RESTART_BACKOFF", "1"))  # first retry delay, doubles
+
+IMAGE_SHAPE = (preprocessing.IMAGE_SIZE[1], preprocessing.IMAGE_SIZE[0], 3)
+NPZ_TYPE = "application/x-npz"
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+            500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+# Core Sets: split the cores this process may use evenly between the workers
+def core_sets(workers):
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return [None] * workers
+    per_worker = max(1, len(cores) // workers)
+    return [cores[(i * per_worker) % len(cores):(i * per_worker) % len(cores) + per_worker] for i in range(workers)]
+
+
+# Worker Process: one model per process, pinned to its cores. Images arrive in a shared (max_batch, H, W, 3)
+# float32 block written by the server; results go back through a second shared block the worker creates
+# once it knows the output sizes. Only small control tuples cross the pipe.
+def _worker_main(conn, input_name, max_batch, cores, model_path):
+    # Shutdown is driven by the server (Ctrl+C reaches the whole process group)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    threads = str(len(cores)) if cores else str(os.cpu_count() or 1)
+    if cores:
+        os.sched_setaffinity(0, cores)
+    # Before TensorFlow/TFLite are imported, so the runtimes size their thread pools to the pinned cores
+    for name in ("OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS", "TFLITE_THREADS"):
+        os.environ[name] = threads
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+    input_block = output_block = None
+    try:
+        import model_registry
+
+        input_block = shared_memory.SharedMemory(name=input_name)
+        images = np.ndarray((max_batch, *IMAGE_SHAPE), dtype=np.float32, buffer=input_block.buf)
+        predictor = model_registry.get_predictor(model_path)
+        supports_embeddings = hasattr(predictor, "predict_with_embeddings")
+        if supports_embeddings:
+            probabilities, embeddings = predictor.predict_with_embeddings(images[:1])
+        else:
+            probabilities, embeddings = predictor.predict(images[:1]), None
+        classes = probabilities.shape[1]
+        dim = embeddings.shape[1] if embeddings is not None else 0
+        output_block = shared_memory.SharedMemory(create=True, size=max_batch * (classes + dim) * 4)
+        outputs = np.ndarray((max_batch, classes + dim), dtype=np.float32, buffer=output_block.buf)
+        conn.send(("ready", output_block.name, classes, dim, predictor.version, os.getpid()))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+
+    try:
+        while True:
+            command = conn.recv()
+            if command is None:
+                break
+            count, want_embeddings = command
+            try:
+                # The registry hot-swaps the model when its file changes, so look the predictor up per batch
+                predictor = model_registry.get_predictor(model_path)
+                if want_embeddings and supports_embeddings:
+                    probabilities, embeddings = predictor.predict_with_embeddings(images[:count])
+                else:
+                    probabilities, embeddings = predictor.predict(images[:count]), None
+                outputs[:count, :classes] = probabilities
+                if embeddings is not None:
+                    outputs[:count, classes:] = embeddings
+                conn.send(("ok", predictor.version, embeddings is not None))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        input_block.close()
+        output_block.close()
+
+
+class WorkerError(Exception):
+    pass
+
+
+# Worker: the server-side handle of one worker process and its two shared memory blocks
+class Worker:
+    def __init__(self, index, cores, model_path, max_batch):
+        self.index = index
+        self.cores = cores
+        self.model_path = model_path
+        self.max_batch = max_batch
+        self.input_block = shared_memory.SharedMemory(create=True, size=max_batch * int(np.prod(IMAGE_SHAPE)) * 4)
+        self.images = np.ndarray((max_batch, *IMAGE_SHAPE), dtype=np.float32, buffer=self.input_block.buf)
+        self.output_block = self.outputs = None
+        self.process = self.conn = None
+        self.classes = self.dim = 0
+        self.version = None
+        self.batches = 0
+
+    # Start: spawn (TensorFlow isn't fork-safe) and block until the model is loaded and warmed up
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, name=f"inference-worker-{self.index}", daemon=True,
+                                       args=(child, self.input_block.name, self.max_batch, self.cores,
+                                             self.model_path))
+        self.process.start()
+        child.close()
+        message = self.conn.recv()
+        if message[0] != "ready":
+            self.process.join()
+            raise WorkerError(f"Worker {self.index} failed to start: {message[1]}")
+        _, output_name, self.classes, self.dim, self.version, _ = message
+        self._release_output()
+        self.output_block = shared_memory.SharedMemory(name=output_name)
+        self.outputs = np.ndarray((self.max_batch, self.classes + self.dim), dtype=np.float32,
+                                  buffer=self.output_block.buf)
+        return self
+
+    # Run: the first `count` rows of self.images through the model; returns (probabilities, embeddings or None)
+    def run(self, count, want_embeddings):
+        try:
+            self.conn.send((count, want_embeddings))
+            reply = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerError(f"Worker {self.index} exited: {e}")
+        if reply[0] != "ok":
+            raise WorkerError(reply[1])
+        _, self.version, has_embeddings = reply
+        self.batches += 1
+        probabilities = self.outputs[:count, :self.classes].copy()
+        embeddings = self.outputs[:count, self.classes:].copy() if has_embeddings else None
+        return probabilities, embeddings
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def _release_output(self):
+        if self.output_block is not None:
+            self.outputs = None
+            self.output_block.close()
+            self.output_block.unlink()
+            self.output_block = None
+
+    def stop(self, timeout=5.0):
+        if self.process is not None:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.conn.close()
+            self.process = None
+        self._release_output()
+
+    def close(self):
+        self.stop()
+        self.images = None
+        self.input_block.close()
+        self.input_block.unlink()
+
+
+class _Item:
+    __slots__ = ("image", "want_embeddings", "future", "enqueued_at")
+
+    def __init__(self, image, want_embeddings, future):
+        self.image = image
+        self.want_embeddings = want_embeddings
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+# Inference Service: asyncio HTTP front end; single images from concurrent requests are coalesced into
+# batches of up to max_batch and handed to whichever worker process is free
+class InferenceService:
+    def __init__(self, model_path, workers=SERVICE_WORKERS, max_batch=SERVICE_MAX_BATCH,
+                 max_wait_ms=SERVICE_MAX_WAIT_MS, max_body_mb=SERVICE_MAX_BODY_MB,
+                 request_timeout=SERVICE_REQUEST_TIMEOUT):
+        self.model_path = model_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.request_timeout = request_timeout
+        self.max_body = int(max_body_mb * 2**20)
+        self.workers = [Worker(i, cores, model_path, max_batch) for i, cores in enumerate(core_sets(workers))]
+        self.draining = False
+        self.ready = False
+        self.in_flight = 0
+        self.started_at = time.time()
+        self._stats = {"requests": 0, "images": 0, "batches": 0, "errors": 0, "rejected_draining": 0,
+                       "timed_out": 0, "worker_restarts": 0, "worker_restart_failures": 0}
+        # One thread per worker waits on its pipe; decoding JPEG bodies runs on the preprocessing pool
+        self._pipe_executor = ThreadPoolExecutor(max_workers=len(self.workers), thread_name_prefix="worker-pipe")
+        self._queue = None
+        self._free = None
+        self._server = None
+        self._drained = None
+        self._connections = set()
+
+    @property
+    def version(self):
+        versions = [worker.version for worker in self.workers if worker.version]
+        return versions[0] if versions else None
+
+    async def start(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._free = asyncio.Queue()
+        self._drained = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle_connection, host, port, limit=64 * 1024)
+        print(f"Inference service listening on http://{host}:{port} ({len(self.workers)} workers)")
+        # Workers load in parallel; /healthz answers meanwhile and /readyz flips once they are up
+        await asyncio.gather(*(loop.run_in_executor(self._pipe_executor, worker.start) for worker in self.workers))
+        for worker in self.workers:
+            print(f"Worker {worker.index} ready on cores {worker.cores} (model {worker.version})")
+            self._free.put_nowait(worker)
+        self.ready = True
+        loop.create_task(self._batch_loop())
+
+    # Batching: items whose request already timed out (future cancelled) are skipped
+    async def _next_item(self, timeout=None):
+        while True:
+            item = await (asyncio.wait_for(self._queue.get(), timeout) if timeout is not None else self._queue.get())
+            if not item.future.done():
+                return item
+
+    async def _collect(self):
+        batch = [await self._next_item()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                if self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+                if not item.future.done():
+                    batch.append(item)
+                continue
+            try:
+                batch.append(await self._next_item(remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Waiting for a free worker first lets requests pile up into fuller batches under load
+            worker = await self._free.get()
+            batch = await self._collect()
+            loop.create_task(self._run_batch(worker, batch))
+
+    async def _run_batch(self, worker, batch):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        error = None
+        try:
+            for i, item in enumerate(batch):
+                np.copyto(worker.images[i], item.image, casting="unsafe")
+            want_embeddings = any(item.want_embeddings for item in batch)
+            probabilities, embeddings = await loop.run_in_executor(
+                self._pipe_executor, worker.run, len(batch), want_embeddings)
+            for i, item in enumerate(batch):
+                if not item.future.done():
+                    # Batches mix requests; only those that asked for embeddings get them
+                    embedding = embeddings[i] if embeddings is not None and item.want_embeddings else None
+                    item.future.set_result((probabilities[i], embedding))
+        except Exception as e:
+            self._stats["errors"] += 1
+            error = e
+        finally:
+            # Whatever went wrong, no request of this batch is left waiting
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(error or WorkerError(f"Worker {worker.index} batch aborted"))
+            finished = time.perf_counter()
+            metrics.observe("app_stage_seconds", finished - started, stage="service_batch")
+            for item in batch:
+                metrics.observe("app_stage_seconds", started - item.enqueued_at, stage="service_queue")
+            self._stats["batches"] += 1
+            self._stats["images"] += len(batch)
+        if error is not None and not worker.is_alive():
+            await self._restart(worker, error)
+        else:
+            self._free.put_nowait(worker)
+
+    # Restart: replace a dead worker process, retrying with backoff until it comes up (or the service drains),
+    # then return its slot to the free pool
+    async def _restart(self, worker, reason):
+        loop = asyncio.get_running_loop()
+        delay = SERVICE_RESTART_BACKOFF
+        print(f"Worker {worker.index} died ({reason}); restarting")
+        while not self.draining:
+            self._stats["worker_restarts"] += 1
+            try:
+                await loop.run_in_executor(self._pipe_executor, lambda: (worker.stop(), worker.start()))
+            except Exception as e:
+                self._stats["worker_restart_failures"] += 1
+                print(f"Worker {worker.index} restart failed: {e}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            self._free.put_nowait(worker)
+            return
+
+    # Predict: waits at most request_timeout for the batches; cancelled items are dropped from the queue
+    async def predict(self, images, want_embeddings):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for image in images:
+            future = loop.create_future()
+            self._queue.put_nowait(_Item(image, want_embeddings, future))
+            futures.append(future)
+        results = await asyncio.wait_for(asyncio.gather(*futures), self.request_timeout)
+        probabilities = np.stack([result[0] for result in results])
+        embeddings = None
+        # None when the model has no feature output
+        if want_embeddings and results and all(result[1] is not None for result in results):
+            embeddings = np.stack([result[1] for result in results])
+        return probabilities, embeddings
+
+    # Request Bodies: a .npz with an "images" (N, H, W, 3) array (uint8 or float32 pixel values, as
+    # preprocessing produces), or one encoded JPEG/PNG image
+    async def _decode_body(self, content_type, body):
+        if content_type.startswith(NPZ_TYPE):
+            with np.load(io.BytesIO(body), allow_pickle=False) as archive:
+                images = archive["images"]
+            if images.ndim == 3:
+                images = images[np.newaxis]
+            if images.shape[1:] != IMAGE_SHAPE:
+                raise ValueError(f"Expected images of shape (N, {', '.join(map(str, IMAGE_SHAPE))}), "
+                                 f"got {images.shape}")
+            return images
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(preprocessing.get_executor(), preprocessing.decode_image, body)
+        return image[np.newaxis]
+
+    async def _predict_response(self, query, headers, body):
+        if self.draining:
+            self._stats["rejected_draining"] += 1
+            return 503, {"error": "draining"}, None
+        if not self.ready:
+            return 503, {"error": "not ready"}, None
+        self._stats["requests"] += 1
+        self.in_flight += 1
+        try:
+            try:
+                images = await self._decode_body(headers.get("content-type", ""), body)
+            except Exception as e:
+                return 400, {"error": f"Could not read images: {e}"}, None
+            want_embeddings = query.get("embeddings", ["0"])[0] == "1"
+            try:
+                probabilities, embeddings = await self.predict(images, want_embeddings)
+            except asyncio.TimeoutError:
+                self._stats["timed_out"] += 1
+                return 504, {"error": f"No result within {self.request_timeout:g}s"}, None
+            except Exception as e:
+                return 500, {"error": str(e)}, None
+            if "application/json" in headers.get("accept", ""):
+                payload = {"model_version": self.version, "probabilities": probabilities.tolist()}
+                if embeddings is not None:
+                    payload["embeddings"] = embeddings.tolist()
+                return 200, payload, None
+            buffer = io.BytesIO()
+            arrays = {"probabilities": probabilities, "model_version": np.array(self.version)}
+            if embeddings is not None:
+                arrays["embeddings"] = embeddings
+            np.savez(buffer, **arrays)
+            return 200, buffer.getvalue(), NPZ_TYPE
+        finally:
+            self.in_flight -= 1
+            if self.draining and not self.in_flight:
+                self._drained.set()
+
+    def stats(self):
+        s = dict(self._stats)
+        s.update(ready=self.ready, draining=self.draining, in_flight=self.in_flight, queue_depth=self._queue.qsize(),
+                 workers=len(self.workers), workers_alive=sum(worker.is_alive() for worker in self.workers),
+                 max_batch=self.max_batch, max_wait_ms=self.max_wait * 1000.0, model_version=self.version,
+                 avg_batch_size=s["images"] / s["batches"] if s["batches"] else 0.0,
+                 uptime_s=round(time.time() - self.started_at, 1))
+        return s
+
+    # HTTP/1.1 with keep-alive; only what the client and curl need (Content-Length bodies, no chunking)
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0") or 0)
+                if length > self.max_body:
+                    await self._respond(writer, 413, {"error": f"Body over {self.max_body} bytes"}, None, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                              and not self.draining)
+                status, payload, content_type = await self._route(method, target, headers, body)
+                await self._respond(writer, status, payload, content_type, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _route(self, method, target, headers, body):
+        url = urlsplit(target)
+        if url.path == "/predict":
+            if method != "POST":
+                return 405, {"error": "POST an image or .npz body"}, None
+            return await self._predict_response(parse_qs(url.query), headers, body)
+        if method != "GET":
+            return 405, {"error": "Method not allowed"}, None
+        if url.path == "/healthz":
+            return 200, {"status": "ok", "pid": os.getpid()}, None
+        if url.path == "/readyz":
+            ready = self.ready and not self.draining and any(worker.is_alive() for worker in self.workers)
+            return (200 if ready else 503), {"ready": ready, "draining": self.draining,
+                                             "model_version": self.version, "max_batch": self.max_batch}, None
+        if url.path == "/stats":
+            return 200, self.stats(), None
+        if url.path == "/metrics":
+            return 200, metrics.render().encode(), "text/plain; version=0.0.4"
+        return 404, {"error": f"No route for {url.path}"}, None
+
+    async def _respond(self, writer, status, payload, content_type, keep_alive):
+        if content_type is None:
+            payload, content_type = json.dumps(payload).encode(), "application/json"
+        writer.write((f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                      f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                      f"\r\n").encode("latin-1") + payload)
+        await writer.drain()
+
+    # Drain: fail readiness and refuse new predictions at once, let in-flight requests finish
+    # (up to timeout), then stop listening and shut the workers down
+    async def drain(self, timeout=SERVICE_DRAIN_TIMEOUT):
+        if self.draining:
+            return
+        self.draining = True
+        print(f"Draining: {self.in_flight} requests in flight")
+        if self.in_flight:
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout)
+            except asyncio.TimeoutError:
+                print(f"Drain timed out with {self.in_flight} requests in flight")
+        self._server.close()
+        # Idle keep-alive connections end with EOF instead of being cancelled mid-read at shutdown
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.sleep(0.1)
+        await self._server.wait_closed()
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self._pipe_executor.shutdown(wait=False)
+
+
+async def serve(args):
+    service = InferenceService(args.model, args.workers, args.max_batch, args.max_wait_ms,
+                               request_timeout=args.request_timeout)
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop.set))
+    try:
+        await service.start(args.host, args.port)
+        await stop.wait()
+        await service.drain(args.drain_timeout)
+    finally:
+        service.close()
+        print("Inference service stopped")
+
+
+def main():
+    import model_registry
+
+    parser = argparse.ArgumentParser(description="Serve the plant disease model over HTTP from worker processes.")
+    parser.add_argument("--model", default=model_registry.MODEL_PATH)
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Model processes, each pinned to "
+                        "an equal share of the available cores")
+    parser.add_argument("--max-batch", type=int, default=SERVICE_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=SERVICE_MAX_WAIT_MS)
+    parser.add_argument("--drain-timeout", type=float, default=SERVICE_DRAIN_TIMEOUT)
+    parser.add_argument("--request-timeout", type=float, default=SERVICE_REQUEST_TIMEOUT)
+    args = parser.parse_args()
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# labels.py
+
+import json
+import os
+
+# Written by the training run (validation_set.class_names); must match the model's output order
+CLASS_NAMES_PATH = os.getenv("CLASS_NAMES_PATH", "class_names.json")
+
+# Class order matches validation_set.class_names from Train_plant_disease.ipynb
+BUILTIN_CLASS_NAMES = ['Apple___Apple_scab', 'Apple___Black_rot', 'Apple___Cedar_apple_rust', 'Apple___healthy',
+    'Blueberry___healthy', 'Cherry_(including_sour)___Powdery_mildew',
+    'Cherry_(including_sour)___healthy', 'Corn_(maize)___Cercospora_leaf_spot Gray_leaf_spot',
+    'Corn_(maize)___Common_rust_', 'Corn_(maize)___Northern_Leaf_Blight', 'Corn_(maize)___healthy',
+    'Grape___Black_rot', 'Grape___Esca_(Black_Measles)', 'Grape___Leaf_blight_(Isariopsis_Leaf_Spot)',
+    'Grape___healthy', 'Orange___Haunglongbing_(Citrus_greening)', 'Peach___Bacterial_spot',
+    'Peach___healthy', 'Pepper,_bell___Bacterial_spot', 'Pepper,_bell___healthy',
+    'Potato___Early_blight', 'Potato___Late_blight', 'Potato___healthy',
+    'Raspberry___healthy', 'Soybean___healthy', 'Squash___Powdery_mildew',
+    'Strawberry___Leaf_scorch', 'Strawberry___healthy', 'Tomato___Bacterial_spot',
+    'Tomato___Early_blight', 'Tomato___Late_blight', 'Tomato___Leaf_Mold',
+    'Tomato___Septoria_leaf_spot', 'Tomato___Spider_mites Two-spotted_spider_mite',
+    'Tomato___Target_Spot', 'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus',
+    'Tomato___healthy']
+
+SOLUTIONS = {
+    'Apple___Apple_scab': "Apply fungicides and remove infected leaves.",
+    'Apple___Black_rot': "Prune and destroy infected branches; use copper-based sprays.",
+    'Apple___Cedar_apple_rust': "Use fungicides and plant disease-resistant varieties.",
+    'Corn_(maize)___Common_rust_': "Apply fungicides and practice crop rotation.",
+    'Tomato___Late_blight': "Remove infected plants and use copper fungicides."
+}
+
+DEFAULT_SOLUTION = "No specific solution available. Please consult an expert."
+HEALTHY_SOLUTION = "The plant looks healthy. No treatment needed."
+
+
+# Load Class Names: the training run's list when present, otherwise the built-in one
+def load_class_names(path=CLASS_NAMES_PATH):
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                names = json.load(f)
+            if isinstance(names, dict):
+                names = names["class_names"]
+            if names:
+                return list(names)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not read class names from {path}: {e}")
+    return list(BUILTIN_CLASS_NAMES)
+
+
+def save_class_names(class_names, path=CLASS_NAMES_PATH):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(list(class_names), f, indent=1)
+
+
+# "Corn_(maize)___Common_rust_" -> ("Corn (maize)", "Common rust")
+def split_label(name):
+    crop, _, condition = name.partition("___")
+    return crop.replace("_", " ").strip(), condition.replace("_", " ").strip()
+
+
+def is_healthy(name):
+    return split_label(name)[1].lower() == "healthy"
+
+
+def solution_for(name):
+    if name in SOLUTIONS:
+        return SOLUTIONS[name]
+    return HEALTHY_SOLUTION if is_healthy(name) else DEFAULT_SOLUTION
+
+
+# Built once at import
+CLASS_NAMES = load_class_names()
+CROPS = list(dict.fromkeys(split_label(name)[0] for name in CLASS_NAMES))
@@ -0,0 +1,415 @@
+# loadtest.py
+
+import argparse
+import json
+import os
+import random
+import resource
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import auth
+import catalog_cache
+import database
+import db_client
+import metrics
+import prediction_log_writer
+from benchmark import environment_info, load_image_bytes, percentiles, synthetic_image_bytes
+from labels import CLASS_NAMES
+
+FLOWS = ("login", "predict", "add_to_cart", "place_order", "order_history")
+LOADTEST_PASSWORD = "loadtest-password"
+_SEED_CHUNK = 5000
+
+# Collection methods counted as one DB operation each (find() counts once, however many batches it reads)
+_OPERATIONS = {"find", "find_one", "insert_one", "insert_many", "update_one", "update_many", "delete_one",
+               "delete_many", "bulk_write", "aggregate", "count_documents", "find_one_and_delete",
+               "find_one_and_update", "replace_one", "distinct"}
+
+_local = threading.local()
+_op_counts = defaultdict(Counter)
+_op_counts_lock = threading.Lock()
+
+
+# DB operations are attributed to the flow running on the calling thread; the prediction log writer's
+# batched inserts run on its own thread and show up as "background". Counted at the collection level,
+# so it works the same on mongomock (which has no command monitoring) and a real mongod.
+class _CountingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in _OPERATIONS:
+            return attribute
+
+        def counted(*args, **kwargs):
+            with _op_counts_lock:
+                _op_counts[getattr(_local, "flow", None) or "background"][name] += 1
+            return attribute(*args, **kwargs)
+
+        return counted
+
+
+def install_op_counter():
+    get_collection = db_client.get_collection
+    db_client.get_collection = lambda name: _CountingCollection(get_collection(name))
+
+
+# Connect: a separate database (default loadtest_plant_disease) so seeding never touches app data
+def connect(uri, db_name):
+    db_client.MONGO_DB_NAME = db_name
+    db_client.set_client(db_client._create_client(uri))
+    return db_client.get_db()
+
+
+# Seed: users share one bcrypt hash (hashing thousands of passwords would dominate the setup),
+# then supplements, order history and prediction logs in bulk
+def seed(db, users, supplements, orders, logs, reset=False, seed_value=0):
+    rng = random.Random(seed_value)
+    if reset:
+        for name in ("users", "supplements", "carts", "orders", "prediction_logs", "catalog_meta"):
+            db[name].delete_many({})
+    started = time.perf_counter()
+    existing = db["users"].count_documents({})
+    if existing < users:
+        hashed = auth.hash_password(LOADTEST_PASSWORD)
+        _insert_chunks(db["users"], ({"username": f"loadtest-user-{i}", "password": hashed}
+                                     for i in range(existing, users)))
+    catalog = [{"name": f"Supplement {i}", "description": f"Load test supplement {i}",
+                "price": round(rng.uniform(50, 2000), 2), "image_url": None} for i in range(supplements)]
+    existing = db["supplements"].count_documents({})
+    _insert_chunks(db["supplements"], catalog[existing:])
+    db["catalog_meta"].update_one({"_id": "supplements"}, {"$inc": {"version": 1}}, upsert=True)
+
+    now = datetime.now()
+
+    def order(i):
+        items = [{"supplement_name": s["name"], "quantity": rng.randint(1, 3), "price": s["price"]}
+                 for s in rng.sample(catalog, min(len(catalog), rng.randint(1, 4)))]
+        return {"username": f"loadtest-user-{rng.randrange(users)}", "items": items,
+                "total_price": sum(item["price"] * item["quantity"] for item in items),
+                "order_date": now - timedelta(minutes=rng.randrange(60 * 24 * 365))}
+
+    def log(i):
+        return {"username": f"loadtest-user-{rng.randrange(users)}", "image_name": f"seed-{i}.jpg",
+                "disease_name": rng.choice(CLASS_NAMES), "model_version": "seed",
+                "timestamp": now - timedelta(minutes=rng.randrange(60 * 24 * 365))}
+
+    existing = db["orders"].count_documents({})
+    _insert_chunks(db["orders"], (order(i) for i in range(existing, orders)))
+    existing = db["prediction_logs"].count_documents({})
+    _insert_chunks(db["prediction_logs"], (log(i) for i in range(existing, logs)))
+    counts = {name: db[name].count_documents({}) for name in ("users", "supplements", "orders", "prediction_logs")}
+    print(f"Seeded in {time.perf_counter() - started:.1f}s: " + ", ".join(f"{v} {k}" for k, v in counts.items()))
+    return counts
+
+
+def _insert_chunks(collection, docs):
+    chunk = []
+    for doc in docs:
+        chunk.append(doc)
+        if len(chunk) == _SEED_CHUNK:
+            collection.insert_many(chunk, ordered=False)
+            chunk = []
+    if chunk:
+        collection.insert_many(chunk, ordered=False)
+
+
+# Resource Sampler: process CPU (cores busy) and RSS, sampled while the load runs
+class ResourceSampler:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-sampler", daemon=True)
+
+    @staticmethod
+    def rss_mb():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+        except (OSError, ValueError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    @staticmethod
+    def cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def _run(self):
+        last_cpu, last_time = self.cpu_seconds(), time.perf_counter()
+        while not self._stop.wait(self.interval):
+            cpu, now = self.cpu_seconds(), time.perf_counter()
+            self.samples.append({"cpu_cores": (cpu - last_cpu) / (now - last_time), "rss_mb": self.rss_mb()})
+            last_cpu, last_time = cpu, now
+
+    def start(self):
+        self.started_cpu, self.started_at, self.rss_start_mb = self.cpu_seconds(), time.perf_counter(), self.rss_mb()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        elapsed = time.perf_counter() - self.started_at
+        cores = [s["cpu_cores"] for s in self.samples]
+        rss = [s["rss_mb"] for s in self.samples] or [self.rss_mb()]
+        return {
+            "cpu_cores_avg": round((self.cpu_seconds() - self.started_cpu) / elapsed, 3),
+            "cpu_cores_max": round(max(cores), 3) if cores else None,
+            "cpu_count": os.cpu_count(),
+            "rss_start_mb": round(self.rss_start_mb, 1),
+            "rss_end_mb": round(self.rss_mb(), 1),
+            "rss_max_mb": round(max(rss), 1),
+        }
+
+
+# Simulated User: logs in like the Login page, then loops over the enabled flows the way the pages call
+# the database layer, re-verifying the session token on every "rerun" (and logging in again every
+# `session_flows` loops when set; the default is one login per user, like one browser session)
+class SimulatedUser:
+    def __init__(self, index, harness):
+        self.username = f"loadtest-user-{index % harness.seeded_users}"
+        self.client_id = f"10.0.{index // 250}.{index % 250}"
+        self.harness = harness
+        self.rng = random.Random(index)
+        self.token = None
+
+    def _flow(self, name, fn):
+        _local.flow = name
+        started = time.perf_counter()
+        try:
+            outcome = fn()
+            error = None if outcome is not False else "failed"
+        except Exception as e:
+            error = type(e).__name__
+        finally:
+            _local.flow = None
+        self.harness.record(name, (time.perf_counter() - started) * 1000.0, error)
+        return error is None
+
+    def login(self):
+        if not database.login_user(self.username, LOADTEST_PASSWORD, client_id=self.client_id):
+            return False
+        self.token = auth.issue_token(self.username)
+        return True
+
+    def predict(self):
+        image_name = f"upload-{self.rng.randrange(10**9)}.jpg"
+        result = self.harness.prediction.predict_upload(self.rng.choice(self.harness.images), image_name=image_name)
+        database.save_prediction(self.username, image_name, result["disease_name"],
+                                 model_version=result["model_version"], top_k=result["top_k"],
+                                 latency_ms=result["latency_ms"], uncertain=result["uncertain"])
+
+    def add_to_cart(self):
+        supplements = catalog_cache.get_supplements()
+        return database.add_to_cart(self.username, self.rng.choice(supplements)["name"], 1) == "Item added to cart!"
+
+    def place_order(self):
+        database.get_cart(self.username)
+        return database.place_order(self.username) in ("Order placed successfully!", "Cart is empty.")
+
+    def order_history(self):
+        database.get_user_orders(self.username)
+
+    def run(self, stop_at):
+        loops = 0
+        while time.perf_counter() < stop_at:
+            if self.token is None or (self.harness.session_flows and loops % self.harness.session_flows == 0):
+                if not self._flow("login", self.login):
+                    self.token = None
+                    time.sleep(self.harness.think_s or 0.1)
+                    continue
+            for name in self.harness.flows:
+                if name == "login" or time.perf_counter() >= stop_at:
+                    continue
+                # Every page interaction is a Streamlit rerun, which checks the session token first
+                if auth.verify_token(self.token) != self.username:
+                    self.token = None
+                    break
+                self._flow(name, getattr(self, name))
+                if self.harness.think_s:
+                    time.sleep(self.rng.uniform(0.5, 1.5) * self.harness.think_s)
+            loops += 1
+
+
+class LoadTest:
+    def __init__(self, flows, seeded_users, images=None, think_ms=0.0, session_flows=0):
+        self.flows = flows
+        self.seeded_users = seeded_users
+        self.images = images
+        self.think_s = think_ms / 1000.0
+        self.session_flows = session_flows
+        self.prediction = None
+        if "predict" in flows:
+            # Loaded here so DB-only runs never import the inference stack
+            import prediction
+            self.prediction = prediction
+        self._lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def record(self, flow, elapsed_ms, error):
+        with self._lock:
+            if error is None:
+                self.timings[flow].append(elapsed_ms)
+            else:
+                self.errors[flow][error] += 1
+
+    def run(self, users, duration, ramp_up=0.0):
+        with _op_counts_lock:
+            _op_counts.clear()
+        commands_before = db_client.stats()["commands"]
+        sampler = ResourceSampler().start()
+        started = time.perf_counter()
+        stop_at = started + ramp_up + duration
+        threads = []
+        for i in range(users):
+            simulated = SimulatedUser(i, self)
+            thread = threading.Thread(target=simulated.run, args=(stop_at,), name=f"loadtest-user-{i}", daemon=True)
+            thread.start()
+            threads.append(thread)
+            if ramp_up:
+                time.sleep(ramp_up / users)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        resources = sampler.stop()
+        return self._report(users, elapsed, resources, commands_before)
+
+    def _report(self, users, elapsed, resources, commands_before):
+        flows = {}
+        for flow in FLOWS:
+            timings = self.timings.get(flow, [])
+            errors = dict(self.errors.get(flow, {}))
+            if not timings and not errors:
+                continue
+            with _op_counts_lock:
+                operations = dict(_op_counts.get(flow, {}))
+            flows[flow] = dict(
+                percentiles(timings),
+                per_second=round(len(timings) / elapsed, 2),
+                errors=errors,
+                db_ops_per_flow=round(sum(operations.values()) / max(1, len(timings) + sum(errors.values())), 2),
+                db_ops=operations,
+            )
+        with _op_counts_lock:
+            background = dict(_op_counts.get("background", {}))
+        # Server-side command counts (pymongo command monitoring; empty on mongomock)
+        commands = {name: entry["count"] - commands_before.get(name, {}).get("count", 0)
+                    for name, entry in db_client.stats()["commands"].items()}
+        completed = sum(len(timings) for timings in self.timings.values())
+        components = {"auth": auth.stats(), "prediction_log": prediction_log_writer.get_writer().stats()}
+        if self.prediction is not None:
+            # Repeated images are answered from the prediction cache; its hit rate says how much inference ran
+            components["prediction_cache"] = self.prediction.prediction_cache.get_cache().stats()
+        return {
+            "users": users,
+            "seconds": round(elapsed, 2),
+            "flows_per_second": round(completed / elapsed, 2),
+            "flows": flows,
+            "background_db_ops": background,
+            "mongo_commands": {name: count for name, count in commands.items() if count},
+            "resources": resources,
+            "components": components,
+        }
+
+
+def print_report(result):
+    print(f"{result['users']} users, {result['seconds']}s: {result['flows_per_second']} flows/s")
+    for flow, r in result["flows"].items():
+        errors = ", ".join(f"{k}={v}" for k, v in r["errors"].items()) or "none"
+        print(f"  {flow:14s} {r['per_second']:8.2f}/s  p50 {r.get('p50_ms', 0):8.1f}ms  "
+              f"p95 {r.get('p95_ms', 0):8.1f}ms  p99 {r.get('p99_ms', 0):8.1f}ms  "
+              f"db ops {r['db_ops_per_flow']:5.2f}  errors: {errors}")
+    res = result["resources"]
+    print(f"  CPU {res['cpu_cores_avg']:.2f} cores avg (max {res['cpu_cores_max']}) of {res['cpu_count']}, "
+          f"RSS {res['rss_start_mb']} -> {res['rss_end_mb']} MB (max {res['rss_max_mb']})")
+
+
+# Compare against a previous results file: throughput and p95 per flow, per user count
+def compare(previous_path, results):
+    with open(previous_path) as f:
+        previous = {r["users"]: r for r in json.load(f)["results"]}
+    for result in results:
+        old = previous.get(result["users"])
+        if old is None:
+            continue
+        for flow, r in result["flows"].items():
+            old_flow = old["flows"].get(flow)
+            if not old_flow or not old_flow.get("p95_ms") or not r.get("p95_ms"):
+                continue
+            change = (r["p95_ms"] - old_flow["p95_ms"]) / old_flow["p95_ms"]
+            print(f"users={result['users']} {flow}: {old_flow['per_second']} -> {r['per_second']}/s, "
+                  f"p95 {old_flow['p95_ms']} -> {r['p95_ms']}ms ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-user load test of the app's page flows and DB layer.")
+    parser.add_argument("--users", default="10",
+                        help="Concurrent simulated users; comma-separated to step, e.g. 1,10,50")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per step (after ramp-up)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which users are started")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between flows (0 = flat out)")
+    parser.add_argument("--session-flows", type=int, default=0,
+                        help="Log in again every N flow loops (0 = once per user; note the login rate limit)")
+    parser.add_argument("--flows", default=",".join(FLOWS), help=f"Subset of: {', '.join(FLOWS)}")
+    parser.add_argument("--mongo-uri", default="mongomock://", help="mongomock:// or e.g. mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="loadtest_plant_disease")
+    parser.add_argument("--reset", action="store_true", help="Empty the load test database before seeding")
+    parser.add_argument("--seed-users", type=int, default=1000)
+    parser.add_argument("--seed-supplements", type=int, default=50)
+    parser.add_argument("--seed-orders", type=int, default=10000)
+    parser.add_argument("--seed-logs", type=int, default=50000)
+    parser.add_argument("--images-dir", default=None, help="Upload these images (e.g. test/test) in the predict flow")
+    parser.add_argument("--synthetic", type=int, default=64,
+                        help="Synthetic JPEGs when no --images-dir is given (more images, fewer prediction cache hits)")
+    parser.add_argument("--synthetic-size", default="1024x768")
+    parser.add_argument("-o", "--output", default="loadtest_results.json")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare against")
+    args = parser.parse_args()
+
+    flows = [flow for flow in args.flows.split(",") if flow]
+    unknown = set(flows) - set(FLOWS)
+    if unknown:
+        parser.error(f"Unknown flows: {', '.join(sorted(unknown))}")
+    db = connect(args.mongo_uri, args.db_name)
+    seed_counts = seed(db, args.seed_users, args.seed_supplements, args.seed_orders, args.seed_logs, args.reset)
+    install_op_counter()
+    catalog_cache.invalidate()
+
+    images = None
+    if "predict" in flows:
+        images = load_image_bytes(args.images_dir, 256) if args.images_dir else []
+        if not images:
+            width, height = (int(v) for v in args.synthetic_size.lower().split("x"))
+            images = synthetic_image_bytes(args.synthetic, width, height)
+    test = LoadTest(flows, args.seed_users, images, args.think_ms, args.session_flows)
+    if test.prediction is not None:
+        # Model load and first forward pass happen before the clock starts
+        test.prediction.predict_upload(images[0])
+
+    results = []
+    for users in (int(value) for value in args.users.split(",") if value):
+        test.timings.clear()
+        test.errors.clear()
+        result = test.run(users, args.duration, args.ramp_up)
+        results.append(result)
+        print_report(result)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment_info(), "config": config, "seeded": seed_counts,
+                   "stage_seconds": {stage: metrics.percentiles("app_stage_seconds", stage=stage)
+                                     for stage in ("login", "predict", "decode", "inference_batch")},
+                   "results": results}, f, indent=2, default=str)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
+import tempfile
 import streamlit as st
+import auth
 import database  # Import database functions
-import tensorflow as tf
-import numpy as np
+import catalog_cache
+import metrics
+import warmup
 from database import place_order
 
 st.markdown("""
@@ -36,10 +39,26 @@ st.markdown("""
 
 st.title("🌿 Plant Disease Detection")
 
+# Metrics endpoint (Prometheus text format on METRICS_PORT), started once per process
+metrics.start_server()
+
+# Opt-in profiling for one session: open the app with ?profile=1 (one profile per script run in PROFILE_DIR)
+if st.session_state.get("profile") is not None:
+    st.session_state.pop("profile").stop()  # a run cut short by a rerun is closed here
+if st.experimental_get_query_params().get("profile") == ["1"]:
+    st.session_state["profile"] = metrics.profile(f"session-{id(st.session_state):x}").start()
+
 # Authentication System
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
 
+# Reruns check the signed session token instead of re-running bcrypt; expired tokens log out
+if st.session_state["logged_in"] and \
+        auth.verify_token(st.session_state.get("session_token")) != st.session_state.get("username"):
+    st.session_state["logged_in"] = False
+    st.session_state.pop("username", None)
+    st.session_state.pop("session_token", None)
+
 
 # Adjust Sidebar Menu Based on Login Status
 if st.session_state["logged_in"]:
@@ -95,13 +114,20 @@ elif app_mode == "🔑 Login":
     password = st.text_input("🔒 Password", type="password", key="login_password")
 
     if st.button("✅ Login", help="Click to access your account"):
-        if database.login_user(username, password):
-            st.session_state['logged_in'] = True
-            st.session_state['username'] = username
-            st.success("✅ Login Successful!")
-            st.experimental_rerun()
+        client_id = auth.client_id_from_headers(getattr(getattr(st, "context", None), "headers", None))
+        try:
+            logged_in = database.login_user(username, password, client_id)
+        except (auth.RateLimitExceeded, auth.AuthBusy) as e:
+            st.warning(f"⏳ {e}")
         else:
-            st.error("❌ Invalid Credentials. Please try again.")
+            if logged_in:
+                st.session_state['logged_in'] = True
+                st.session_state['username'] = username
+                st.session_state['session_token'] = auth.issue_token(username)
+                st.success("✅ Login Successful!")
+                st.experimental_rerun()
+            else:
+                st.error("❌ Invalid Credentials. Please try again.")
 
 # Cart Management
 if app_mode == "🛒 Cart":
@@ -109,12 +135,11 @@ if app_mode == "🛒 Cart":
     username = st.session_state.get("username")
 
     if username:
-        cart_items = database.view_cart(username)
-        if cart_items:
-            for item in cart_items:
+        cart = database.get_cart(username)
+        if cart["items"]:
+            for item in cart["items"]:
                 st.write(f"**{item['supplement_name']}** - ₹{item['price']} x {item['quantity']}")
-            total_price = sum(item['price'] * item['quantity'] for item in cart_items)
-            st.write(f"### 🧾 Total: ₹{total_price}")
+            st.write(f"### 🧾 Total: ₹{cart['total']}")
             
             # Purchase button and order placement
             if st.button("🛍 Purchase"):
@@ -135,12 +160,12 @@ elif st.session_state["logged_in"] and app_mode == "🛂 Supplements":
     if "carts" not in st.session_state:
         st.session_state["carts"] = []
 
-    supplements = database.get_all_supplements()
+    supplements = catalog_cache.get_supplements()
 
     if supplements:
         for supplement in supplements:
             st.subheader(supplement.get('name', 'Unknown Supplement'))
-            image_url = supplement.get('image_url')
+            image_url = supplement.get('thumbnail_url') or supplement.get('image_url')
             if image_url and image_url != 'None':
                 st.image(image_url, caption=supplement['name'], width=300)
             st.write(f"💰 **Price:** ₹{supplement.get('price', 'N/A')}")
@@ -204,62 +229,93 @@ elif(app_mode=="📌 About"):
 
 elif app_mode == "🔍 Disease Recognition":
     st.header("🌱 Disease Recognition")
-    test_image = st.file_uploader("📷 Upload an Image:")
-
-    if test_image:
-        st.image(test_image, caption="Uploaded Image", use_column_width=True)
-
-        if test_image and st.button("🔬 Predict"):
-
-            def model_prediction(test_image):
-                model = tf.keras.models.load_model("trained_model.keras")
-                image = tf.keras.preprocessing.image.load_img(test_image, target_size=(128, 128))
-                input_arr = tf.keras.preprocessing.image.img_to_array(image)
-                input_arr = np.array([input_arr])  # Convert single image to batch
-                prediction = model.predict(input_arr)
-                return np.argmax(prediction)
-
-            result_index = model_prediction(test_image)
-            class_name = ['Apple___Apple_scab', 'Apple___Black_rot', 'Apple___Cedar_apple_rust', 'Apple___healthy',
-                'Blueberry___healthy', 'Cherry_(including_sour)___Powdery_mildew', 
-                'Cherry_(including_sour)___healthy', 'Corn_(maize)___Cercospora_leaf_spot Gray_leaf_spot', 
-                'Corn_(maize)___Common_rust_', 'Corn_(maize)___Northern_Leaf_Blight', 'Corn_(maize)___healthy', 
-                'Grape___Black_rot', 'Grape___Esca_(Black_Measles)', 'Grape___Leaf_blight_(Isariopsis_Leaf_Spot)', 
-                'Grape___healthy', 'Orange___Haunglongbing_(Citrus_greening)', 'Peach___Bacterial_spot',
-                'Peach___healthy', 'Pepper,_bell___Bacterial_spot', 'Pepper,_bell___healthy', 
-                'Potato___Early_blight', 'Potato___Late_blight', 'Potato___healthy', 
-                'Raspberry___healthy', 'Soybean___healthy', 'Squash___Powdery_mildew', 
-                'Strawberry___Leaf_scorch', 'Strawberry___healthy', 'Tomato___Bacterial_spot', 
-                'Tomato___Early_blight', 'Tomato___Late_blight', 'Tomato___Leaf_Mold', 
-                'Tomato___Septoria_leaf_spot', 'Tomato___Spider_mites Two-spotted_spider_mite', 
-                'Tomato___Target_Spot', 'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus',
-                'Tomato___healthy']
-            
-            solutions = {
-                'Apple___Apple_scab': "Apply fungicides and remove infected leaves.",
-                'Apple___Black_rot': "Prune and destroy infected branches; use copper-based sprays.",
-                'Apple___Cedar_apple_rust': "Use fungicides and plant disease-resistant varieties.",
-                'Corn_(maize)___Common_rust_': "Apply fungicides and practice crop rotation.",
-                'Tomato___Late_blight': "Remove infected plants and use copper fungicides."
-            }
-
-            disease_name = class_name[result_index]
-            st.success(f"✅ Model predicts: **{disease_name}**")
-
-            # Show Solution
-            solution = solutions.get(disease_name, "No specific solution available. Please consult an expert.")
-            st.info(f"📝 Recommended Solution: {solution}")
-
-            # Save Prediction Log in MongoDB
+    # NumPy, TensorFlow and the model backend are imported here, on first use, not at app start
+    import bulk_predict
+    import prediction
+
+    recognition_mode = st.radio("Mode", ["Single Image", "Bulk Upload"], horizontal=True)
+
+    if recognition_mode == "Single Image":
+        test_image = st.file_uploader("📷 Upload an Image:")
+
+        if test_image:
+            st.image(test_image, caption="Uploaded Image", use_column_width=True)
+
+            if test_image and st.button("🔬 Predict"):
+                result = prediction.predict_upload(test_image.getvalue(), image_name=test_image.name)
+                disease_name = result["disease_name"]
+                st.success(f"✅ Model predicts: **{result['crop']} – {result['condition']}** "
+                           f"({result['confidence']:.1%})")
+                if result["uncertain"]:
+                    st.warning("⚠️ The model is not confident about this image. Other likely matches: " +
+                               ", ".join(f"{item['disease_name']} ({item['probability']:.1%})"
+                                         for item in result["top_k"][1:]))
+
+                # Show Solution
+                st.info(f"📝 Recommended Solution: {result['solution']}")
+
+                # Similar Confirmed Cases (embedding index)
+                if result["similar_cases"]:
+                    st.write("🔎 Similar confirmed cases:")
+                    st.table([{"Image": case["image_name"], "Confirmed diagnosis": case["disease_name"],
+                               "Similarity": case["similarity"]}
+                              for case in result["similar_cases"]])
+
+                # Save Prediction Log in MongoDB
+                username = st.session_state.get("username", "Guest")
+                database.save_prediction(username, test_image.name, disease_name,
+                                         model_version=result["model_version"], top_k=result["top_k"],
+                                         latency_ms=result["latency_ms"], uncertain=result["uncertain"],
+                                         embedding_row=result["embedding_row"])
+
+    else:
+        uploaded_files = st.file_uploader("📂 Upload Images or a .zip Archive:", type=["jpg", "jpeg", "png", "zip"],
+                                          accept_multiple_files=True)
+
+        if uploaded_files and st.button("🔬 Predict All"):
             username = st.session_state.get("username", "Guest")
-            database.save_prediction(username, test_image.name, disease_name)
+            progress = st.empty()
+            table = st.empty()
+            recent = []
+            count = 0
+            # Results stream to a temporary file (removed when it closes), as in the CLI
+            with tempfile.TemporaryFile("w+", newline="", encoding="utf-8") as output:
+                writer = bulk_predict.CsvResultWriter(output)
+                for row in bulk_predict.predict_stream(bulk_predict.iter_uploads(uploaded_files),
+                                                       index_embeddings=True):
+                    writer.write(row)
+                    count += 1
+                    if row["error"] is None:
+                        database.save_prediction(username, row["image_name"], row["disease_name"],
+                                                 model_version=row["model_version"], top_k=row["top_k"],
+                                                 latency_ms=row["inference_ms"], uncertain=row["uncertain"],
+                                                 embedding_row=row["embedding_row"])
+                    # Keep only the latest rows on screen; the full result set lives in the CSV
+                    recent.append({"Image": row["image_name"], "Prediction": row["disease_name"],
+                                   "Confidence": row["confidence"], "Uncertain": row["uncertain"],
+                                   "Error": row["error"]})
+                    recent = recent[-20:]
+                    progress.write(f"Processed {count} images...")
+                    table.table(recent)
+                progress.success(f"✅ Processed {count} images.")
+                output.seek(0)
+                st.download_button("⬇️ Download Results (CSV)", output, file_name="predictions.csv",
+                                   mime="text/csv")
 
 # Logout Button (Persistent)
 if st.session_state["logged_in"] and st.sidebar.button("🚪 Logout"):
     st.session_state["logged_in"] = False
     st.session_state.pop("username", None)
+    st.session_state.pop("session_token", None)
     st.experimental_rerun()
 
 
 elif app_mode == "none of the above":
-    st.error("Login and register first")
\ No newline at end of file
+    st.error("Login and register first")
+
+# The page is rendered; once the user is logged in, load the inference stack in the background so the
+# first Predict click is fast (PREWARM_MODEL in warmup.py)
+warmup.start_background_prewarm(logged_in=st.session_state["logged_in"])
+
+if st.session_state.get("profile") is not None:
+    st.session_state.pop("profile").stop()
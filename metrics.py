@@ -0,0 +1,374 @@
+# metrics.py
+
+import cProfile
+import functools
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics Settings
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))  # 0 disables the HTTP endpoint
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")  # "sample" (collapsed stacks) or "cprofile"
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # seconds
+
+# Histogram resolution: 8 log-spaced sub-buckets per power of two (~9% relative error), 1us .. ~18 min
+_SUB_BUCKETS = 8
+_MIN_EXPONENT = -19  # 2**-20 s ~ 1us
+_MAX_EXPONENT = 11  # 2**10 s ~ 17 min
+_NUM_BUCKETS = (_MAX_EXPONENT - _MIN_EXPONENT) * _SUB_BUCKETS
+
+
+def _bucket_index(seconds):
+    if seconds <= 0:
+        return 0
+    mantissa, exponent = math.frexp(seconds)  # seconds = mantissa * 2**exponent, 0.5 <= mantissa < 1
+    index = (exponent - _MIN_EXPONENT) * _SUB_BUCKETS + int((mantissa - 0.5) * 2 * _SUB_BUCKETS)
+    return min(max(index, 0), _NUM_BUCKETS - 1)
+
+
+def _bucket_upper(index):
+    exponent, sub = divmod(index, _SUB_BUCKETS)
+    return math.ldexp(0.5 + (sub + 1) / (2 * _SUB_BUCKETS), exponent + _MIN_EXPONENT)
+
+
+# HDR-style histogram: fixed log-linear buckets, O(1) record, percentiles within one sub-bucket
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max", "lock")
+
+    def __init__(self):
+        self.counts = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = _bucket_index(seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, q):
+        with self.lock:
+            counts, count, maximum = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        rank = q / 100.0 * count
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if n and seen >= rank:
+                return min(_bucket_upper(index), maximum)
+        return maximum
+
+    # Exported per power of two so the Prometheus bucket set stays small and stable
+    def cumulative_octaves(self):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.total
+        buckets = []
+        seen = 0
+        for start in range(0, _NUM_BUCKETS, _SUB_BUCKETS):
+            seen += sum(counts[start:start + _SUB_BUCKETS])
+            buckets.append((_bucket_upper(start + _SUB_BUCKETS - 1), seen))
+        return buckets, count, total
+
+
+# Registry: metric families keyed by name, series keyed by sorted label pairs
+_HELP = {}
+_histograms = {}
+_counters = {}
+_registry_lock = threading.Lock()
+_collectors = []
+
+
+def _series(store, factory, name, labels):
+    key = (name, tuple(sorted(labels.items())))
+    series = store.get(key)
+    if series is None:
+        with _registry_lock:
+            series = store.setdefault(key, factory())
+    return series
+
+
+def describe(name, help_text):
+    _HELP[name] = help_text
+
+
+def observe(name, seconds, **labels):
+    if METRICS_ENABLED:
+        _series(_histograms, Histogram, name, labels).observe(seconds)
+
+
+class _CounterValue:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+
+def inc(name, n=1, **labels):
+    if METRICS_ENABLED:
+        counter = _series(_counters, _CounterValue, name, labels)
+        with counter.lock:
+            counter.value += n
+
+
+# Timer: `with metrics.timer("app_stage_seconds", stage="decode"):` or `@metrics.timed(...)`
+class timer:
+    __slots__ = ("histogram", "started", "elapsed")
+
+    def __init__(self, name, **labels):
+        self.histogram = _series(_histograms, Histogram, name, labels) if METRICS_ENABLED else None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.started
+        if self.histogram is not None:
+            self.histogram.observe(self.elapsed)
+        return False
+
+
+# The series is resolved once at decoration time, so each call costs two clock reads and one observe
+def timed(name, **labels):
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+        histogram = _series(_histograms, Histogram, name, labels)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def stage(stage_name):
+    return timer("app_stage_seconds", stage=stage_name)
+
+
+def percentiles(name, qs=(50, 95, 99), **labels):
+    histogram = _histograms.get((name, tuple(sorted(labels.items()))))
+    return {f"p{q}": histogram.percentile(q) if histogram else 0.0 for q in qs}
+
+
+# Collectors: callables returning [(name, labels, value)] gauges, evaluated at scrape time
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+def _numeric_gauges(prefix, values, **labels):
+    return [(f"{prefix}_{key}", labels, float(value)) for key, value in values.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+
+# Only report components that are already running; never start one just to scrape it
+@register_collector
+def _component_stats():
+    gauges = []
+    engine = getattr(sys.modules.get("inference_engine"), "_engine", None)
+    if engine is not None:
+        gauges += _numeric_gauges("app_inference", engine.stats())
+    client = getattr(sys.modules.get("inference_client"), "_client", None)
+    if client is not None:
+        gauges += _numeric_gauges("app_inference_client", client.stats())
+    cache = getattr(sys.modules.get("prediction_cache"), "_cache", None)
+    if cache is not None:
+        gauges += _numeric_gauges("app_prediction_cache", cache.stats())
+    writer = getattr(sys.modules.get("prediction_log_writer"), "_writer", None)
+    if writer is not None:
+        gauges += _numeric_gauges("app_prediction_log", writer.stats())
+    for path, cascade in list(getattr(sys.modules.get("cascade"), "_cascades", {}).items()):
+        gauges += _numeric_gauges("app_cascade", cascade.stats(), model=path)
+    if "auth" in sys.modules:
+        gauges += _numeric_gauges("app_auth", sys.modules["auth"].stats())
+    db_client = sys.modules.get("db_client")
+    if db_client is not None and db_client._client is not None:
+        snapshot = db_client.stats()
+        gauges += _numeric_gauges("app_mongo_pool", snapshot["pool"])
+        for command, entry in snapshot["commands"].items():
+            gauges += _numeric_gauges("app_mongo_command", entry, command=command)
+    return gauges
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def _header(lines, seen, name, kind):
+    if name not in seen:
+        seen.add(name)
+        lines.append(f"# HELP {name} {_HELP.get(name, name.replace('_', ' '))}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+# Render: Prometheus text exposition format 0.0.4
+def render():
+    lines = []
+    seen = set()
+    for (name, labels), histogram in sorted(list(_histograms.items()), key=lambda item: item[0]):
+        _header(lines, seen, name, "histogram")
+        buckets, count, total = histogram.cumulative_octaves()
+        for upper, cumulative in buckets:
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{upper:.9g}'))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total:.9g}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    for (name, labels), counter in sorted(list(_counters.items()), key=lambda item: item[0]):
+        _header(lines, seen, name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {counter.value}")
+    gauges = []
+    for collector in _collectors:
+        try:
+            gauges += collector()
+        except Exception as e:
+            print(f"Metrics collector {collector.__name__} failed: {e}")
+    # Series of one family must be contiguous
+    for name, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+        _header(lines, seen, name, "gauge")
+        lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value:.9g}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# Start Server: one /metrics endpoint per process; a busy port (e.g. a second app) is reported and skipped
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    global _server
+    if not METRICS_ENABLED or not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Metrics endpoint not started on {host}:{port}: {e}")
+                _server = False
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server or None
+
+
+# Stack Sampler: samples one thread's stack and writes collapsed stacks ("a;b;c 42"), the format
+# py-spy --format raw and flamegraph.pl/speedscope read
+class StackSampler:
+    def __init__(self, thread_id=None, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, path):
+        self._stop.set()
+        self._thread.join()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+# Profile one session's script runs: `with metrics.profile(name):` or profile(name).start() ... .stop()
+class profile:
+    def __init__(self, name, enabled=True, mode=PROFILE_MODE):
+        self.enabled = enabled
+        self.mode = mode
+        extension = "prof" if mode == "cprofile" else "folded"
+        self.path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+        self._profiler = None
+
+    def start(self):
+        if not self.enabled or self._profiler is not None:
+            return self
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError as e:  # only one cProfile may be active per interpreter on 3.12+
+                print(f"Profiling skipped: {e}")
+                self._profiler = None
+        else:
+            self._profiler = StackSampler()
+            self._profiler.start()
+        return self
+
+    def stop(self):
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return None
+        if isinstance(profiler, StackSampler):
+            profiler.stop(self.path)
+        else:
+            profiler.disable()
+            profiler.dump_stats(self.path)
+        print(f"Profile written to {self.path}")
+        return self.path
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+describe("app_stage_seconds", "Time spent per request stage")
+describe("app_db_query_seconds", "MongoDB query latency by operation")
+describe("app_model_load_seconds", "Model artifact load time")
+describe("app_auth_hash_seconds", "bcrypt hash/check time in the worker pool")
+describe("app_auth_queue_seconds", "Time bcrypt jobs waited for a worker")
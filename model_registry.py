@@ -0,0 +1,175 @@
+# model_registry.py
+
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+import inference_backends
+import metrics
+
+# Model Registry Settings
+MODEL_PATH = os.getenv("MODEL_PATH", "trained_model.keras")  # .keras/.h5, SavedModel dir, .tflite or .onnx
+MODEL_CHECK_INTERVAL = float(os.getenv("MODEL_CHECK_INTERVAL", "5"))  # seconds between mtime checks
+IMAGE_SIZE = (128, 128)
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "single")  # "cascade": small student model first (cascade.py)
+
+# One entry per model file, shared by every Streamlit session in this process
+_models = {}
+_registry_lock = threading.Lock()
+_load_locks = {}
+_reloading = set()
+
+
+class LoadedModel:
+    def __init__(self, path, backend, version, mtime, size):
+        self.path = path
+        self.backend = backend
+        self.version = version
+        self.mtime = mtime
+        self.size = size
+        self.loaded_at = time.time()
+        self.last_checked = self.loaded_at
+
+    def predict(self, batch):
+        return self.backend.predict(batch)
+
+    # Embeddings are None for backends without a feature output (TFLite, ONNX, SavedModel)
+    def predict_with_embeddings(self, batch):
+        if getattr(self.backend, "supports_embeddings", False):
+            return self.backend.predict_with_embeddings(batch)
+        return self.backend.predict(batch), None
+
+
+def _artifact_files(path):
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+
+
+# File fingerprint used as the model version (SavedModel directories hash every file)
+def file_version(path):
+    digest = hashlib.sha256()
+    for file_path in _artifact_files(path):
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _stat(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, "saved_model.pb")
+    return os.stat(path)
+
+
+def _load(path):
+    stat = _stat(path)
+    version = file_version(path)
+    with metrics.timer("app_model_load_seconds"):
+        backend = inference_backends.load_backend(path)
+    return LoadedModel(path, backend, version, stat.st_mtime, stat.st_size)
+
+
+def _load_lock(path):
+    with _registry_lock:
+        return _load_locks.setdefault(path, threading.Lock())
+
+
+def _reload_in_background(path):
+    with _registry_lock:
+        if path in _reloading:
+            return
+        _reloading.add(path)
+
+    def worker():
+        try:
+            entry = _load(path)
+            _warm(entry)
+            with _registry_lock:
+                old = _models.get(path)
+                # Only swap when the file really changed; a touch keeps the current weights
+                if old is None or old.version != entry.version:
+                    _models[path] = entry
+                else:
+                    old.mtime, old.size = entry.mtime, entry.size
+        except Exception as e:
+            print(f"Model reload failed for {path}: {e}")
+        finally:
+            with _registry_lock:
+                _reloading.discard(path)
+
+    threading.Thread(target=worker, name=f"model-reload-{os.path.basename(path)}", daemon=True).start()
+
+
+def _check_for_update(entry):
+    now = time.time()
+    if now - entry.last_checked < MODEL_CHECK_INTERVAL:
+        return
+    entry.last_checked = now
+    try:
+        stat = _stat(entry.path)
+    except OSError:
+        return
+    if stat.st_mtime != entry.mtime or stat.st_size != entry.size:
+        _reload_in_background(entry.path)
+
+
+# Get Model (loads once per process, hot-swaps when the file changes)
+def get_entry(path=MODEL_PATH):
+    entry = _models.get(path)
+    if entry is not None:
+        # In-flight callers keep their reference to the old entry until they finish
+        _check_for_update(entry)
+        return entry
+
+    with _load_lock(path):
+        entry = _models.get(path)
+        if entry is None:
+            entry = _load(path)
+            with _registry_lock:
+                _models[path] = entry
+    return entry
+
+
+# Get Predictor: what the serving paths call .predict/.version on; the model entry itself, or the
+# student/full-model cascade when INFERENCE_MODE=cascade
+def get_predictor(path=MODEL_PATH):
+    if INFERENCE_MODE == "cascade":
+        import cascade
+        return cascade.get_cascade(path)
+    return get_entry(path)
+
+
+def get_model(path=MODEL_PATH):
+    return get_entry(path).backend
+
+
+def get_version(path=MODEL_PATH):
+    return get_predictor(path).version
+
+
+def _warm(entry):
+    entry.predict(np.zeros((1, *IMAGE_SIZE, 3), dtype=np.float32))
+
+
+# Warm Up (load and run one dummy forward pass so the first user doesn't pay for it)
+def warm_up(path=MODEL_PATH, background=False):
+    if background:
+        thread = threading.Thread(target=warm_up, args=(path,), name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+    try:
+        _warm(get_predictor(path))
+    except Exception as e:
+        print(f"Model warm-up failed for {path}: {e}")
+
+
+def loaded_models():
+    with _registry_lock:
+        return [
+            {"path": e.path, "backend": e.backend.name, "version": e.version, "loaded_at": e.loaded_at}
+            for e in _models.values()
+        ]
@@ -0,0 +1,94 @@
+# postprocessing.py
+
+import os
+import threading
+
+import numpy as np
+
+import labels
+
+# Post-processing Settings
+UNCERTAIN_THRESHOLD = float(os.getenv("UNCERTAIN_THRESHOLD", "0.5"))  # top-1 probability below this is "uncertain"
+DEFAULT_TOP_K = int(os.getenv("PREDICTION_TOP_K", "3"))
+
+
+# Label Index: class metadata as arrays so a whole batch is post-processed with a few numpy ops
+class LabelIndex:
+    def __init__(self, class_names):
+        self.class_names = list(class_names)
+        split = [labels.split_label(name) for name in self.class_names]
+        self.crops = list(dict.fromkeys(crop for crop, _ in split))
+        self.conditions = [condition for _, condition in split]
+        self.solutions = [labels.solution_for(name) for name in self.class_names]
+        self.healthy = np.array([labels.is_healthy(name) for name in self.class_names])
+        self.crop_of = np.array([self.crops.index(crop) for crop, _ in split], dtype=np.int64)
+        # (classes, crops) one-hot: probabilities @ crop_matrix sums each crop's classes
+        self.crop_matrix = np.zeros((len(self.class_names), len(self.crops)), dtype=np.float32)
+        self.crop_matrix[np.arange(len(self.class_names)), self.crop_of] = 1.0
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LabelIndex(labels.CLASS_NAMES)
+    return _index
+
+
+# Postprocess: (N, classes) or (classes,) softmax -> top-k, uncertain flags and per-crop totals for the batch
+def postprocess(probabilities, k=DEFAULT_TOP_K, threshold=UNCERTAIN_THRESHOLD, index=None):
+    index = index or get_index()
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    if probabilities.ndim == 1:
+        probabilities = probabilities[np.newaxis]
+    if probabilities.shape[1] != len(index.class_names):
+        raise ValueError(f"Model returned {probabilities.shape[1]} classes but {len(index.class_names)} "
+                         f"class names are loaded (see labels.CLASS_NAMES_PATH)")
+    k = min(k, probabilities.shape[1])
+    # argpartition finds the k best in O(classes); only those k are sorted
+    top = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(probabilities, top, axis=1), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_probabilities = np.take_along_axis(probabilities, top, axis=1)
+    crop_probabilities = probabilities @ index.crop_matrix
+    return {
+        "indices": top,
+        "probabilities": top_probabilities,
+        "uncertain": top_probabilities[:, 0] < threshold,
+        "crop_indices": index.crop_of[top[:, 0]],
+        "crop_probabilities": crop_probabilities,
+    }
+
+
+# Rows: the dicts the pages, logs and bulk writers use, built from the batch arrays
+def to_rows(result, index=None):
+    index = index or get_index()
+    indices = result["indices"].tolist()
+    probabilities = result["probabilities"].tolist()
+    uncertain = result["uncertain"].tolist()
+    crop_indices = result["crop_indices"].tolist()
+    crop_confidence = np.take_along_axis(result["crop_probabilities"], result["crop_indices"][:, np.newaxis],
+                                         axis=1)[:, 0].tolist()
+    return [
+        {
+            "disease_name": index.class_names[top[0]],
+            "crop": index.crops[crop],
+            "condition": index.conditions[top[0]],
+            "confidence": probs[0],
+            "uncertain": flag,
+            "crop_confidence": crop_conf,
+            "solution": index.solutions[top[0]],
+            "top_k": [{"disease_name": index.class_names[i], "probability": p} for i, p in zip(top, probs)],
+        }
+        for top, probs, flag, crop, crop_conf in zip(indices, probabilities, uncertain, crop_indices,
+                                                     crop_confidence)
+    ]
+
+
+def postprocess_rows(probabilities, k=DEFAULT_TOP_K, threshold=UNCERTAIN_THRESHOLD):
+    return to_rows(postprocess(probabilities, k, threshold))
@@ -0,0 +1,74 @@
+# prediction.py
+
+import time
+
+import numpy as np
+
+import embedding_index
+import inference_client
+import inference_engine
+import metrics
+import model_registry
+import postprocessing
+import prediction_cache
+from labels import CLASS_NAMES
+from preprocessing import decode_image
+
+
+# Predict Image: one decoded image through the inference service when it's running (it batches across
+# app processes), else queued with this process's other sessions on the in-process engine.
+# Returns (probabilities, embedding or None, version of the model that answered).
+def predict_image(image):
+    remote = inference_client.remote_predictor()
+    if remote is not None:
+        probabilities, embeddings, version = remote.predict_versioned(image[np.newaxis], embeddings=True)
+        return probabilities[0], embeddings[0] if embeddings is not None else None, version
+    probabilities, embedding = inference_engine.get_engine().predict_with_embedding(image)
+    return probabilities, embedding, model_registry.get_version()
+
+
+# Predict Probabilities: re-uploads of the same photo are answered from the cache without decoding
+# or inference; misses go through predict_image
+def predict_probabilities(data):
+    return prediction_cache.cached_predict(
+        data,
+        inference_client.get_version(),
+        decode_image,
+        lambda image: predict_image(image)[::2],
+    )[0]
+
+
+def model_prediction(data):
+    return int(postprocessing.postprocess(predict_probabilities(data), k=1)["indices"][0, 0])
+
+
+def predict_disease(data):
+    return CLASS_NAMES[model_prediction(data)]
+
+
+def top_k(probabilities, k=postprocessing.DEFAULT_TOP_K):
+    return postprocessing.postprocess_rows(probabilities, k)[0]["top_k"]
+
+
+# Predict Upload: everything the page shows and logs for one uploaded image. The feature embedding
+# comes out of the same forward pass; cache hits have none, so re-uploads aren't indexed twice.
+@metrics.timed("app_stage_seconds", stage="predict")
+def predict_upload(data, k=postprocessing.DEFAULT_TOP_K, image_name=None):
+    started = time.perf_counter()
+    captured = {}
+
+    def predict_fn(image):
+        probabilities, captured["embedding"], version = predict_image(image)
+        return probabilities, version
+
+    probabilities, model_version = prediction_cache.cached_predict(
+        data, inference_client.get_version(), decode_image, predict_fn)
+    result = postprocessing.postprocess_rows(probabilities, k)[0]
+    result["model_version"] = model_version
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000.0, 3)
+    result["similar_cases"], result["embedding_row"] = [], None
+    if embedding_index.EMBEDDING_INDEX_ENABLED and embedding_index.has_embedding(captured.get("embedding")):
+        with metrics.timer("app_stage_seconds", stage="similar_cases"):
+            result["similar_cases"], result["embedding_row"] = embedding_index.lookup_and_add(
+                captured["embedding"], model_version, image_name, result["disease_name"])
+    return result
@@ -0,0 +1,217 @@
+# prediction_cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Cache Settings
+CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL", "86400"))
+CACHE_PERSISTENT = os.getenv("PREDICTION_CACHE_PERSISTENT", "none")  # none | local | mongo
+CACHE_LOCAL_PATH = os.getenv("PREDICTION_CACHE_PATH", "prediction_cache.sqlite3")
+
+
+# Keys: the decoded 128x128 tensor identifies the image; the raw upload bytes are an alias
+# so a byte-identical re-upload is answered without decoding at all
+def tensor_key(input_arr, model_version):
+    arr = np.ascontiguousarray(input_arr, dtype=np.float32)
+    return f"t:{model_version}:{hashlib.sha256(arr.tobytes()).hexdigest()}"
+
+
+def bytes_key(data, model_version):
+    return f"b:{model_version}:{hashlib.sha256(data).hexdigest()}"
+
+
+# In-Process LRU with TTL
+class LRUCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+# Persistent Tier: local SQLite file
+class SqliteStore:
+    def __init__(self, path=CACHE_LOCAL_PATH, ttl_seconds=CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS prediction_cache "
+                           "(key TEXT PRIMARY KEY, probabilities BLOB, created_at REAL)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT probabilities, created_at FROM prediction_cache WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None or row[1] + self.ttl_seconds < time.time():
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put_many(self, keys, probabilities):
+        blob = np.asarray(probabilities, dtype=np.float32).tobytes()
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO prediction_cache VALUES (?, ?, ?)",
+                                   [(key, blob, now) for key in keys])
+            self._conn.commit()
+
+
+# Persistent Tier: Mongo collection next to prediction_logs, expired by a TTL index. TTL indexes compare
+# against UTC, so timestamps are written in UTC (pymongo reads them back naive unless tz_aware is set).
+class MongoStore:
+    def __init__(self, collection, ttl_seconds=CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self.collection.create_index("created_at", expireAfterSeconds=int(ttl_seconds))
+
+    def get(self, key):
+        doc = self.collection.find_one({"_id": key}, {"probabilities": 1, "created_at": 1})
+        if doc is None:
+            return None
+        created_at = doc["created_at"]
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if created_at + timedelta(seconds=self.ttl_seconds) < datetime.now(timezone.utc):
+            return None
+        return np.frombuffer(doc["probabilities"], dtype=np.float32)
+
+    def put_many(self, keys, probabilities):
+        blob = np.asarray(probabilities, dtype=np.float32).tobytes()
+        now = datetime.now(timezone.utc)
+        for key in keys:
+            self.collection.replace_one({"_id": key}, {"_id": key, "probabilities": blob, "created_at": now},
+                                        upsert=True)
+
+
+class PredictionCache:
+    def __init__(self, memory=None, persistent=None):
+        self.memory = memory if memory is not None else LRUCache()
+        self.persistent = persistent
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits_memory": 0, "hits_persistent": 0, "misses": 0, "puts": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    # Returns (probabilities, tier) where tier is "memory", "persistent" or None on a miss
+    def lookup(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value, "memory"
+        if self.persistent is not None:
+            try:
+                value = self.persistent.get(key)
+            except Exception as e:
+                print(f"Prediction cache lookup failed: {e}")
+                value = None
+            if value is not None:
+                self.memory.put(key, value)
+                return value, "persistent"
+        return None, None
+
+    def record(self, tier):
+        self._count(f"hits_{tier}" if tier else "misses")
+
+    def get(self, key):
+        value, tier = self.lookup(key)
+        self.record(tier)
+        return value
+
+    def put(self, keys, probabilities):
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        for key in keys:
+            self.memory.put(key, probabilities)
+        if self.persistent is not None:
+            try:
+                self.persistent.put_many(keys, probabilities)
+            except Exception as e:
+                print(f"Prediction cache write failed: {e}")
+        self._count("puts")
+
+    # Hit/miss rates for monitoring
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        hits = s["hits_memory"] + s["hits_persistent"]
+        lookups = hits + s["misses"]
+        s["entries"] = len(self.memory)
+        s["hit_rate"] = hits / lookups if lookups else 0.0
+        return s
+
+
+def _make_persistent_store():
+    if CACHE_PERSISTENT == "local":
+        return SqliteStore()
+    if CACHE_PERSISTENT == "mongo":
+        import database
+        return MongoStore(database.db["prediction_cache"])
+    return None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Get Cache (one shared cache per process)
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PredictionCache(persistent=_make_persistent_store())
+    return _cache
+
+
+# Cached Predict: raw bytes -> (probabilities, model version), skipping decode and/or the forward pass on a
+# hit. predict_fn returns (probabilities, version of the model that answered); when that differs from
+# model_version (e.g. the service fell back in-process) the result is cached under the answering model.
+def cached_predict(data, model_version, decode_fn, predict_fn):
+    cache = get_cache()
+    raw_key = bytes_key(data, model_version)
+    probabilities, tier = cache.lookup(raw_key)
+    if probabilities is not None:
+        cache.record(tier)
+        return probabilities, model_version
+
+    input_arr = decode_fn(data)
+    decoded_key = tensor_key(input_arr, model_version)
+    probabilities, tier = cache.lookup(decoded_key)
+    cache.record(tier)
+    if probabilities is None:
+        probabilities, version = predict_fn(input_arr)
+        if version != model_version:
+            model_version = version
+            raw_key, decoded_key = bytes_key(data, version), tensor_key(input_arr, version)
+    cache.put([raw_key, decoded_key], probabilities)
+    return probabilities, model_version
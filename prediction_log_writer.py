@@ -0,0 +1,247 @@
+# prediction_log_writer.py
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+
+import db_client
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Log Writer Settings
+LOG_QUEUE_SIZE = int(os.getenv("PREDICTION_LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("PREDICTION_LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("PREDICTION_LOG_FLUSH_INTERVAL", "1.0"))  # seconds
+LOG_ENQUEUE_TIMEOUT = float(os.getenv("PREDICTION_LOG_ENQUEUE_TIMEOUT", "0"))  # >0 applies backpressure
+LOG_SPILL_PATH = os.getenv("PREDICTION_LOG_SPILL_PATH", "prediction_logs.spill.jsonl")
+LOG_RETRY_INTERVAL = float(os.getenv("PREDICTION_LOG_RETRY_INTERVAL", "30"))  # seconds between spill replays
+
+# Per-document write errors worth retrying (server stepping down, shutting down, timing out);
+# any other code is a rejected document and retrying it would fail the same way
+DUPLICATE_KEY = 11000
+TRANSIENT_WRITE_CODES = {6, 7, 50, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    if isinstance(value, dict) and "$oid" in value:
+        return ObjectId(value["$oid"])
+    return value
+
+
+# The _id insert_many assigned is kept, so a replay of documents that did reach Mongo is a duplicate key
+def _encode(doc):
+    return json.dumps({k: _encode_value(v) for k, v in doc.items()})
+
+
+def _decode(line):
+    return {k: _decode_value(v) for k, v in json.loads(line).items()}
+
+
+# Split an unordered BulkWriteError into (indexes to retry, indexes rejected); duplicates are already written
+def _classify_write_errors(error):
+    retry, rejected = set(), set()
+    for write_error in error.details.get("writeErrors", []):
+        code = write_error.get("code")
+        if code in TRANSIENT_WRITE_CODES:
+            retry.add(write_error["index"])
+        elif code != DUPLICATE_KEY:
+            rejected.add(write_error["index"])
+    return retry, rejected
+
+
+# Background sink: the request path only enqueues; a writer thread batches documents into insert_many
+class PredictionLogWriter:
+    def __init__(self, collection_name="prediction_logs", queue_size=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, enqueue_timeout=LOG_ENQUEUE_TIMEOUT, spill_path=LOG_SPILL_PATH):
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.spill_path = spill_path
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"enqueued": 0, "dropped": 0, "written": 0, "batches": 0, "write_errors": 0,
+                       "spilled": 0, "replayed": 0}
+        self._last_replay_attempt = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="prediction-log-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
+        if key in ("dropped", "spilled", "write_errors") and n:
+            metrics.inc(f"app_prediction_log_{key}_total", n)
+
+    # Enqueue: never blocks longer than enqueue_timeout; drops (and counts) when the queue is full
+    def write(self, doc):
+        try:
+            if self.enqueue_timeout > 0:
+                self._queue.put(doc, timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(doc)
+            self._count("enqueued")
+            return True
+        except queue.Full:
+            self._count("dropped")
+            return False
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._maybe_replay_spill()
+                continue
+            # Give a trickle of logs a moment to accumulate into one insert_many
+            if self._queue.qsize() < self.batch_size and not self._stop.is_set():
+                time.sleep(min(self.flush_interval, 0.05))
+            self._flush(self._drain(first))
+            self._maybe_replay_spill()
+
+    def _flush(self, batch):
+        try:
+            with metrics.timer("app_db_query_seconds", query="prediction_log_insert_many"):
+                db_client.get_collection(self.collection_name).insert_many(batch, ordered=False)
+            self._count("written", len(batch))
+            self._count("batches")
+        except BulkWriteError as e:
+            # Unordered insert: everything except the listed indexes made it in
+            retry, rejected = _classify_write_errors(e)
+            self._count("write_errors")
+            self._count("batches")
+            self._count("written", len(batch) - len(retry) - len(rejected))
+            if rejected:
+                self._count("dropped", len(rejected))
+                logger.error("Prediction log write rejected %d of %d records, dropping them: %s",
+                             len(rejected), len(batch), e)
+            if retry:
+                logger.warning("Prediction log write failed for %d of %d records, spilling them: %s",
+                               len(retry), len(batch), e)
+                self._spill([doc for i, doc in enumerate(batch) if i in retry])
+        except PyMongoError as e:
+            # Connection loss, failover, timeouts, write concern: the whole batch is retried from the spill file
+            self._count("write_errors")
+            logger.warning("Prediction log write failed, spilling %d records: %s", len(batch), e)
+            self._spill(batch)
+        except Exception:
+            # Not a Mongo error (e.g. a document BSON can't encode): retrying can't help
+            self._count("write_errors")
+            self._count("dropped", len(batch))
+            logger.exception("Prediction log write failed, dropping %d records", len(batch))
+
+    # Spill: append-only local file used while Mongo is unreachable
+    def _spill(self, batch):
+        if not self.spill_path:
+            self._count("dropped", len(batch))
+            return
+        with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as f:
+            for doc in batch:
+                f.write(_encode(doc) + "\n")
+        self._count("spilled", len(batch))
+
+    # Replay: new spill records are appended to any .replaying file a crashed or failed replay left behind,
+    # so nothing already on disk is overwritten
+    def _maybe_replay_spill(self):
+        now = time.monotonic()
+        if not self.spill_path or now - self._last_replay_attempt < LOG_RETRY_INTERVAL:
+            return
+        self._last_replay_attempt = now
+        replay_path = self.spill_path + ".replaying"
+        with self._spill_lock:
+            if os.path.exists(self.spill_path):
+                if os.path.exists(replay_path):
+                    with open(self.spill_path, encoding="utf-8") as src, open(replay_path, "a", encoding="utf-8") as dst:
+                        for line in src:
+                            dst.write(line if line.endswith("\n") else line + "\n")
+                    os.remove(self.spill_path)
+                else:
+                    os.replace(self.spill_path, replay_path)
+            elif not os.path.exists(replay_path):
+                return
+        with open(replay_path, encoding="utf-8") as f:
+            docs = [_decode(line) for line in f if line.strip()]
+        failed = []
+        collection = db_client.get_collection(self.collection_name)
+        for start in range(0, len(docs), self.batch_size):
+            batch = docs[start:start + self.batch_size]
+            try:
+                collection.insert_many(batch, ordered=False)
+                self._count("replayed", len(batch))
+            except BulkWriteError as e:
+                retry, rejected = _classify_write_errors(e)
+                self._count("write_errors")
+                self._count("replayed", len(batch) - len(retry) - len(rejected))
+                if rejected:
+                    self._count("dropped", len(rejected))
+                    logger.error("Replaying spilled prediction logs: %d records rejected, dropping them: %s",
+                                 len(rejected), e)
+                failed.extend(doc for i, doc in enumerate(batch) if i in retry)
+            except PyMongoError as e:
+                self._count("write_errors")
+                logger.warning("Replaying spilled prediction logs failed, keeping %d records: %s",
+                               len(docs) - start, e)
+                failed.extend(docs[start:])
+                break
+            except Exception:
+                self._count("write_errors")
+                self._count("dropped", len(batch))
+                logger.exception("Replaying spilled prediction logs: dropping %d records", len(batch))
+        if failed:
+            self._spill(failed)
+        os.remove(replay_path)
+
+    # Flush on shutdown: drain the queue and wait for the writer thread
+    def close(self, timeout=10.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["queue_depth"] = self._queue.qsize()
+        return s
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+# Get Writer (one background writer per process, flushed at interpreter exit)
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = PredictionLogWriter()
+                atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,200 @@
+# preprocessing.py
+
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+# Shared by the app, the bulk/benchmark tools and the notebooks so train/serve preprocessing can't drift
+IMAGE_SIZE = (128, 128)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+PREPROCESS_THREADS = int(os.getenv("PREPROCESS_THREADS", str(min(8, os.cpu_count() or 1))))
+
+# JPEGs at least this many times the target size are downscaled in the DCT domain while decoding (draft)
+DRAFT_MIN_RATIO = 4
+
+
+def _open(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def _resize_axis(in_size, out_size):
+    source = (np.arange(out_size) + 0.5) * (in_size / out_size) - 0.5
+    lower = np.floor(source)
+    weight = (source - lower).astype(np.float32)
+    return (np.clip(lower, 0, in_size - 1).astype(np.intp), np.clip(lower + 1, 0, in_size - 1).astype(np.intp),
+            weight)
+
+
+# Resize Bilinear: tf.image.resize(method="bilinear") as image_dataset_from_directory used it in training
+# (half-pixel centers, no antialiasing). PIL's BILINEAR widens its filter when downscaling (antialiased),
+# which gives the model visibly different inputs, e.g. for the 256px dataset images.
+def resize_bilinear(pixels, size=IMAGE_SIZE):
+    y0, y1, wy = _resize_axis(pixels.shape[0], size[1])
+    x0, x1, wx = _resize_axis(pixels.shape[1], size[0])
+    pixels = pixels.astype(np.float32)
+    wx = wx[:, np.newaxis]
+    top = pixels[y0][:, x0] * (1 - wx) + pixels[y0][:, x1] * wx
+    bottom = pixels[y1][:, x0] * (1 - wx) + pixels[y1][:, x1] * wx
+    wy = wy[:, np.newaxis, np.newaxis]
+    return top * (1 - wy) + bottom * wy
+
+
+# Decode Into: write one image straight into a slot of a preallocated (H, W, 3) uint8/float32 buffer
+@metrics.timed("app_stage_seconds", stage="decode")
+def decode_into(source, out, size=IMAGE_SIZE):
+    with _open(source) as image:
+        # JPEG only: a phone photo many times the target size is downscaled by libjpeg in the DCT domain while
+        # decoding (to at least twice the target), so 12 MP are never materialized. Training-size inputs skip
+        # it, since it changes the pixels the resize below sees.
+        if image.format == "JPEG" and image.width >= DRAFT_MIN_RATIO * size[0] \
+                and image.height >= DRAFT_MIN_RATIO * size[1]:
+            image.draft("RGB", (2 * size[0], 2 * size[1]))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        pixels = np.asarray(image)
+    if pixels.shape[:2] != (size[1], size[0]):
+        pixels = resize_bilinear(pixels, size)
+        if out.dtype.kind in "iu":
+            pixels = np.rint(pixels)
+    np.copyto(out, pixels, casting="unsafe")
+    return out
+
+
+# Decode Image: a fresh float32 array, for single requests that outlive the call (cache / batching queue)
+def decode_image(source, size=IMAGE_SIZE):
+    return decode_into(source, np.empty((size[1], size[0], 3), dtype=np.float32), size)
+
+
+# Batch Buffer: one reusable allocation per batch size and dtype, per thread
+class BatchBuffer:
+    def __init__(self, batch_size, dtype=np.float32, size=IMAGE_SIZE):
+        self.array = np.empty((batch_size, size[1], size[0], 3), dtype=dtype)
+        self.size = size
+
+    def __len__(self):
+        return self.array.shape[0]
+
+
+_local = threading.local()
+
+
+def get_buffer(batch_size, dtype=np.float32, size=IMAGE_SIZE):
+    buffers = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    key = (batch_size, np.dtype(dtype).str, size)
+    if key not in buffers:
+        buffers[key] = BatchBuffer(batch_size, dtype, size)
+    return buffers[key]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PREPROCESS_THREADS, thread_name_prefix="preprocess")
+    return _executor
+
+
+# Decode Batch: decode sources in parallel (PIL releases the GIL while decoding) into buffer rows.
+# Returns (view of the filled rows, list of per-row errors or None).
+def decode_batch(sources, out=None, executor=None, size=IMAGE_SIZE):
+    if out is None:
+        out = get_buffer(len(sources), size=size).array
+    executor = executor or get_executor()
+
+    def work(i, source):
+        try:
+            decode_into(source, out[i], size)
+            return None
+        except Exception as e:
+            out[i] = 0
+            return str(e)
+
+    futures = [executor.submit(work, i, source) for i, source in enumerate(sources)]
+    errors = [future.result() for future in futures]
+    return out[:len(sources)], errors
+
+
+# Directory Batches: (images, labels, paths) over a class-per-folder directory like train/ or valid/,
+# in the same sorted class order image_dataset_from_directory uses
+def list_directory(directory):
+    class_names = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    paths, labels = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        for root, _, files in os.walk(class_dir):
+            for file_name in sorted(files):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, file_name))
+                    labels.append(label)
+    return class_names, paths, np.asarray(labels, dtype=np.int64)
+
+
+def iter_directory_batches(directory, batch_size=256, size=IMAGE_SIZE):
+    _, paths, labels = list_directory(directory)
+    buffer = np.empty((batch_size, size[1], size[0], 3), dtype=np.float32)
+    for start in range(0, len(paths), batch_size):
+        batch_paths = paths[start:start + batch_size]
+        images, _ = decode_batch(batch_paths, out=buffer, size=size)
+        yield images, labels[start:start + batch_size], batch_paths
+
+
+# Parity Check: this module's decode against the TF decode/resize path the model was trained on, per image
+# (max/mean absolute pixel difference) and, with a model, top-1 agreement of the two inputs
+def parity_check(directory, samples=500, model_path=None, batch_size=32):
+    import tensorflow as tf
+
+    paths = sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                   for name in names if name.lower().endswith(IMAGE_EXTENSIONS))[:samples]
+    entry = None
+    if model_path:
+        import model_registry
+        entry = model_registry.get_entry(model_path)
+    max_diff, diff_sum, agree, total = 0.0, 0.0, 0, 0
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        ours = np.stack([decode_image(path) for path in chunk])
+        reference = np.stack([
+            tf.image.resize(tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False),
+                            (IMAGE_SIZE[1], IMAGE_SIZE[0]), method="bilinear").numpy()
+            for path in chunk])
+        diff = np.abs(ours - reference)
+        max_diff = max(max_diff, float(diff.max()))
+        diff_sum += float(diff.mean()) * len(chunk)
+        if entry is not None:
+            agree += int(np.sum(np.argmax(entry.predict(ours), axis=1) == np.argmax(entry.predict(reference), axis=1)))
+        total += len(chunk)
+    report = {"images": total, "max_abs_diff": max_diff, "mean_abs_diff": diff_sum / total if total else None}
+    if entry is not None:
+        report["top1_agreement"] = agree / total if total else None
+    return report
+
+
+def main():
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compare this preprocessing against the TF training decode path.")
+    parser.add_argument("directory", help="Images to compare, e.g. test/test")
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--model", default=None, help="Also report top-1 agreement for this model")
+    args = parser.parse_args()
+    print(json.dumps(parity_check(args.directory, args.samples, args.model), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# startup_benchmark.py
+
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import warmup
+from benchmark import environment_info
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ("tensorflow", "numpy", "pandas", "pymongo", "PIL")
+
+# Runs in a fresh interpreter: import the given modules in order, then report time, RSS and what got loaded
+_CHILD = r"""
+import json, os, sys, time
+sys.path.insert(0, sys.argv[1])
+os.chdir(sys.argv[1])
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, AttributeError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+result = {"rss_before_mb": rss_mb(), "modules": {}, "errors": {}}
+started = time.perf_counter()
+for name in json.loads(sys.argv[2]):
+    t = time.perf_counter()
+    try:
+        __import__(name)
+    except Exception as e:
+        result["errors"][name] = f"{type(e).__name__}: {e}"
+    result["modules"][name] = time.perf_counter() - t
+if sys.argv[3] == "1":
+    t = time.perf_counter()
+    try:
+        import model_registry
+        model_registry.warm_up()
+    except Exception as e:
+        result["errors"]["model_load"] = f"{type(e).__name__}: {e}"
+    result["model_load_s"] = time.perf_counter() - t
+result["import_s"] = time.perf_counter() - started
+result["rss_mb"] = rss_mb()
+result["loaded"] = {name: name in sys.modules for name in json.loads(sys.argv[4])}
+result["module_count"] = len(sys.modules)
+print(json.dumps(result))
+"""
+
+
+# Module-level imports of an app script (imports nested in page branches or functions are lazy)
+def top_level_imports(script):
+    with open(os.path.join(APP_DIR, script), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def scenarios():
+    main_imports = top_level_imports("main.py")
+    admin_imports = top_level_imports("admin.py")
+    # Under PREWARM_MODEL=startup the background pre-warm follows the very first render, Login included
+    prewarm_on_first_render = warmup.PREWARM_MODEL == "startup"
+    return {
+        # What a Login/Register render pays with the configured PREWARM_MODEL
+        "main_startup": (main_imports + (["prediction"] if prewarm_on_first_render else []), prewarm_on_first_render),
+        "admin_startup": (admin_imports, False),
+        # First render after login (the background pre-warm under the default "session" mode) or
+        # first Disease Recognition visit
+        "disease_recognition": (main_imports + ["prediction", "bulk_predict"], True),
+        # The old layout, for comparison: TensorFlow/NumPy and pandas imported at app start
+        "eager_main": (main_imports + ["numpy", "tensorflow", "prediction", "bulk_predict"], False),
+        "eager_admin": (admin_imports + ["pandas"], False),
+    }
+
+
+def run_scenario(modules, load_model, repeats):
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.check_output(
+            [sys.executable, "-c", _CHILD, APP_DIR, json.dumps(modules), "1" if load_model else "0",
+             json.dumps(HEAVY_MODULES)],
+            text=True,
+        )
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    summary = {
+        "modules": modules,
+        "import_s": statistics.median(r["import_s"] for r in runs),
+        "rss_mb": statistics.median(r["rss_mb"] for r in runs),
+        "module_count": runs[-1]["module_count"],
+        "loaded": runs[-1]["loaded"],
+        "errors": runs[-1]["errors"],
+        # Slowest imports in the last run
+        "top_modules": dict(sorted(runs[-1]["modules"].items(), key=lambda item: -item[1])[:5]),
+    }
+    if load_model:
+        summary["model_load_s"] = statistics.median(r["model_load_s"] for r in runs)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app cold-start import time and RSS per scenario.")
+    parser.add_argument("--scenario", action="append", help="Scenario(s) to run (default: all)")
+    parser.add_argument("--repeats", type=int, default=3, help="Fresh interpreters per scenario (median reported)")
+    parser.add_argument("-o", "--output", default="startup_results.json")
+    args = parser.parse_args()
+
+    available = scenarios()
+    print(f"PREWARM_MODEL={warmup.PREWARM_MODEL}")
+    results = {}
+    for name in args.scenario or list(available):
+        modules, load_model = available[name]
+        results[name] = run_scenario(modules, load_model, args.repeats)
+        r = results[name]
+        heavy = ", ".join(module for module, loaded in r["loaded"].items() if loaded) or "none"
+        extra = f", model load {r['model_load_s']:.2f}s" if load_model else ""
+        print(f"{name:20s} import {r['import_s']:6.2f}s  RSS {r['rss_mb']:7.1f} MB{extra}  heavy: {heavy}")
+        for module, error in r["errors"].items():
+            print(f"{'':20s} ! {module}: {error}")
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment_info(), "prewarm_model": warmup.PREWARM_MODEL, "results": results},
+                  f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# train.py
+
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Training Settings (CLI flags override these)
+TRAIN_STRATEGY = os.getenv("TRAIN_STRATEGY", "default")  # default | mirrored | multi-worker
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "checkpoints")
+
+
+# Threading has to be configured before TensorFlow runs its first op
+def configure_tensorflow(intra_op_threads, inter_op_threads, replicas):
+    import tensorflow as tf
+
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    if replicas > 1:
+        # Split the host CPU into logical devices so MirroredStrategy runs one replica per core group
+        cpu = tf.config.list_physical_devices("CPU")[0]
+        tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()] * replicas)
+    return tf
+
+
+def cpu_supports_bfloat16():
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def make_strategy(tf, name, replicas):
+    if name == "mirrored":
+        devices = [device.name for device in tf.config.list_logical_devices("CPU")][:max(replicas, 1)]
+        return tf.distribute.MirroredStrategy(devices=devices)
+    if name == "multi-worker":
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    return tf.distribute.get_strategy()
+
+
+# Same architecture as Train_plant_disease.ipynb; the output layer stays float32 under mixed precision
+def build_model(tf, num_classes, learning_rate):
+    from tensorflow.keras.layers import Conv2D, Dense, Dropout, Flatten, MaxPool2D
+
+    model = tf.keras.Sequential()
+    model.add(tf.keras.Input(shape=[128, 128, 3]))
+    for filters in (32, 64, 128, 256, 512):
+        model.add(Conv2D(filters=filters, kernel_size=3, padding='same', activation='relu'))
+        model.add(Conv2D(filters=filters, kernel_size=3, activation='relu'))
+        model.add(MaxPool2D(pool_size=2, strides=2))
+    model.add(Dropout(0.25))
+    model.add(Flatten())
+    model.add(Dense(units=1500, activation='relu'))
+    model.add(Dropout(0.4))
+    model.add(Dense(units=num_classes, activation='softmax', dtype='float32'))
+    compile_model(tf, model, learning_rate)
+    return model
+
+
+def compile_model(tf, model, learning_rate):
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss='categorical_crossentropy', metrics=['accuracy'])
+
+
+# Fine-tuning: continue from a trained model, optionally freezing the convolutional feature extractor
+def load_for_fine_tuning(tf, path, learning_rate, freeze_features):
+    model = tf.keras.models.load_model(path)
+    if freeze_features:
+        for layer in model.layers:
+            if isinstance(layer, tf.keras.layers.Flatten):
+                break
+            layer.trainable = False
+    compile_model(tf, model, learning_rate)
+    return model
+
+
+# Per-epoch seeds: epoch N always sees the same shuffle order and RNG streams, resumed or not
+def seed_everything(tf, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+
+# Batches per pass over the new images: the TFRecord/filtered pipelines report an unknown cardinality,
+# so fall back to the converted directory's metadata count, then to counting a raw image directory
+def fine_tune_batches(tf, training_data, new_images, data_dir, batch_size):
+    batches = int(tf.data.experimental.cardinality(new_images).numpy())
+    if batches > 0:
+        return batches
+    metadata = training_data.read_metadata(data_dir)
+    if metadata is not None:
+        count = metadata["count"]
+    else:
+        import preprocessing
+        count = len(preprocessing.list_directory(data_dir)[1])
+    return math.ceil(count / batch_size) if count else None
+
+
+def training_dataset(training_data, args, class_names, seed):
+    dataset = training_data.load_dataset(args.train_dir, batch_size=args.global_batch_size, seed=seed,
+                                         class_names=class_names)
+    if not args.fine_tune_dir:
+        return dataset
+    # New images mixed with a replay sample of the original data so earlier classes aren't forgotten
+    new_images = training_data.load_dataset(args.fine_tune_dir, batch_size=args.global_batch_size, seed=seed,
+                                            class_names=class_names)
+    if args.replay_fraction <= 0:
+        return new_images
+    import tensorflow as tf
+    steps = args.steps_per_epoch
+    if not steps:
+        new_batches = fine_tune_batches(tf, training_data, new_images, args.fine_tune_dir, args.global_batch_size)
+        steps = int(new_batches / (1 - args.replay_fraction)) if new_batches else None
+    if steps is None:
+        raise SystemExit("--steps-per-epoch is required when the size of --fine-tune-dir is unknown")
+    mixed = tf.data.Dataset.sample_from_datasets(
+        [new_images.repeat(), dataset.repeat()], weights=[1 - args.replay_fraction, args.replay_fraction],
+        seed=seed).take(steps)
+    mixed.class_names = class_names
+    return mixed
+
+
+class _Checkpoints:
+    def __init__(self, tf, directory, model, is_chief, worker_index):
+        # Non-chief workers must write somewhere else; only the chief's checkpoints are kept
+        self.directory = directory if is_chief else os.path.join(directory, f"worker_{worker_index}")
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, epoch=self.epoch)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, self.directory, max_to_keep=3)
+        self.state_path = os.path.join(self.directory, "state.json")
+
+    # Restore model, optimizer slots and epoch; returns (next_epoch, history so far)
+    def restore(self, model):
+        if not self.manager.latest_checkpoint:
+            return 0, {}
+        if hasattr(model.optimizer, "build"):
+            model.optimizer.build(model.trainable_variables)
+        self.checkpoint.restore(self.manager.latest_checkpoint)
+        history = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                history = json.load(f)["history"]
+        print(f"Resumed from {self.manager.latest_checkpoint} at epoch {int(self.epoch.numpy())}")
+        return int(self.epoch.numpy()), history
+
+    def save(self, epoch, history, args):
+        self.epoch.assign(epoch)
+        self.manager.save(checkpoint_number=epoch)
+        with open(self.state_path, "w") as f:
+            json.dump({"epoch": epoch, "seed": args.seed, "history": history}, f)
+
+
+def make_throughput_callback(tf, batch_size):
+    # Times only the training batches of an epoch; the validation pass is excluded
+    class Throughput(tf.keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.batches = 0
+            self.started = time.perf_counter()
+            self.seconds = None
+
+        def on_train_batch_end(self, batch, logs=None):
+            self.batches += 1
+
+        def on_test_begin(self, logs=None):
+            if self.seconds is None:
+                self.seconds = time.perf_counter() - self.started
+
+        def on_epoch_end(self, epoch, logs=None):
+            if self.seconds is None:
+                self.seconds = time.perf_counter() - self.started
+            self.images_per_second = self.batches * batch_size / self.seconds
+            self.epoch_seconds = time.perf_counter() - self.started
+
+    return Throughput()
+
+
+def _append(history, logs):
+    for key, value in logs.items():
+        history.setdefault(key, []).append(float(value))
+
+
+def train(args):
+    tf = configure_tensorflow(args.intra_op_threads, args.inter_op_threads,
+                              args.replicas if args.strategy == "mirrored" else 1)
+    import labels
+    import training_data
+
+    if args.mixed_precision == "bf16" or (args.mixed_precision == "auto" and cpu_supports_bfloat16()):
+        tf.keras.mixed_precision.set_global_policy("mixed_bfloat16")
+        print("Mixed precision: mixed_bfloat16")
+
+    strategy = make_strategy(tf, args.strategy, args.replicas)
+    args.global_batch_size = args.batch_size * strategy.num_replicas_in_sync
+    resolver = getattr(strategy, "cluster_resolver", None)
+    worker_index = resolver.task_id if resolver is not None and resolver.task_type else 0
+    is_chief = worker_index == 0
+
+    # Fine-tuning keeps the base model's label order; a fresh run takes it from the training data
+    if args.fine_tune_dir:
+        class_names = labels.load_class_names()
+    else:
+        class_names = training_data.load_dataset(args.train_dir, shuffle=False).class_names
+    valid = training_data.load_dataset(args.valid_dir, batch_size=args.global_batch_size, shuffle=False,
+                                       cache="memory", class_names=class_names)
+    with strategy.scope():
+        if args.fine_tune_dir:
+            model = load_for_fine_tuning(tf, args.base_model, args.learning_rate, args.freeze_features)
+        else:
+            model = build_model(tf, len(class_names), args.learning_rate)
+        checkpoints = _Checkpoints(tf, args.checkpoint_dir, model, is_chief, worker_index)
+        start_epoch, history = checkpoints.restore(model) if args.resume else (0, {})
+
+    throughput = make_throughput_callback(tf, args.global_batch_size)
+    for epoch in range(start_epoch, args.epochs):
+        seed_everything(tf, args.seed + epoch)
+        dataset = training_dataset(training_data, args, class_names, args.seed + epoch)
+        result = model.fit(dataset, validation_data=valid, initial_epoch=epoch, epochs=epoch + 1,
+                           steps_per_epoch=args.steps_per_epoch, callbacks=[throughput], verbose=2)
+        logs = {key: values[-1] for key, values in result.history.items()}
+        logs["images_per_second"] = throughput.images_per_second
+        logs["epoch_seconds"] = throughput.epoch_seconds
+        _append(history, logs)
+        print(f"Epoch {epoch + 1}: {logs['images_per_second']:.0f} images/s "
+              f"({strategy.num_replicas_in_sync} replicas, {logs['epoch_seconds']:.0f}s)")
+        checkpoints.save(epoch + 1, history, args)
+
+    if is_chief:
+        model.save(args.output)
+        if args.save_h5:
+            model.save(os.path.splitext(args.output)[0] + ".h5")
+        with open(args.history, "w") as f:
+            json.dump(history, f)
+        labels.save_class_names(class_names)
+        print(f"Model saved to {args.output}, history to {args.history}")
+
+
+# Local multi-worker run: one process per worker on this machine, wired together through TF_CONFIG
+def launch_local_workers(count, argv):
+    ports = []
+    for _ in range(count):
+        with socket.socket() as s:
+            s.bind(("localhost", 0))
+            ports.append(s.getsockname()[1])
+    cluster = {"worker": [f"localhost:{port}" for port in ports]}
+    processes = []
+    for index in range(count):
+        env = dict(os.environ, TF_CONFIG=json.dumps({"cluster": cluster, "task": {"type": "worker", "index": index}}))
+        processes.append(subprocess.Popen([sys.executable, __file__] + argv, env=env))
+    return max(process.wait() for process in processes)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train (or fine-tune) the plant disease CNN.")
+    parser.add_argument("--train-dir", default="data/train_tfrecord", help="Raw or converted (training_data.py) split")
+    parser.add_argument("--valid-dir", default="data/valid_tfrecord")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32, help="Per replica")
+    parser.add_argument("--learning-rate", type=float, default=None,
+                        help="Default 1e-4, or 1e-5 when fine-tuning")
+    parser.add_argument("--steps-per-epoch", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--strategy", choices=["default", "mirrored", "multi-worker"], default=TRAIN_STRATEGY)
+    parser.add_argument("--replicas", type=int, default=os.cpu_count() // 4 or 1,
+                        help="Logical CPU devices for --strategy mirrored")
+    parser.add_argument("--workers", type=int, default=1, help="Local worker processes for --strategy multi-worker")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="0 lets TensorFlow decide")
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--mixed-precision", choices=["off", "bf16", "auto"], default="off")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="Ignore existing checkpoints in --checkpoint-dir")
+    parser.add_argument("--fine-tune-dir", default=None, help="Newly labelled images (class-per-folder)")
+    parser.add_argument("--base-model", default="trained_model.keras", help="Model to fine-tune")
+    parser.add_argument("--replay-fraction", type=float, default=0.3,
+                        help="Share of fine-tuning batches drawn from --train-dir")
+    parser.add_argument("--freeze-features", action="store_true", help="Fine-tune only the dense head")
+    parser.add_argument("--output", default="trained_model.keras")
+    parser.add_argument("--save-h5", action="store_true", help="Also write the legacy .h5 file")
+    parser.add_argument("--history", default=None,
+                        help="Default training_hist.json, or fine_tune_hist.json when fine-tuning")
+    args = parser.parse_args(argv)
+    if args.learning_rate is None:
+        args.learning_rate = 1e-5 if args.fine_tune_dir else 1e-4
+    if args.history is None:
+        # A fine-tuning run must not replace the full training history (the notebook and export_model.py's
+        # accuracy baseline read training_hist.json)
+        args.history = "fine_tune_hist.json" if args.fine_tune_dir else "training_hist.json"
+    if args.fine_tune_dir:
+        # Never resume a fine-tuning run from a full training run's checkpoints (or vice versa)
+        args.checkpoint_dir = os.path.join(args.checkpoint_dir, "fine_tune")
+    return args
+
+
+# Convert the raw splits once, as the notebook does, when the converted directories don't exist yet
+def prepare_data(args):
+    import training_data
+
+    for source, converted in (("train", args.train_dir), ("valid", args.valid_dir)):
+        if not os.path.exists(converted) and os.path.isdir(source):
+            training_data.convert_if_needed(source, converted)
+
+
+def main():
+    args = parse_args()
+    prepare_data(args)
+    if args.strategy == "multi-worker" and args.workers > 1 and "TF_CONFIG" not in os.environ:
+        sys.exit(launch_local_workers(args.workers, sys.argv[1:]))
+    train(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# training_data.py
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+import preprocessing
+
+AUTOTUNE = tf.data.AUTOTUNE
+IMAGE_SIZE = preprocessing.IMAGE_SIZE
+METADATA_FILE = "metadata.json"
+
+
+def _write_metadata(out_dir, fmt, class_names, count, source_dir):
+    with open(os.path.join(out_dir, METADATA_FILE), "w") as f:
+        json.dump({"format": fmt, "class_names": class_names, "count": count, "source": source_dir,
+                   "image_size": list(IMAGE_SIZE)}, f, indent=2)
+
+
+def read_metadata(data_dir):
+    path = os.path.join(data_dir, METADATA_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# Convert to TFRecord: decode every image once at 128x128 and store raw uint8 pixels in shards.
+# Paths are shuffled before sharding so each shard holds a mix of classes.
+def convert_to_tfrecord(source_dir, out_dir, num_shards=32, batch_size=256, workers=4, seed=42):
+    class_names, paths, labels = preprocessing.list_directory(source_dir)
+    order = np.random.default_rng(seed).permutation(len(paths))
+    os.makedirs(out_dir, exist_ok=True)
+
+    def write_shard(shard):
+        indices = order[shard::num_shards]
+        shard_path = os.path.join(out_dir, f"shard-{shard:05d}-of-{num_shards:05d}.tfrecord")
+        buffer = np.empty((batch_size, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.uint8)
+        written = 0
+        with tf.io.TFRecordWriter(shard_path) as writer:
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start:start + batch_size]
+                images, errors = preprocessing.decode_batch([paths[i] for i in chunk], out=buffer)
+                for image, index, error in zip(images, chunk, errors):
+                    if error is not None:
+                        print(f"Skipping {paths[index]}: {error}")
+                        continue
+                    example = tf.train.Example(features=tf.train.Features(feature={
+                        "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+                        "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[int(labels[index])])),
+                    }))
+                    writer.write(example.SerializeToString())
+                    written += 1
+        return written
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        count = sum(executor.map(write_shard, range(num_shards)))
+    _write_metadata(out_dir, "tfrecord", class_names, count, source_dir)
+    return count
+
+
+# Convert to NumPy: one memory-mapped (N, 128, 128, 3) uint8 array plus labels
+def convert_to_numpy(source_dir, out_dir, batch_size=256):
+    class_names, paths, labels = preprocessing.list_directory(source_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    images = np.lib.format.open_memmap(os.path.join(out_dir, "images.npy"), mode="w+", dtype=np.uint8,
+                                       shape=(len(paths), IMAGE_SIZE[1], IMAGE_SIZE[0], 3))
+    for start in range(0, len(paths), batch_size):
+        preprocessing.decode_batch(paths[start:start + batch_size], out=images[start:start + batch_size])
+    images.flush()
+    np.save(os.path.join(out_dir, "labels.npy"), labels)
+    _write_metadata(out_dir, "numpy", class_names, len(paths), source_dir)
+    return len(paths)
+
+
+def convert_if_needed(source_dir, out_dir, fmt="tfrecord", **kwargs):
+    if read_metadata(out_dir) is not None:
+        return
+    started = time.perf_counter()
+    convert = convert_to_tfrecord if fmt == "tfrecord" else convert_to_numpy
+    count = convert(source_dir, out_dir, **kwargs)
+    print(f"Converted {count} images from {source_dir} to {out_dir} in {time.perf_counter() - started:.0f}s")
+
+
+def _parse_example(serialized):
+    features = tf.io.parse_single_example(serialized, {
+        "image": tf.io.FixedLenFeature([], tf.string),
+        "label": tf.io.FixedLenFeature([], tf.int64),
+    })
+    image = tf.reshape(tf.io.decode_raw(features["image"], tf.uint8), [IMAGE_SIZE[1], IMAGE_SIZE[0], 3])
+    return image, features["label"]
+
+
+# A seed makes the shuffled order reproducible (deterministic interleave), e.g. for resumed training
+def _tfrecord_dataset(data_dir, shuffle, seed=None):
+    deterministic = not shuffle or seed is not None
+    files = tf.data.Dataset.list_files(os.path.join(data_dir, "*.tfrecord"), shuffle=shuffle, seed=seed)
+    dataset = files.interleave(tf.data.TFRecordDataset, cycle_length=AUTOTUNE, num_parallel_calls=AUTOTUNE,
+                               deterministic=deterministic)
+    return dataset.map(_parse_example, num_parallel_calls=AUTOTUNE, deterministic=deterministic)
+
+
+def _numpy_dataset(data_dir):
+    images = np.load(os.path.join(data_dir, "images.npy"), mmap_mode="r")
+    labels = np.load(os.path.join(data_dir, "labels.npy"))
+
+    def gather(index):
+        return np.asarray(images[index]), labels[index]
+
+    def load(index):
+        image, label = tf.numpy_function(gather, [index], [tf.uint8, tf.int64])
+        image.set_shape([IMAGE_SIZE[1], IMAGE_SIZE[0], 3])
+        label.set_shape([])
+        return image, label
+
+    return tf.data.Dataset.range(len(labels)).map(load, num_parallel_calls=AUTOTUNE)
+
+
+# Load Dataset: drop-in for image_dataset_from_directory (float32 images in 0..255, categorical labels,
+# .class_names set) over a converted TFRecord/NumPy directory, or a raw image directory as a fallback.
+# cache: None, "memory", or a file path prefix for tf.data's on-disk cache.
+# class_names: label order to map onto, for directories holding only some of the classes (fine-tuning).
+def load_dataset(data_dir, batch_size=32, shuffle=True, cache=None, label_mode="categorical", seed=None,
+                 class_names=None):
+    metadata = read_metadata(data_dir)
+    if metadata is None:
+        dataset = tf.keras.utils.image_dataset_from_directory(
+            data_dir, labels="inferred", label_mode="int", color_mode="rgb", batch_size=32,
+            image_size=IMAGE_SIZE, shuffle=shuffle, seed=seed, interpolation="bilinear")
+        found_class_names = dataset.class_names
+        dataset = dataset.unbatch().map(lambda x, y: (tf.cast(x, tf.uint8), y), num_parallel_calls=AUTOTUNE)
+        count = None
+    else:
+        found_class_names = metadata["class_names"]
+        count = metadata["count"]
+        if metadata["format"] == "numpy":
+            dataset = _numpy_dataset(data_dir)
+        else:
+            dataset = _tfrecord_dataset(data_dir, shuffle, seed)
+
+    # Cache the compact uint8 pixels, before batching and the float32 cast
+    if cache == "memory":
+        dataset = dataset.cache()
+    elif cache:
+        os.makedirs(os.path.dirname(cache) or ".", exist_ok=True)
+        dataset = dataset.cache(cache)
+    if shuffle:
+        dataset = dataset.shuffle(min(count or 4096, 4096), seed=seed, reshuffle_each_iteration=True)
+
+    if class_names is not None and list(class_names) != list(found_class_names):
+        unknown = sorted(set(found_class_names) - set(class_names))
+        if unknown:
+            raise ValueError(f"{data_dir} has classes the model doesn't know: {', '.join(unknown)}")
+        mapping = tf.constant([list(class_names).index(name) for name in found_class_names], dtype=tf.int64)
+        dataset = dataset.map(lambda x, y: (x, tf.gather(mapping, tf.cast(y, tf.int64))), num_parallel_calls=AUTOTUNE)
+    class_names = list(class_names) if class_names is not None else found_class_names
+    num_classes = len(class_names)
+
+    def to_model_input(images, labels):
+        images = tf.cast(images, tf.float32)
+        if label_mode == "categorical":
+            labels = tf.one_hot(labels, num_classes)
+        return images, labels
+
+    dataset = dataset.batch(batch_size, num_parallel_calls=AUTOTUNE, deterministic=not shuffle or seed is not None)
+    dataset = dataset.map(to_model_input, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+    dataset.class_names = class_names
+    return dataset
+
+
+# Evaluation Dataset: large batches, no shuffling
+def evaluation_dataset(data_dir, batch_size=512, cache=None):
+    return load_dataset(data_dir, batch_size=batch_size, shuffle=False, cache=cache)
+
+
+# Predict Dataset: (y_pred, y_true) class indices in a single pass, for the confusion matrix
+def predict_dataset(model, dataset):
+    predicted, true = [], []
+    for images, labels in dataset:
+        predicted.append(np.argmax(model.predict_on_batch(images), axis=1))
+        labels = labels.numpy()
+        true.append(np.argmax(labels, axis=1) if labels.ndim == 2 else labels)
+    return np.concatenate(predicted), np.concatenate(true)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-convert an image directory for fast training/evaluation.")
+    parser.add_argument("source", help="Class-per-folder image directory, e.g. train or valid")
+    parser.add_argument("output", help="Output directory, e.g. data/train_tfrecord")
+    parser.add_argument("--format", choices=["tfrecord", "numpy"], default="tfrecord")
+    parser.add_argument("--shards", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.format == "tfrecord":
+        count = convert_to_tfrecord(args.source, args.output, num_shards=args.shards, workers=args.workers)
+    else:
+        count = convert_to_numpy(args.source, args.output)
+    print(f"Converted {count} images to {args.output} in {time.perf_counter() - started:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
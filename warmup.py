@@ -0,0 +1,57 @@
+# warmup.py
+
+import os
+import threading
+import time
+
+# Warm-up Settings
+# When to load the inference stack in the background: "session" (default) after a render for a logged-in
+# session, "startup" after any first render (Login included), "off" never (first Predict pays for it)
+PREWARM_MODEL = os.getenv("PREWARM_MODEL", "session").lower()
+PREWARM_MODEL = {"1": "startup", "0": "off"}.get(PREWARM_MODEL, PREWARM_MODEL)  # earlier on/off values
+
+_started = False
+_started_lock = threading.Lock()
+_ready = threading.Event()
+_status = {"import_s": None, "load_s": None, "remote": None, "error": None}
+
+
+# Imports NumPy, the inference engine/cache and the model backend (TensorFlow), then loads the model
+def _prewarm():
+    started = time.perf_counter()
+    try:
+        import prediction  # noqa: F401
+        import inference_client
+        import model_registry
+        _status["import_s"] = round(time.perf_counter() - started, 3)
+        # With the inference service up this process never needs the model itself
+        _status["remote"] = inference_client.remote_predictor() is not None
+        if not _status["remote"]:
+            model_registry.warm_up()
+        _status["load_s"] = round(time.perf_counter() - started - _status["import_s"], 3)
+    except Exception as e:
+        _status["error"] = str(e)
+        print(f"Model pre-warm failed: {e}")
+    finally:
+        _ready.set()
+
+
+# Start Background Pre-warm: once per process; pages that never predict never wait for it, and by default
+# processes that only ever serve the Login/Register pages never import TensorFlow at all
+def start_background_prewarm(logged_in=False):
+    global _started
+    if _started or PREWARM_MODEL not in ("session", "startup") or (PREWARM_MODEL == "session" and not logged_in):
+        return
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_prewarm, name="model-prewarm", daemon=True).start()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def status():
+    return dict(_status, ready=_ready.is_set(), started=_started, mode=PREWARM_MODEL)